@@ -1,8 +1,11 @@
 from torch.utils import data
-from typing import Tuple, Union, List
+from typing import Tuple, Union, List, Optional
+from data.datasets.decoded_cache import DecodedCache
+from data.datasets.encoded_frames import EncodedFrames
 import numpy as np
 import json
 import math
+import random
 import cv2
 import h5py
 import os
@@ -35,16 +38,22 @@ class CaterSample(data.Dataset):
                 frames.append(os.path.join(data_path, file))
 
         frames.sort()
-        self.imgs = []
-        for path in frames:
-            self.imgs.append(RamImage(path))
 
-    def get_data(self):
+        # file paths until the dataset writes them into its encoded frame blob
+        self.imgs = frames
 
-        frames = np.zeros((301,3,self.size[1], self.size[0]),dtype=np.float32)
-        for i in range(len(self.imgs)):
-            img = self.imgs[i].to_numpy()
-            frames[i] = img.transpose(2, 0, 1).astype(np.float32) / 255.0
+    def get_data(self, decoded: Optional[np.ndarray] = None, uint8: bool = False, window: slice = slice(0, 301, 1)):
+
+        # only the frames of the window are decoded
+        frames = np.zeros((len(range(window.start, window.stop, window.step)),3,self.size[1], self.size[0]),dtype=np.uint8 if uint8 else np.float32)
+        if decoded is not None:
+            decoded = decoded[window].transpose(0, 3, 1, 2)
+            frames[:len(decoded)] = decoded if uint8 else decoded.astype(np.float32) / 255.0
+            return frames
+
+        for i, img in enumerate(self.imgs[window]):
+            img = img.to_numpy().transpose(2, 0, 1)
+            frames[i] = img if uint8 else img.astype(np.float32) / 255.0
 
         return frames
 
@@ -52,7 +61,7 @@ class CaterSample(data.Dataset):
 class CaterDataset(data.Dataset):
 
     def save(self):
-        state = { 'samples': self.samples, 'labels': self.labels }
+        state = { 'samples': self.samples, 'labels': self.labels, 'label_arrays': self.label_arrays }
         with open(self.file, "wb") as outfile:
     	    pickle.dump(state, outfile)
 
@@ -61,8 +70,9 @@ class CaterDataset(data.Dataset):
             state = pickle.load(infile)
             self.samples = state['samples']
             self.labels  = state['labels']
+            self.label_arrays = state.get('label_arrays')
 
-    def __init__(self, root_path: str, dataset_name: str, type: str, size: Tuple[int, int]):
+    def __init__(self, root_path: str, dataset_name: str, type: str, size: Tuple[int, int], decoded: bool = False, uint8: bool = False, window: Optional[int] = None, stride: int = 1):
 
         data_path  = f'data/data/video/{dataset_name}'
         data_path  = os.path.join(root_path, data_path)
@@ -71,8 +81,9 @@ class CaterDataset(data.Dataset):
         self.val   = (type == "val")
         self.test  = (type == "test")
 
-        self.samples    = []
-        self.labels     = []
+        self.samples      = []
+        self.labels       = []
+        self.label_arrays = None
 
         if os.path.exists(self.file):
             self.load()
@@ -101,14 +112,29 @@ class CaterDataset(data.Dataset):
 
                 print(f"Loading CATER {type} [{i * 100 / num_samples:.2f}]", flush=True)
 
+        # caches of RamImage lists are converted to the encoded frame blob
+        if self.samples and not isinstance(self.samples[0].imgs, EncodedFrames):
+            sequences = [[img if isinstance(img, str) else img.img_raw for img in sample.imgs] for sample in self.samples]
+            for sample, imgs in zip(self.samples, EncodedFrames.write(self.file.replace('.pickle', '.frames'), sequences)):
+                sample.imgs = imgs
             self.save()
+
+        self.uint8   = uint8
+        self.window  = window
+        self.stride  = stride
+        self.decoded = None
+        if decoded:
+            decoded_file = self.file.replace('.pickle', '.decoded')
+            if not DecodedCache.exists(decoded_file):
+                DecodedCache.build(decoded_file, [sample.imgs for sample in self.samples], size)
+            self.decoded = DecodedCache(decoded_file)
         
         self.length     = len(self.samples)
         self.background = None
         if "background.jpg" in os.listdir(data_path):
             self.background = cv2.imread(os.path.join(data_path, "background.jpg"))
             self.background = cv2.resize(self.background, dsize=size, interpolation=cv2.INTER_CUBIC)
-            self.background = self.background.transpose(2, 0, 1).astype(np.float32) / 255.0
+            self.background = self.background.transpose(2, 0, 1) if uint8 else self.background.transpose(2, 0, 1).astype(np.float32) / 255.0
             self.background = self.background.reshape(1, self.background.shape[0], self.background.shape[1], self.background.shape[2])
 
         print(f"CaterDataset[{type}]: {self.length}")
@@ -209,6 +235,44 @@ class CaterDataset(data.Dataset):
             'cone_green':      31,
         }
 
+        # computed once, caches written before the label arrays existed are updated
+        if self.label_arrays is None:
+            self.label_arrays = self.build_label_arrays()
+            self.save()
+
+    def build_label_arrays(self):
+        """Labels of all samples as compact arrays (num_samples, 301, ...), sliced at fetch time."""
+        num    = len(self.labels)
+        arrays = {
+            'snitch_positions':  np.zeros((num, 301, 3),  dtype=np.float16),
+            'snitch_label':      np.zeros((num,),         dtype=np.uint8),
+            'snitch_contained':  np.zeros((num, 301),     dtype=np.uint8),
+            'actions_visible':   np.zeros((num, 301, 14), dtype=np.uint8),
+            'actions_hidden':    np.zeros((num, 301, 14), dtype=np.uint8),
+            'materials_visible': np.zeros((num, 301, 8),  dtype=np.uint8),
+            'materials_hidden':  np.zeros((num, 301, 8),  dtype=np.uint8),
+            'sizes_visible':     np.zeros((num, 301, 12), dtype=np.uint8),
+            'sizes_hidden':      np.zeros((num, 301, 12), dtype=np.uint8),
+            'colors_visible':    np.zeros((num, 301, 32), dtype=np.uint8),
+            'colors_hidden':     np.zeros((num, 301, 32), dtype=np.uint8),
+        }
+
+        for i, label in enumerate(self.labels):
+            positions = self.snitch_position(label)[:301]
+            arrays['snitch_positions'][i, :len(positions)] = positions
+            arrays['snitch_label'][i]     = self.localize_label(label)
+            arrays['snitch_contained'][i] = self.snitch_contained(label)
+
+            arrays['actions_visible'][i],   arrays['actions_hidden'][i]   = self.actions_over_time(label)
+            arrays['materials_visible'][i], arrays['materials_hidden'][i] = self.materials_over_time(label)
+            arrays['sizes_visible'][i],     arrays['sizes_hidden'][i]     = self.sizes_over_time(label)
+            arrays['colors_visible'][i],    arrays['colors_hidden'][i]    = self.colors_over_time(label)
+
+            if i % 100 == 0:
+                print(f"Computing CATER labels [{i * 100 / num:.2f}]", flush=True)
+
+        return arrays
+
     def project_3d_point(self, pts):
         """
         Args:     pts: Nx3 matrix, with the 3D coordinates of the points to convert
@@ -357,25 +421,42 @@ class CaterDataset(data.Dataset):
         
         return color_visible, color_hidden
 
+    def get_window(self) -> slice:
+        """Frames of a sample: a random window of `window` frames every `stride` frames for training, the first one otherwise."""
+        if self.window is None:
+            return slice(0, 301, 1)
+
+        span  = (self.window - 1) * self.stride + 1
+        start = random.randint(0, max(301 - span, 0)) if self.train else 0
+        return slice(start, start + span, self.stride)
+
+    def get_data(self, index: int, window: slice):
+        return self.samples[index].get_data(self.decoded.sequence(index) if self.decoded is not None else None, self.uint8, window)
+
     def __len__(self):
         return self.length
 
     def __getitem__(self, index: int):
 
-        label = self.labels[index]
-
-        snitch_positions  = self.snitch_position(label)
-        snitch_label      = self.localize_label(label)
-        snitch_contained  = self.snitch_contained(label)
-
-        actions_visible,   actions_hidden   = self.actions_over_time(label)
-        materials_visible, materials_hidden = self.materials_over_time(label)
-        sizes_visible,     sizes_hidden     = self.sizes_over_time(label)
-        colors_visible,    colors_hidden    = self.colors_over_time(label)
+        labels = self.label_arrays
+        window = self.get_window()
+
+        snitch_positions  = labels['snitch_positions'][index, window].astype(np.float32)
+        snitch_label      = np.int64(labels['snitch_label'][index])
+        snitch_contained  = labels['snitch_contained'][index, window].astype(np.float32)
+
+        actions_visible   = labels['actions_visible'][index, window].astype(np.float32)
+        actions_hidden    = labels['actions_hidden'][index, window].astype(np.float32)
+        materials_visible = labels['materials_visible'][index, window].astype(np.float32)
+        materials_hidden  = labels['materials_hidden'][index, window].astype(np.float32)
+        sizes_visible     = labels['sizes_visible'][index, window].astype(np.float32)
+        sizes_hidden      = labels['sizes_hidden'][index, window].astype(np.float32)
+        colors_visible    = labels['colors_visible'][index, window].astype(np.float32)
+        colors_hidden     = labels['colors_hidden'][index, window].astype(np.float32)
         
         if self.background is not None:
             return (
-                self.samples[index].get_data(),
+                self.get_data(index, window),
                 self.background,
                 snitch_positions, 
                 snitch_label,
@@ -391,7 +472,7 @@ class CaterDataset(data.Dataset):
             )
 
         return (
-            self.samples[index].get_data(),
+            self.get_data(index, window),
             self.background,
             snitch_positions, 
             snitch_label,
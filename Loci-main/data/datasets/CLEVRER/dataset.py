@@ -1,8 +1,11 @@
 from torch.utils import data
-from typing import Tuple, Union, List
+from typing import Tuple, Union, List, Optional
+from data.datasets.decoded_cache import DecodedCache
+from data.datasets.encoded_frames import EncodedFrames
 import numpy as np
 import json
 import math
+import random
 import cv2
 import h5py
 import os
@@ -35,16 +38,22 @@ class ClevrerSample(data.Dataset):
                 frames.append(os.path.join(data_path, file))
 
         frames.sort()
-        self.imgs = []
-        for path in frames:
-            self.imgs.append(RamImage(path))
 
-    def get_data(self):
+        # file paths until the dataset writes them into its encoded frame blob
+        self.imgs = frames
 
-        frames = np.zeros((128,3,self.size[1], self.size[0]),dtype=np.float32)
-        for i in range(len(self.imgs)):
-            img = self.imgs[i].to_numpy()
-            frames[i] = img.transpose(2, 0, 1).astype(np.float32) / 255.0
+    def get_data(self, decoded: Optional[np.ndarray] = None, uint8: bool = False, window: slice = slice(0, 128, 1)):
+
+        # only the frames of the window are decoded
+        frames = np.zeros((len(range(window.start, window.stop, window.step)),3,self.size[1], self.size[0]),dtype=np.uint8 if uint8 else np.float32)
+        if decoded is not None:
+            decoded = decoded[window].transpose(0, 3, 1, 2)
+            frames[:len(decoded)] = decoded if uint8 else decoded.astype(np.float32) / 255.0
+            return frames
+
+        for i, img in enumerate(self.imgs[window]):
+            img = img.to_numpy().transpose(2, 0, 1)
+            frames[i] = img if uint8 else img.astype(np.float32) / 255.0
 
         return frames
 
@@ -59,7 +68,7 @@ class ClevrerDataset(data.Dataset):
         with open(self.file, "rb") as infile:
             self.samples = pickle.load(infile)
 
-    def __init__(self, root_path: str, dataset_name: str, type: str, size: Tuple[int, int]):
+    def __init__(self, root_path: str, dataset_name: str, type: str, size: Tuple[int, int], decoded: bool = False, uint8: bool = False, window: Optional[int] = None, stride: int = 1):
 
         data_path  = f'data/data/video/{dataset_name}'
         data_path  = os.path.join(root_path, data_path)
@@ -80,14 +89,29 @@ class ClevrerDataset(data.Dataset):
 
                 print(f"Loading CLEVRER [{i * 100 / num_samples:.2f}]", flush=True)
 
+        # caches of RamImage lists are converted to the encoded frame blob
+        if self.samples and not isinstance(self.samples[0].imgs, EncodedFrames):
+            sequences = [[img if isinstance(img, str) else img.img_raw for img in sample.imgs] for sample in self.samples]
+            for sample, imgs in zip(self.samples, EncodedFrames.write(self.file.replace('.pickle', '.frames'), sequences)):
+                sample.imgs = imgs
             self.save()
+
+        self.uint8   = uint8
+        self.window  = window
+        self.stride  = stride
+        self.decoded = None
+        if decoded:
+            decoded_file = self.file.replace('.pickle', '.decoded')
+            if not DecodedCache.exists(decoded_file):
+                DecodedCache.build(decoded_file, [sample.imgs for sample in self.samples], size)
+            self.decoded = DecodedCache(decoded_file)
         
         self.length     = len(self.samples)
         self.background = None
         if "background.jpg" in os.listdir(data_path):
             self.background = cv2.imread(os.path.join(data_path, "background.jpg"))
             self.background = cv2.resize(self.background, dsize=size, interpolation=cv2.INTER_CUBIC)
-            self.background = self.background.transpose(2, 0, 1).astype(np.float32) / 255.0
+            self.background = self.background.transpose(2, 0, 1) if uint8 else self.background.transpose(2, 0, 1).astype(np.float32) / 255.0
             self.background = self.background.reshape(1, self.background.shape[0], self.background.shape[1], self.background.shape[2])
 
         print(f"ClevrerDataset: {self.length}")
@@ -95,6 +119,15 @@ class ClevrerDataset(data.Dataset):
         if len(self) == 0:
             raise FileNotFoundError(f'Found no dataset at {self.data_path}')
 
+    def get_window(self) -> slice:
+        """Frames of a sample: a random window of `window` frames every `stride` frames for training, the first one otherwise."""
+        if self.window is None:
+            return slice(0, 128, 1)
+
+        span  = (self.window - 1) * self.stride + 1
+        start = random.randint(0, max(128 - span, 0)) if self.train else 0
+        return slice(start, start + span, self.stride)
+
     def __len__(self):
         if self.train:
             return int(self.length * 0.9)
@@ -107,6 +140,6 @@ class ClevrerDataset(data.Dataset):
             index += int(self.length * 0.9)
         
         return (
-            self.samples[index].get_data(),
+            self.samples[index].get_data(self.decoded.sequence(index) if self.decoded is not None else None, self.uint8, self.get_window()),
             self.background,
         )
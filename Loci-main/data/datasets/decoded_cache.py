@@ -0,0 +1,58 @@
+"""
+Decoded uint8 frame cache shared by the CATER, CLEVRER and video datasets.
+
+The encoded frames of all sequences of a dataset are decoded once into a single uint8 memmap (num_frames, H, W, 3)
+next to the dataset cache, together with the frame offsets of every sequence. Fetching a sequence is then a
+zero-copy slice of the memmap instead of one cv2.imdecode per frame and epoch.
+"""
+
+from typing import List, Tuple
+import numpy as np
+import os
+
+
+class DecodedCache:
+    def __init__(self, file: str):
+
+        self.file    = file
+        self.offsets = np.load(f'{file}.offsets.npy')
+        self.frames  = None
+
+    @staticmethod
+    def exists(file: str) -> bool:
+        # the offsets are written last, so an interrupted build is redone
+        return os.path.exists(f'{file}.offsets.npy') and os.path.exists(f'{file}.frames.npy')
+
+    @staticmethod
+    def build(file: str, sequences: List[list], size: Tuple[int, int]):
+        """Decode sequences of encoded images (anything with a to_numpy method) of size (W, H) into the cache."""
+        offsets = np.concatenate(([0], np.cumsum([len(sequence) for sequence in sequences]))).astype(np.int64)
+        frames  = np.lib.format.open_memmap(f'{file}.frames.npy', mode='w+', dtype=np.uint8,
+                                            shape=(int(offsets[-1]), size[1], size[0], 3))
+
+        for i, sequence in enumerate(sequences):
+            for j, img in enumerate(sequence):
+                frames[offsets[i] + j] = img.to_numpy()
+
+            if i % 100 == 0:
+                print(f"Decoding [{i * 100 / len(sequences):.2f}]", flush=True)
+
+        frames.flush()
+        del frames
+        np.save(f'{file}.offsets.npy', offsets)
+
+    def __getstate__(self):
+        # opened per worker, a memmap would be copied when the dataset is pickled
+        state = self.__dict__.copy()
+        state['frames'] = None
+        return state
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def sequence(self, index: int) -> np.ndarray:
+        """Frames (T, H, W, 3) of a sequence as a view into the memmap."""
+        if self.frames is None:
+            self.frames = np.load(f'{self.file}.frames.npy', mmap_mode='r')
+
+        return self.frames[self.offsets[index]:self.offsets[index + 1]]
@@ -0,0 +1,83 @@
+"""
+Encoded frames of a dataset in one contiguous file.
+
+The JPEG/PNG bytes of all frames are concatenated into `{file}.blob`, with the offset and length of every frame in
+`{file}.index.npy`. The blob is memory mapped once per process, so opening a dataset does not read it and forked
+DataLoader workers share its pages instead of copying millions of small Python buffers. Sequences are views of a
+range of the index and decode their frames on access, like the lists of RamImage they replace.
+"""
+
+from typing import List, Optional
+import numpy as np
+import cv2
+
+# memory maps of the blobs opened by this process
+BLOBS = {}
+
+
+class EncodedImage():
+    def __init__(self, frames: 'EncodedFrames', index: int):
+
+        self.frames = frames
+        self.index  = index
+
+    def to_numpy(self):
+        return cv2.imdecode(self.frames.raw(self.index), cv2.IMREAD_COLOR)
+
+
+class EncodedFrames():
+    def __init__(self, file: str, index: Optional[np.ndarray] = None):
+
+        self.file  = file
+        self.index = np.load(f'{file}.index.npy') if index is None else index
+
+    @staticmethod
+    def write(file: str, sequences: List[list]) -> List['EncodedFrames']:
+        """
+        Write the frames of all sequences, given as image file paths or encoded bytes, into one blob and return a view
+        of every sequence.
+        """
+        lengths = []
+        with open(f'{file}.blob', 'wb') as blob:
+            for i, sequence in enumerate(sequences):
+                for item in sequence:
+                    if isinstance(item, str):
+                        with open(item, 'rb') as fd:
+                            item = fd.read()
+
+                    blob.write(item)
+                    lengths.append(len(item))
+
+                if i % 100 == 0:
+                    print(f"Writing frames [{i * 100 / len(sequences):.2f}]", flush=True)
+
+        lengths = np.array(lengths, dtype=np.int64)
+        np.save(f'{file}.index.npy', np.stack((np.cumsum(lengths) - lengths, lengths), axis=1))
+
+        frames  = EncodedFrames(file)
+        offsets = np.concatenate(([0], np.cumsum([len(sequence) for sequence in sequences])))
+        return [frames[offsets[i]:offsets[i + 1]] for i in range(len(sequences))]
+
+    def raw(self, index: int) -> np.ndarray:
+        """Encoded bytes of a frame, a view into the memory mapped blob."""
+        if self.file not in BLOBS:
+            BLOBS[self.file] = np.memmap(f'{self.file}.blob', dtype=np.uint8, mode='r')
+
+        offset, length = self.index[index]
+        return BLOBS[self.file][offset:offset + length]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return EncodedFrames(self.file, self.index[index])
+
+        if index < -len(self) or index >= len(self):
+            raise IndexError(index)
+
+        return EncodedImage(self, index % len(self))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield EncodedImage(self, index)
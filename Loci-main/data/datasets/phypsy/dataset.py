@@ -0,0 +1,191 @@
+"""
+Dataset of trials generated with phypsy, read directly from its log.
+
+The _img frames of all trials are decoded once, resized to the Loci input size and stored as a single uint8 memmap
+(num_frames, H, W, 3) next to the log, together with an index of the frame offsets of every trial, the trial
+backgrounds phypsy extracts and the transition frames of the log. Items are windows of `time` frames of a trial,
+returned with the background of the trial as input[1] and the first transition frame of the window.
+"""
+
+from torch.utils import data
+from typing import Tuple, List, Optional
+import numpy as np
+import pandas as pd
+import ast
+import glob
+import cv2
+import os
+import re
+
+FRAME_FILE = re.compile(r'^img_(\d{4})\.(png|jpg)$')
+
+
+def resolve_path(path, data_path: str) -> Optional[str]:
+    """Paths in the log are relative to the directory phypsy ran in, or to the directory of a merged plan log."""
+    if not isinstance(path, str):
+        return None
+    root = os.path.dirname(os.path.dirname(os.path.abspath(data_path)))
+    for candidate in [path, os.path.join(data_path, path), os.path.join(root, path)]:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def list_img_frames(frames_dir: str) -> Tuple[List[str], Optional[str]]:
+    """Sorted _img frames of a trial and the avatar directory they were captured in."""
+    frames = []
+    for file in glob.glob(f'{frames_dir}/*') + glob.glob(f'{frames_dir}/*/*'):
+        if FRAME_FILE.match(os.path.basename(file)) and not re.fullmatch(r'\d+x\d+', os.path.basename(os.path.dirname(file))):
+            frames.append(file)
+    frames.sort(key=os.path.basename)
+    return frames, os.path.basename(os.path.dirname(frames[0])) if frames else None
+
+
+def find_background(frames_dir: str, trial_id: int, avatar_dir: Optional[str]) -> Optional[str]:
+    """
+    The background phypsy saved for a trial: frames/{ctrl}/{type}/{trial} maps to backgrounds/{ctrl}/{type}, and the
+    background of a tiled run is the one of the tile the frames were captured by.
+    """
+    trial_dir = os.path.normpath(frames_dir)
+    backgrounds_dir = os.path.dirname(trial_dir).replace(f'{os.sep}frames{os.sep}', f'{os.sep}backgrounds{os.sep}')
+    tile = re.search(r'_(\d+)$', avatar_dir or '')
+    suffix = f'_tile{tile.group(1)}' if tile else ''
+    matches = [file for file in glob.glob(f'{backgrounds_dir}/background_*{trial_id}{suffix}.*')
+               if re.fullmatch(r'background_[a-z]+' + str(trial_id) + suffix + r'\.(png|jpg)', os.path.basename(file))]
+    return matches[0] if matches else None
+
+
+def parse_transitions(value) -> List[int]:
+    if isinstance(value, str):
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return []
+    values = value if isinstance(value, list) else [value]
+    transitions = []
+    for t in values:
+        try:
+            t = int(t)
+        except (TypeError, ValueError):
+            continue
+        if t >= 0:
+            transitions.append(t)
+    return transitions
+
+
+def load_frame(path: str, size: Tuple[int, int]) -> np.ndarray:
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img.shape[1] != size[0] or img.shape[0] != size[1]:
+        img = cv2.resize(img, dsize=size, interpolation=cv2.INTER_AREA)
+    return img
+
+
+class PhyPsyDataset(data.Dataset):
+    def __init__(self, root_path: str, dataset_name: str, type: str, size: Tuple[int, int], time: Optional[int] = None,
+                 trial_types: Optional[List[str]] = None, uint8: bool = False):
+
+        data_path = dataset_name if os.path.isabs(dataset_name) else f'data/data/video/{dataset_name}'
+        self.data_path = os.path.join(root_path, data_path)
+        self.file   = os.path.join(self.data_path, f'phypsy-{size[0]}x{size[1]}')
+        self.size   = size
+        self.uint8  = uint8
+        self.frames = None
+
+        if not os.path.exists(f'{self.file}.index.npz'):
+            self.build()
+
+        index = np.load(f'{self.file}.index.npz')
+        self.offsets          = index['offsets']
+        self.trial_ids        = index['trial_ids']
+        self.trial_types      = index['trial_types']
+        self.first_transition = index['first_transition']
+        self.backgrounds      = np.load(f'{self.file}.backgrounds.npy', mmap_mode='r')
+
+        # deterministic split over trials as for CATER: 56% train, 14% val, 30% test
+        trials = np.arange(len(self.trial_ids))
+        if trial_types is not None:
+            trials = trials[np.isin(self.trial_types, trial_types)]
+        num_trials = len(trials)
+        bounds = {'train': (0, int(num_trials * 0.7 * 0.8)), 'val': (int(num_trials * 0.7 * 0.8), int(num_trials * 0.7)),
+                  'test': (int(num_trials * 0.7), num_trials)}[type]
+        self.trials = trials[bounds[0]:bounds[1]]
+
+        lengths   = self.offsets[self.trials + 1] - self.offsets[self.trials]
+        self.time = int(lengths.max()) if time is None and len(lengths) else time
+        windows   = np.maximum(lengths - self.time + 1, 0) if time is not None else np.ones_like(lengths)
+        self.window_offsets = np.concatenate(([0], np.cumsum(windows)))
+        self.length = int(self.window_offsets[-1])
+
+        print(f"PhyPsyDataset[{type}]: {len(self.trials)} trials, {self.length} sequences")
+
+        if len(self) == 0:
+            raise FileNotFoundError(f'Found no dataset at {self.data_path}')
+
+    def build(self):
+        """Decode the _img frames of every trial of the log once into the uint8 memmap."""
+        log = pd.read_csv(os.path.join(self.data_path, 'log.csv'), index_col=False)
+
+        trials = []
+        for row in log.to_dict('records'):
+            frames_dir = resolve_path(row.get('frames_path'), self.data_path)
+            if frames_dir is None:
+                continue
+            frames, avatar_dir = list_img_frames(frames_dir)
+            if not frames:
+                continue
+            trials.append((row, frames, find_background(frames_dir, row['id'], avatar_dir)))
+
+        num_frames  = sum(len(frames) for _, frames, _ in trials)
+        memmap      = np.lib.format.open_memmap(f'{self.file}.frames.npy', mode='w+', dtype=np.uint8,
+                                                shape=(num_frames, self.size[1], self.size[0], 3))
+        backgrounds = np.zeros((len(trials), self.size[1], self.size[0], 3), dtype=np.uint8)
+        offsets     = np.zeros(len(trials) + 1, dtype=np.int64)
+
+        for i, (row, frames, background) in enumerate(trials):
+            offsets[i + 1] = offsets[i] + len(frames)
+            for j, path in enumerate(frames):
+                memmap[offsets[i] + j] = load_frame(path, self.size)
+            backgrounds[i] = load_frame(background, self.size) if background else memmap[offsets[i]]
+
+            if i % 100 == 0:
+                print(f"Loading PhyPsy [{i * 100 / len(trials):.2f}]", flush=True)
+
+        memmap.flush()
+        del memmap
+        np.save(f'{self.file}.backgrounds.npy', backgrounds)
+
+        first_transition = np.array([min(parse_transitions(row.get('transition_frame')), default=-1)
+                                     for row, _, _ in trials], dtype=np.int64)
+        np.savez(f'{self.file}.index.npz', offsets=offsets, first_transition=first_transition,
+                 trial_ids=np.array([row['id'] for row, _, _ in trials], dtype=np.int64),
+                 trial_types=np.array([str(row.get('trial_type')) for row, _, _ in trials]))
+
+    def get_transition_frame(self, trial: int) -> int:
+        """First transition frame of a trial of this split, -1 if it has none."""
+        return int(self.first_transition[self.trials[trial]])
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index: int):
+        if self.frames is None:
+            # opened per worker, a memmap would be copied when the dataset is pickled
+            self.frames = np.load(f'{self.file}.frames.npy', mmap_mode='r')
+
+        position = int(np.searchsorted(self.window_offsets, index, side='right')) - 1
+        trial    = self.trials[position]
+        start    = int(self.offsets[trial]) + index - int(self.window_offsets[position])
+        end      = min(start + self.time, int(self.offsets[trial + 1]))
+
+        frames = np.zeros((self.time, 3, self.size[1], self.size[0]), dtype=np.uint8 if self.uint8 else np.float32)
+        window = self.frames[start:end].transpose(0, 3, 1, 2)
+        frames[:end - start] = window if self.uint8 else window.astype(np.float32) / 255.0
+
+        background = self.backgrounds[trial].transpose(2, 0, 1)
+        background = np.ascontiguousarray(background) if self.uint8 else background.astype(np.float32) / 255.0
+        background = background.reshape(1, background.shape[0], background.shape[1], background.shape[2])
+
+        transition = int(self.first_transition[trial]) - (start - int(self.offsets[trial]))
+        transition = transition if 0 <= transition < self.time else -1
+
+        return frames, background, np.int64(transition)
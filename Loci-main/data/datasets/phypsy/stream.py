@@ -0,0 +1,135 @@
+"""
+Never-repeating stream of trials from running phypsy simulators.
+
+The trainer creates a shared-memory ring buffer (phypsy/ring_buffer.py) and simulators started with
+`--stream <name>` write every finished trial into it. Each data loader worker takes the fresh trials whose sequence
+number falls to it, so no fresh trial is seen twice, and with probability `replay_ratio`, or whenever no fresh trial
+is available, replays a random trial still held by the buffer. Items are random windows of `time` frames, in the
+format of PhyPsyDataset.
+"""
+
+from torch.utils import data
+from typing import Tuple, Optional
+import numpy as np
+import time as clock
+import sys
+import os
+
+PHYPSY_PATH = os.environ.get('PHYPSY_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), *[os.pardir] * 4, 'phypsy'))
+sys.path.append(PHYPSY_PATH)
+
+from ring_buffer import TrialRingBuffer
+
+
+class PhyPsyStreamDataset(data.IterableDataset):
+    def __init__(self, name: str, size: Tuple[int, int], time: int, replay_ratio: float = 0.5,
+                 samples_per_epoch: int = 10000, slots: int = 256, max_frames: int = 200, wait: float = 0.1,
+                 uint8: bool = False):
+
+        self.name              = name
+        self.size              = size
+        self.time              = time
+        self.replay_ratio      = replay_ratio
+        self.samples_per_epoch = samples_per_epoch
+        self.wait              = wait
+        self.uint8             = uint8
+        self.buffer            = None
+        self.cursor            = None
+
+        try:
+            self.owner = TrialRingBuffer.create(name, slots, max_frames, size)
+            print(f"PhyPsyStreamDataset: created ring buffer {name} with {slots} slots of {max_frames} frames")
+        except FileExistsError:
+            self.owner = None
+            print(f"PhyPsyStreamDataset: using existing ring buffer {name}")
+
+    def __getstate__(self):
+        # shared memory views cannot be pickled, workers attach by name instead
+        state = self.__dict__.copy()
+        state['owner'] = state['buffer'] = None
+        return state
+
+    def get_buffer(self) -> TrialRingBuffer:
+        if self.buffer is None:
+            self.buffer = self.owner or TrialRingBuffer.attach(self.name)
+            if self.buffer.size != tuple(self.size):
+                raise ValueError(f'Ring buffer {self.name} holds frames of size {self.buffer.size}, not {self.size}')
+        return self.buffer
+
+    def next_fresh(self, worker_id: int, num_workers: int) -> Optional[tuple]:
+        """Oldest trial of this worker not read yet, skipping trials that were overwritten meanwhile."""
+        buffer      = self.get_buffer()
+        latest      = buffer.latest
+        self.cursor = max(self.cursor, latest - buffer.slots)
+        while self.cursor < latest:
+            sequence = self.cursor
+            if sequence % num_workers != worker_id:
+                self.cursor += 1
+                continue
+
+            trial = buffer.read(buffer.slot_of(sequence))
+            if trial is None or trial[0] < sequence:
+                # still being written
+                return None
+
+            self.cursor += 1
+            if trial[0] == sequence:
+                return trial
+        return None
+
+    def replay(self, rng: np.random.Generator) -> Optional[tuple]:
+        buffer = self.get_buffer()
+        filled = np.flatnonzero(buffer.meta[:, 1] >= 0)
+        return buffer.read(int(rng.choice(filled))) if len(filled) else None
+
+    def get_window(self, trial: tuple, rng: np.random.Generator):
+        _, frames, background, transition = trial
+        start = int(rng.integers(0, max(len(frames) - self.time, 0) + 1))
+        end   = min(start + self.time, len(frames))
+
+        window = np.zeros((self.time, 3, self.size[1], self.size[0]), dtype=np.uint8 if self.uint8 else np.float32)
+        frames = frames[start:end].transpose(0, 3, 1, 2)
+        window[:end - start] = frames if self.uint8 else frames.astype(np.float32) / 255.0
+
+        background = background.transpose(2, 0, 1)
+        background = np.ascontiguousarray(background) if self.uint8 else background.astype(np.float32) / 255.0
+        background = background.reshape(1, background.shape[0], background.shape[1], background.shape[2])
+
+        transition = transition - start
+        transition = transition if 0 <= transition < self.time else -1
+
+        return window, background, np.int64(transition)
+
+    def __len__(self):
+        return self.samples_per_epoch
+
+    def __iter__(self):
+        worker = data.get_worker_info()
+        worker_id, num_workers = (worker.id, worker.num_workers) if worker is not None else (0, 1)
+        rng = np.random.default_rng()
+
+        buffer = self.get_buffer()
+        if self.cursor is None:
+            self.cursor = max(buffer.latest - buffer.slots, 0)
+
+        samples = self.samples_per_epoch // num_workers + (worker_id < self.samples_per_epoch % num_workers)
+        count   = 0
+        while count < samples:
+            trial = None
+            if rng.random() >= self.replay_ratio:
+                trial = self.next_fresh(worker_id, num_workers)
+            if trial is None:
+                trial = self.replay(rng)
+            if trial is None:
+                clock.sleep(self.wait)
+                continue
+
+            yield self.get_window(trial, rng)
+            count += 1
+
+    def close(self):
+        if self.buffer is not None and self.buffer is not self.owner:
+            self.buffer.close()
+        if self.owner is not None:
+            self.owner.close()
+        self.buffer = self.owner = None
@@ -0,0 +1,121 @@
+"""
+Decoded-frame LRU cache shared by all DataLoader workers, and a sampler that keeps nearby windows together.
+
+Neighbouring windows of a video overlap in all but one frame. The cache keeps decoded uint8 frames in one shared
+memory block of a configurable byte budget, keyed by frame index, so a frame decoded by one worker is reused by the
+others; the least recently used frame is evicted. NearbyWindowSampler walks batch_size random runs of consecutive
+windows in parallel, so every batch holds windows from different places of the video while consecutive batches
+reuse almost all frames of the previous one.
+"""
+
+from multiprocessing import Lock, resource_tracker, shared_memory
+from torch.utils import data
+from typing import Callable, Iterator, Tuple
+import numpy as np
+import random
+
+
+class SharedFrameCache():
+    def __init__(self, num_frames: int, frame_shape: Tuple[int, int, int], budget: int):
+
+        self.num_frames  = num_frames
+        self.frame_shape = tuple(frame_shape)
+        self.slots       = max(int(budget // np.prod(frame_shape)), 1)
+        self.lock        = Lock()
+        self.owner       = True
+
+        self.shm = shared_memory.SharedMemory(create=True, size=self.get_nbytes())
+        self.attach()
+        self.slot_of[:] = -1
+        self.keys[:]    = -1
+        self.stamps[:]  = 0
+        self.clock[:]   = 0
+
+    def get_nbytes(self) -> int:
+        return 8 + self.num_frames * 8 + self.slots * 16 + self.slots * int(np.prod(self.frame_shape))
+
+    def attach(self):
+        buffer = self.shm.buf
+        offset = 0
+        self.clock   = np.ndarray((1,), dtype=np.int64, buffer=buffer, offset=offset)
+        offset      += 8
+        self.slot_of = np.ndarray((self.num_frames,), dtype=np.int64, buffer=buffer, offset=offset)
+        offset      += self.num_frames * 8
+        self.keys    = np.ndarray((self.slots,), dtype=np.int64, buffer=buffer, offset=offset)
+        offset      += self.slots * 8
+        self.stamps  = np.ndarray((self.slots,), dtype=np.int64, buffer=buffer, offset=offset)
+        offset      += self.slots * 8
+        self.frames  = np.ndarray((self.slots,) + self.frame_shape, dtype=np.uint8, buffer=buffer, offset=offset)
+
+    def __getstate__(self):
+        # workers started with spawn attach by name, forked workers inherit the mapping
+        state = self.__dict__.copy()
+        state['shm'] = self.shm.name
+        for name in ['clock', 'slot_of', 'keys', 'stamps', 'frames']:
+            state[name] = None
+        state['owner'] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.shm = shared_memory.SharedMemory(name=state['shm'])
+        # only the creator unlinks the block
+        resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self.attach()
+
+    def get(self, index: int, decode: Callable[[], np.ndarray]) -> np.ndarray:
+        """Copy of a frame (H, W, 3), decoded with decode() and cached if it is not cached yet."""
+        with self.lock:
+            slot = self.slot_of[index]
+            if slot >= 0:
+                self.clock[0] += 1
+                self.stamps[slot] = self.clock[0]
+                return self.frames[slot].copy()
+
+        frame = decode()
+
+        with self.lock:
+            if self.slot_of[index] < 0:
+                slot = int(np.argmin(self.stamps))
+                if self.keys[slot] >= 0:
+                    self.slot_of[self.keys[slot]] = -1
+
+                self.frames[slot]    = frame
+                self.keys[slot]      = index
+                self.slot_of[index]  = slot
+                self.clock[0]       += 1
+                self.stamps[slot]    = self.clock[0]
+
+        return frame
+
+    def close(self):
+        self.clock = self.slot_of = self.keys = self.stamps = self.frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class NearbyWindowSampler(data.Sampler):
+    """
+    Indices of batch_size runs of run_length consecutive windows at a time, interleaved so that the i-th batch of a
+    group holds the i-th window of every run. Runs are shuffled every epoch.
+    """
+    def __init__(self, length: int, batch_size: int, run_length: int):
+
+        self.length     = length
+        self.batch_size = batch_size
+        self.run_length = max(run_length, 1)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self) -> Iterator[int]:
+        runs = [range(start, min(start + self.run_length, self.length)) for start in range(0, self.length, self.run_length)]
+        random.shuffle(runs)
+
+        for group in range(0, len(runs), self.batch_size):
+            group = runs[group:group + self.batch_size]
+            for step in range(self.run_length):
+                for run in group:
+                    if step < len(run):
+                        yield run[step]
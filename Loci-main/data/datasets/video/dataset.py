@@ -9,6 +9,9 @@ https://stanford.edu/~shervine/blog/pytorch-how-to-generate-data-parallel
 
 from torch.utils import data
 from typing import Tuple, Union, List
+from data.datasets.decoded_cache import DecodedCache
+from data.datasets.encoded_frames import EncodedFrames
+from data.datasets.shared_frame_cache import SharedFrameCache, NearbyWindowSampler
 import numpy as np
 import cv2
 import os
@@ -30,7 +33,7 @@ class RamImage():
 
 
 class VideoDataset(data.Dataset):
-    def __init__(self, root_path: str, dataset_name: str, type: str, size: Tuple[int, int], time: int, subset: bool = False):
+    def __init__(self, root_path: str, dataset_name: str, type: str, size: Tuple[int, int], time: int, subset: bool = False, decoded: bool = False, uint8: bool = False, frame_cache: int = 0):
 
         data_path = dataset_name if subset else f'data/data/video/{dataset_name}'
         data_path = os.path.join(root_path, data_path)
@@ -56,21 +59,33 @@ class VideoDataset(data.Dataset):
                 else:
                     frames = frames[int(len(frames) * 0.9):]
 
-            num_samples = len(frames)
+            # file paths until they are written into the encoded frame blob
+            self.imgs = frames
 
-            self.imgs = []
-            for i, path in enumerate(frames):
-                self.imgs.append(RamImage(path))
+        # caches of RamImage lists are converted to the encoded frame blob
+        if not isinstance(self.imgs, EncodedFrames):
+            if not subset:
+                print(f"Loading Video {type} [{len(self.imgs)} frames]", flush=True)
 
-                if not subset and i % 1000 == 0:
-                    print(f"Loading Video {type} [{i * 100 / num_samples:.2f}]", flush=True)
+            self.imgs = EncodedFrames.write(self.file.replace('.pickle', '.frames'), [[img if isinstance(img, str) else img.img_raw for img in self.imgs]])[0]
+            self.save()
 
+        self.decoded = None
+        if decoded:
+            decoded_file = self.file.replace('.pickle', '.decoded')
+            if not DecodedCache.exists(decoded_file):
+                DecodedCache.build(decoded_file, [self.imgs], size)
+            self.decoded = DecodedCache(decoded_file)
 
-            self.save()
+        # overlapping windows decode every frame time times, a cache shared by the workers decodes it once
+        self.frame_cache = None
+        if frame_cache > 0 and self.decoded is None:
+            self.frame_cache = SharedFrameCache(len(self.imgs), (size[1], size[0], 3), frame_cache)
 
         self.length = len(self.imgs) - time + 1
         self.time   = time
         self.size   = size
+        self.uint8  = uint8
 
         if not subset:
             print(f'loaded {type} Video Dataset {dataset_name} [{self.length}]')
@@ -90,18 +105,38 @@ class VideoDataset(data.Dataset):
     def __len__(self):
         return max(self.length, 0)
 
+    def get_sampler(self, batch_size: int):
+        """Sampler keeping nearby windows together so that their frames are still in the frame cache."""
+        if self.frame_cache is None:
+            return None
+
+        return NearbyWindowSampler(len(self), batch_size, self.time)
+
+    def get_frame(self, index: int) -> np.ndarray:
+        if self.frame_cache is None:
+            return self.imgs[index].to_numpy()
+
+        return self.frame_cache.get(index, self.imgs[index].to_numpy)
+
     def __getitem__(self, index: int):
         
+        dtype      = np.uint8 if self.uint8 else np.float32
+        background = np.zeros((1, 3, self.size[1], self.size[0]), dtype=dtype)
+
+        if self.decoded is not None:
+            frames = self.decoded.sequence(0)[index:index + self.time].transpose(0, 3, 1, 2)
+            return (np.ascontiguousarray(frames) if self.uint8 else frames.astype(np.float32) / 255.0), background
+
         frames = []
-        frames = np.zeros((self.time, 3, self.size[1], self.size[0]), dtype=np.float32)
+        frames = np.zeros((self.time, 3, self.size[1], self.size[0]), dtype=dtype)
         for i in range(self.time):
-            img = self.imgs[index + i].to_numpy()
-            frames[i] = img.transpose(2, 0, 1).astype(np.float32) / 255.0
+            img = self.get_frame(index + i).transpose(2, 0, 1)
+            frames[i] = img if self.uint8 else img.astype(np.float32) / 255.0
 
-        return frames, np.zeros((1, 3, self.size[1], self.size[0]), dtype=np.float32)
+        return frames, background
 
 class MultipleVideosDataset(data.Dataset):
-    def __init__(self, root_path: str, dataset_name: str, type: str, size: Tuple[int, int], time: int):
+    def __init__(self, root_path: str, dataset_name: str, type: str, size: Tuple[int, int], time: int, decoded: bool = False, uint8: bool = False, frame_cache: int = 0):
 
         data_path = f'data/data/video/{dataset_name}'
         data_path = os.path.join(root_path, data_path)
@@ -109,16 +144,18 @@ class MultipleVideosDataset(data.Dataset):
 
         self.datasets = []
         self.length = 0
-        for dir in next(os.walk(data_path))[1]:
-            if dir.startswith("00"): 
-                self.datasets.append(VideoDataset(data_path, dir, type, size, time, True))
-                self.length += self.datasets[-1].length
+        self.time   = time
+        dirs = [dir for dir in next(os.walk(data_path))[1] if dir.startswith("00")]
+        for dir in dirs:
+            # the frame cache budget is split between the videos
+            self.datasets.append(VideoDataset(data_path, dir, type, size, time, True, decoded, uint8, frame_cache // max(len(dirs), 1)))
+            self.length += self.datasets[-1].length
         
         self.background = None
         if "background.jpg" in os.listdir(data_path):
             self.background = cv2.imread(os.path.join(data_path, "background.jpg"))
             self.background = cv2.resize(self.background, dsize=size, interpolation=cv2.INTER_CUBIC)
-            self.background = self.background.transpose(2, 0, 1).astype(float) / 255.0
+            self.background = self.background.transpose(2, 0, 1) if uint8 else self.background.transpose(2, 0, 1).astype(float) / 255.0
             self.background = self.background.reshape(1, self.background.shape[0], self.background.shape[1], self.background.shape[2])
 
         print(f"MultipleVideosDataset: {self.length}")
@@ -132,6 +169,13 @@ class MultipleVideosDataset(data.Dataset):
 
         return int(self.length * 0.1)
 
+    def get_sampler(self, batch_size: int):
+        """Sampler keeping nearby windows together, consecutive indices are consecutive windows of one video."""
+        if all(dataset.frame_cache is None for dataset in self.datasets):
+            return None
+
+        return NearbyWindowSampler(len(self), batch_size, self.time)
+
     def __getitem__(self, index: int):
 
         if not self.train:
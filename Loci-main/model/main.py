@@ -10,6 +10,8 @@ from data.datasets.moving_mnist.dataset import MovingMNISTDataset
 from data.datasets.video.dataset import VideoDataset, MultipleVideosDataset
 from data.datasets.CATER.dataset import CaterDataset, CaterLatentDataset
 from data.datasets.CLEVRER.dataset import ClevrerDataset
+from data.datasets.phypsy.dataset import PhyPsyDataset
+from data.datasets.phypsy.stream import PhyPsyStreamDataset
 
 CFG_PATH = "cfg.json"
 
@@ -27,9 +29,11 @@ if __name__ == "__main__":
     mode_group.add_argument("-eval", action="store_true")
     mode_group.add_argument("-save", action="store_true")
     mode_group.add_argument("-export", action="store_true")
+    mode_group.add_argument("-surprise", action="store_true")
     parser.add_argument("-objects", action="store_true")
     parser.add_argument("-nice", action="store_true")
     parser.add_argument("-individual", action="store_true")
+    parser.add_argument("-surprise-window", default=10, type=int)
 
     args = parser.parse_args(sys.argv[1:])
 
@@ -81,31 +85,52 @@ if __name__ == "__main__":
             cfg.model.latent_size[1] = cfg.model.patch_grid_size[1] * 2
 
     if cfg.datatype == "video":
-        trainset = None if args.save and args.testset else VideoDataset("./", cfg.dataset, "train", (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), cfg.sequence_len + 1)
-        valset   = None if args.save else VideoDataset("./", cfg.dataset, "test",  (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), cfg.sequence_len + 1)
-        testset  = VideoDataset("./", cfg.dataset, "test", (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), cfg.sequence_len + 1)
+        trainset = None if args.save and args.testset else VideoDataset("./", cfg.dataset, "train", (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), cfg.sequence_len + 1, decoded=cfg.get("decoded_cache", False), uint8=cfg.get("uint8_frames", False), frame_cache=cfg.get("frame_cache_mb", 0) * 2**20)
+        valset   = None if args.save else VideoDataset("./", cfg.dataset, "test",  (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), cfg.sequence_len + 1, decoded=cfg.get("decoded_cache", False), uint8=cfg.get("uint8_frames", False), frame_cache=cfg.get("frame_cache_mb", 0) * 2**20)
+        testset  = VideoDataset("./", cfg.dataset, "test", (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), cfg.sequence_len + 1, decoded=cfg.get("decoded_cache", False), uint8=cfg.get("uint8_frames", False), frame_cache=cfg.get("frame_cache_mb", 0) * 2**20)
         cfg.sequence_len += 1
 
     if cfg.datatype == "multiple-videos":
-        trainset = None if args.save and args.testset else MultipleVideosDataset("./", cfg.dataset, "train", (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), cfg.sequence_len + 1)
-        valset   = None if args.save else MultipleVideosDataset("./", cfg.dataset, "test",  (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), cfg.sequence_len + 1)
-        testset  = MultipleVideosDataset("./", cfg.dataset, "test", (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), cfg.sequence_len + 1)
+        trainset = None if args.save and args.testset else MultipleVideosDataset("./", cfg.dataset, "train", (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), cfg.sequence_len + 1, decoded=cfg.get("decoded_cache", False), uint8=cfg.get("uint8_frames", False), frame_cache=cfg.get("frame_cache_mb", 0) * 2**20)
+        valset   = None if args.save else MultipleVideosDataset("./", cfg.dataset, "test",  (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), cfg.sequence_len + 1, decoded=cfg.get("decoded_cache", False), uint8=cfg.get("uint8_frames", False), frame_cache=cfg.get("frame_cache_mb", 0) * 2**20)
+        testset  = MultipleVideosDataset("./", cfg.dataset, "test", (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), cfg.sequence_len + 1, decoded=cfg.get("decoded_cache", False), uint8=cfg.get("uint8_frames", False), frame_cache=cfg.get("frame_cache_mb", 0) * 2**20)
         cfg.sequence_len += 1
 
     if cfg.datatype == "clevrer":
-        trainset = None if args.save and args.testset else ClevrerDataset("./", cfg.dataset, "train", (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)))
-        valset   = None if args.save else ClevrerDataset("./", cfg.dataset, "val",   (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)))
-        testset  = ClevrerDataset("./", cfg.dataset, "test",  (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)))
+        window   = cfg.get("temporal_window", {})
+        trainset = None if args.save and args.testset else ClevrerDataset("./", cfg.dataset, "train", (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), decoded=cfg.get("decoded_cache", False), uint8=cfg.get("uint8_frames", False), window=window.get("length"), stride=window.get("stride", 1))
+        valset   = None if args.save else ClevrerDataset("./", cfg.dataset, "val",   (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), decoded=cfg.get("decoded_cache", False), uint8=cfg.get("uint8_frames", False), window=window.get("length"), stride=window.get("stride", 1))
+        testset  = ClevrerDataset("./", cfg.dataset, "test",  (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), decoded=cfg.get("decoded_cache", False), uint8=cfg.get("uint8_frames", False), window=window.get("length"), stride=window.get("stride", 1))
 
         valset.train  = False
         testset.train = False
         
         cfg.sequence_len += 1
 
+    if cfg.datatype == "phypsy" and not args.surprise:
+        trainset = None if args.save and args.testset else PhyPsyDataset("./", cfg.dataset, "train", (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), cfg.sequence_len + 1, uint8=cfg.get("uint8_frames", False))
+        valset   = None if args.save else PhyPsyDataset("./", cfg.dataset, "val",   (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), cfg.sequence_len + 1, uint8=cfg.get("uint8_frames", False))
+        testset  = PhyPsyDataset("./", cfg.dataset, "test",  (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), cfg.sequence_len + 1, uint8=cfg.get("uint8_frames", False))
+        cfg.sequence_len += 1
+
+    if cfg.datatype == "phypsy-stream" and not args.surprise:
+        stream   = cfg.get("stream", {})
+        trainset = PhyPsyStreamDataset(stream.get("name", "phypsy"), (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), cfg.sequence_len + 1, stream.get("replay_ratio", 0.5), stream.get("samples_per_epoch", 10000), stream.get("slots", 256), stream.get("max_frames", 200), uint8=cfg.get("uint8_frames", False))
+        valset   = PhyPsyDataset("./", cfg.dataset, "val",   (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), cfg.sequence_len + 1, uint8=cfg.get("uint8_frames", False))
+        testset  = PhyPsyDataset("./", cfg.dataset, "test",  (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), cfg.sequence_len + 1, uint8=cfg.get("uint8_frames", False))
+        cfg.sequence_len += 1
+
+    if (cfg.datatype == "phypsy" or cfg.datatype == "phypsy-stream") and args.surprise:
+        # whole trials, so the errors can be aligned to their transition frames
+        trainset = None
+        valset   = PhyPsyDataset("./", cfg.dataset, "val",  (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), uint8=cfg.get("uint8_frames", False))
+        testset  = PhyPsyDataset("./", cfg.dataset, "test", (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), uint8=cfg.get("uint8_frames", False))
+
     if cfg.datatype == "cater":
-        trainset = None if args.save and args.testset else CaterDataset("./", cfg.dataset, "train", (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)))
-        valset   = None if args.save else CaterDataset("./", cfg.dataset, "val",   (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)))
-        testset  = CaterDataset("./", cfg.dataset, "test",  (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)))
+        window   = cfg.get("temporal_window", {})
+        trainset = None if args.save and args.testset else CaterDataset("./", cfg.dataset, "train", (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), decoded=cfg.get("decoded_cache", False), uint8=cfg.get("uint8_frames", False), window=window.get("length"), stride=window.get("stride", 1))
+        valset   = None if args.save else CaterDataset("./", cfg.dataset, "val",   (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), decoded=cfg.get("decoded_cache", False), uint8=cfg.get("uint8_frames", False), window=window.get("length"), stride=window.get("stride", 1))
+        testset  = CaterDataset("./", cfg.dataset, "test",  (cfg.model.latent_size[1] * 2**(cfg.model.level*2), cfg.model.latent_size[0] * 2**(cfg.model.level*2)), decoded=cfg.get("decoded_cache", False), uint8=cfg.get("uint8_frames", False), window=window.get("length"), stride=window.get("stride", 1))
 
         
         cfg.sequence_len += 1
@@ -130,3 +155,5 @@ if __name__ == "__main__":
         evaluation.save(cfg, testset if args.testset else trainset, args.load, (cfg.model.level*2), cfg.model.input_size, args.objects, args.nice, args.individual)
     elif args.export:
         evaluation.export_dataset(cfg, trainset, testset, args.load, f"{args.load}.latent-states")
+    elif args.surprise:
+        evaluation.surprise(cfg, testset if args.testset else valset, args.load, (cfg.model.level*2), f"{args.load}.surprise-{'test' if args.testset else 'val'}.csv", args.surprise_window)
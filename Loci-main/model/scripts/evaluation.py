@@ -18,6 +18,7 @@ import shutil
 import pickle
 from einops import rearrange, repeat, reduce
 from model.scripts.training import eval_net
+from utils.data import frames_to_device
 
 def preprocess(tensor, scale=1, normalize=False, mean_std_normalize=False):
 
@@ -345,8 +346,8 @@ def save(cfg: Configuration, dataset: Dataset, file, active_layer, size, object_
     with th.no_grad():
         for i, input in enumerate(dataloader):
 
-            tensor         = input[0].float().to(device)
-            old_background = input[1].to(device)
+            tensor         = frames_to_device(input[0], device)
+            old_background = frames_to_device(input[1], device)
 
             if cfg.datatype == 'cater' and i == 0:
                 net.background.set_background(old_background[:,0])
@@ -553,8 +554,8 @@ def export_latent(cfg: Configuration, dataset: Dataset, net_file, hdf5_file, hdf
     with th.no_grad():
         for batch_index, input in enumerate(dataloader):
             
-            tensor            = input[0].float().to(device)
-            background        = input[1].float().to(device)
+            tensor            = frames_to_device(input[0], device)
+            background        = frames_to_device(input[1], device)
             snitch_positions  = input[2].float()
             snitch_label      = input[3].float()
             snitch_contained  = input[4].float().unsqueeze(dim=2)
@@ -855,3 +856,171 @@ def evaluate(cfg: Configuration, num_gpus: int, dataset: Dataset, file, active_l
     th.backends.cudnn.benchmark = True
     eval_net(net, 'Test', dataset, dataloader, device, cfg, 0)
 
+
+def surprise(cfg: Configuration, dataset: Dataset, file, active_layer, output_file, window = 10):
+    """
+    Violation-of-expectation scores of a checkpoint on whole phypsy trials (PhyPsyDataset with time = None).
+    The per-frame prediction error of every trial is compared before and after its first transition frame:
+    pre/post are the mean errors of the `window` frames before and from the transition on, peak the maximum after it.
+    All reductions run batched on the device, scores are written per trial to output_file (csv), the error curves
+    next to it (npz).
+    """
+    cfg_net = cfg.model
+    device  = th.device(cfg.device)
+
+    dataloader = DataLoader(
+        dataset, 
+        pin_memory = True, 
+        num_workers = cfg.num_workers, 
+        batch_size = cfg_net.batch_size, 
+        shuffle = False,
+        drop_last = False, 
+        prefetch_factor = cfg.prefetch_factor
+    )
+
+    net = Loci(cfg = cfg_net, teacher_forcing = cfg.teacher_forcing)
+
+    # load model
+    if file != '':
+        print(f"load {file} to device {device}")
+        state = th.load(file, map_location=device)
+
+        # backward compatibility
+        model = {}
+        for key, value in state["model"].items():
+            model[key.replace(".module.", ".")] = value
+
+        net.load_state_dict(model)
+
+    net = net.to(device=device)
+    net.eval()
+
+    trial_ids   = dataset.trial_ids[dataset.trials]
+    trial_types = dataset.trial_types[dataset.trials]
+    lengths     = th.from_numpy(dataset.offsets[dataset.trials + 1] - dataset.offsets[dataset.trials]).to(device)
+
+    timer  = Timer()
+    scores = []
+    curves = []
+    with th.no_grad():
+        for batch_index, input in enumerate(dataloader):
+
+            tensor     = frames_to_device(input[0], device)
+            background = frames_to_device(input[1], device)
+            transition = input[2].to(device, non_blocking=True)
+
+            # the recurrent states of the model have a fixed batch size, so the last batch is padded
+            num_trials = tensor.shape[0]
+            if num_trials < cfg_net.batch_size:
+                tensor     = th.cat((tensor, tensor[-1:].expand(cfg_net.batch_size - num_trials, *tensor.shape[1:])))
+                background = th.cat((background, background[-1:].expand(cfg_net.batch_size - num_trials, *background.shape[1:])))
+
+            net.background.set_background(background[:,0])
+
+            error         = None
+            mask_last     = None
+            position_last = None
+            gestalt_last  = None
+            priority_last = None
+
+            # errors[:,f] is the error of the prediction of frame f
+            errors    = th.zeros((tensor.shape[0], tensor.shape[1]), device=device)
+            bg_errors = th.zeros((tensor.shape[0], tensor.shape[1]), device=device)
+
+            for t in range(-cfg.teacher_forcing, tensor.shape[1]-1):
+                if t >= 0:
+                    input  = tensor[:,t]
+                    target = th.clip(tensor[:,t+1], 0, 1)
+                else:
+                    input  = tensor[:,0]
+                    target = th.clip(tensor[:,0], 0, 1)
+
+                (
+                    output_next, 
+                    position_next, 
+                    gestalt_next, 
+                    priority_next, 
+                    mask_next, 
+                    object_next, 
+                    background_next, 
+                    _,_,_,_
+                ) = net(
+                    input, 
+                    error,
+                    mask_last, 
+                    position_last, 
+                    gestalt_last,
+                    priority_last,
+                    reset = (t == -cfg.teacher_forcing),
+                    evaluate=True
+                )
+                mask_last     = mask_next
+                position_last = position_next
+                gestalt_last  = gestalt_next
+                priority_last = priority_next
+
+                bg_error  = th.sqrt(reduce((target - background_next)**2, 'b c h w -> b 1 h w', 'mean'))
+                error     = th.sqrt(reduce((target - output_next)**2, 'b c h w -> b 1 h w', 'mean'))
+                error     = th.sqrt(error) * bg_error
+
+                if t >= 0:
+                    errors[:,t+1]    = reduce(error, 'b 1 h w -> b', 'mean')
+                    bg_errors[:,t+1] = reduce(bg_error, 'b 1 h w -> b', 'mean')
+
+            errors     = errors[:num_trials]
+            bg_errors  = bg_errors[:num_trials]
+            start      = batch_index * cfg_net.batch_size
+            length     = lengths[start:start+num_trials].unsqueeze(1)
+            transition = transition.unsqueeze(1)
+
+            frame = th.arange(errors.shape[1], device=device).unsqueeze(0)
+            valid = (frame >= 1) & (frame < length)
+            pre   = valid & (frame >= transition - window) & (frame < transition)
+            post  = valid & (frame >= transition) & (frame < transition + window)
+
+            pre_sum    = th.sum(pre, dim=1)
+            post_sum   = th.sum(post, dim=1)
+            pre_error  = th.sum(errors * pre, dim=1) / th.clamp(pre_sum, min=1)
+            post_error = th.sum(errors * post, dim=1) / th.clamp(post_sum, min=1)
+            pre_std    = th.sqrt(th.sum((errors - pre_error.unsqueeze(1))**2 * pre, dim=1) / th.clamp(pre_sum, min=1))
+            peak_error = th.max(th.where(post, errors, th.zeros_like(errors)), dim=1)[0]
+            scored     = (transition[:,0] >= 0) & (pre_sum > 0) & (post_sum > 0)
+
+            batch_scores = th.stack((
+                th.sum(errors * valid, dim=1) / th.clamp(th.sum(valid, dim=1), min=1),
+                th.sum(bg_errors * valid, dim=1) / th.clamp(th.sum(valid, dim=1), min=1),
+                pre_error,
+                post_error,
+                peak_error,
+                (post_error - pre_error) / (pre_error + 1e-8),
+                (peak_error - pre_error) / (pre_std + 1e-8),
+            ), dim=1)
+            batch_scores[:,2:] = th.where(scored.unsqueeze(1), batch_scores[:,2:], th.full_like(batch_scores[:,2:], float('nan')))
+
+            # scores and error curves are moved to the host in a single transfer per batch
+            columns = transition.shape[1] + batch_scores.shape[1]
+            result  = th.cat((transition.float(), batch_scores, errors), dim=1).cpu().numpy()
+            scores.append(result[:, :columns])
+            curves.append(result[:, columns:])
+
+            print("Surprise[{}/{}]: {}, {:.2f}%".format(
+                batch_index + 1,
+                len(dataloader),
+                str(timer),
+                (batch_index + 1) * 100 / len(dataloader)
+            ), flush=True)
+
+    scores  = np.concatenate(scores)
+    columns = ['trial_id', 'trial_type', 'frames', 'transition_frame', 'mean_error', 'mean_bg_error', 'pre_error', 'post_error', 'peak_error', 'surprise', 'peak_zscore']
+    with open(output_file, 'w') as f:
+        f.write(','.join(columns) + '\n')
+        for trial_id, trial_type, length, row in zip(trial_ids, trial_types, lengths.cpu().numpy(), scores):
+            f.write(f'{trial_id},{trial_type},{length},{int(row[0])},' + ','.join(f'{value:.6g}' for value in row[1:]) + '\n')
+
+    np.savez_compressed(
+        f'{os.path.splitext(output_file)[0]}.curves.npz',
+        trial_ids  = trial_ids,
+        lengths    = lengths.cpu().numpy(),
+        errors     = np.concatenate(curves),
+    )
+    print(f"Saved surprise scores of {len(scores)} trials to {output_file}")
@@ -1,6 +1,6 @@
 import torch as th
 from torch import nn
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, DataLoader, IterableDataset
 from pytorch_msssim import ms_ssim as msssim, ssim
 import cv2
 
@@ -21,7 +21,7 @@ import time
 import random
 import nn as nn_modules
 from utils.io import Timer, BinaryStatistics, UEMA
-from utils.data import DeviceSideDataset
+from utils.data import DeviceSideDataset, frames_to_device
 from utils.loss import SSIMLoss, MSSSIMLoss
 from nn.latent_classifier import CaterLocalizer, CaterObjectBehavior
 from nn.tracker import TrackingLoss, L1GridDistance, L2TrackingDistance
@@ -168,12 +168,16 @@ def train_eprop(rank: int, world_size: int, cfg: Configuration, trainset: Datase
         print(f'loaded[{rank}] {file}', flush=True)
 
             
+    # datasets with a shared frame cache order their windows so that neighbouring ones are loaded together
+    sampler = trainset.get_sampler(cfg_net.batch_size) if hasattr(trainset, 'get_sampler') else None
+
     trainloader = DataLoader(
         trainset, 
         pin_memory = True, 
         num_workers = cfg.num_workers, 
         batch_size = cfg_net.batch_size, 
-        shuffle = True,
+        sampler = sampler,
+        shuffle = sampler is None and not isinstance(trainset, IterableDataset),
         drop_last = True, 
         prefetch_factor = cfg.prefetch_factor, 
         persistent_workers = True
@@ -247,7 +251,7 @@ def train_eprop(rank: int, world_size: int, cfg: Configuration, trainset: Datase
         for batch_index, input in enumerate(trainloader):
             
             tensor          = input[0]
-            old_background  = input[1].to(device)
+            old_background  = frames_to_device(input[1], device)
             target_position = input[2].float().to(device) if cfg.datatype == 'cater' else None
             target_label    = input[3].to(device) if cfg.datatype == 'cater' else None
 
@@ -265,7 +269,7 @@ def train_eprop(rank: int, world_size: int, cfg: Configuration, trainset: Datase
 
             sequence_len = (tensor.shape[1]-1) 
 
-            input      = tensor[:,0].to(device)
+            input      = frames_to_device(tensor[:,0], device)
             input_next = input
             target     = th.clip(input, 0, 1).detach()
             pos_target = target_position[:,0] if cfg.datatype == 'cater' else None
@@ -277,7 +281,7 @@ def train_eprop(rank: int, world_size: int, cfg: Configuration, trainset: Datase
                 
                 if t >= 0:
                     input      = input_next
-                    input_next = tensor[:,t+1].to(device)
+                    input_next = frames_to_device(tensor[:,t+1], device)
                     target     = th.clip(input_next, 0, 1)
                     pos_target = target_position[:,t+1] if cfg.datatype == 'cater' else None
 
@@ -487,7 +491,7 @@ def eval_net(net_parallel, prefix, dataset, dataloader, device, cfg, epoch):
         for batch_index, input in enumerate(dataloader):
             
             tensor           = input[0]
-            old_background   = input[1].to(device)
+            old_background   = frames_to_device(input[1], device)
             target_position  = input[2].float().to(device)
             target_label     = input[3].to(device)
             snitch_contained = input[4].to(device)
@@ -514,7 +518,7 @@ def eval_net(net_parallel, prefix, dataset, dataloader, device, cfg, epoch):
 
             sequence_len = (tensor.shape[1]-1) 
 
-            input      = tensor[:,0].to(device)
+            input      = frames_to_device(tensor[:,0], device)
             input_next = input
             target     = th.clip(input, 0, 1).detach()
             pos_target = target_position[:,0] if cfg.datatype == 'cater' else None
@@ -526,7 +530,7 @@ def eval_net(net_parallel, prefix, dataset, dataloader, device, cfg, epoch):
                 
                 if t >= 0:
                     input      = input_next
-                    input_next = tensor[:,t+1].to(device)
+                    input_next = frames_to_device(tensor[:,t+1], device)
                     target     = th.clip(input_next, 0, 1)
                     pos_target = target_position[:,t+1] if cfg.datatype == 'cater' else None
 
@@ -71,3 +71,12 @@ class DeviceSideDataset:
             for i in range(len(self.data)):
                 self.data[i] = self.data[i][indices]
 
+
+def frames_to_device(tensor: th.Tensor, device) -> th.Tensor:
+    """
+    Moves frames to the device. uint8 frames are transferred as they are and scaled to [0, 1] on the device.
+    """
+    if tensor.dtype == th.uint8:
+        return tensor.to(device, non_blocking=True).float() / 255.0
+
+    return tensor.float().to(device)
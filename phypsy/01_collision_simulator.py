@@ -1,29 +1,38 @@
 from simulation_handler import SimulationHandler
+from agent_planner import AgentPlan
+from feasibility import check_collision_draws, get_bounds_radius, PrecheckStats
 from tdw.add_ons.third_person_camera import ThirdPersonCamera
 from utils import *
 from copy import deepcopy
+import itertools
 from tdw.tdw_utils import TDWUtils
 from random import uniform
 from tdw.add_ons.collision_manager import CollisionManager
 import numpy as np
 
+PRECHECK_BATCH = 16
+PRECHECK_MAX_BATCHES = 8
 
 class CollisionSimulator(SimulationHandler):
 
-    def __init__(self):
+    def __init__(self, port: int = 1071):
         """
         Initializes a new instance of the CollisionSimulator.
         """
+        super().__init__(port=port)
         self.ctrl_id = 'collision'
         self.add_ons = []
         self.num_objects = 0
         self.o_ids = []
-        self.entities = []
+        # small objects of models_core.json, the library they are spawned from
+        self.entities = list(OCCLUDED_ENTITIES)
         self.target_rec = None
+        self.precheck_stats = PrecheckStats()
 
-    def _initialize_psychological(self) -> Tuple[float, float, float, bool, List[dict]]:
+    def _initialize_psychological(self) -> AgentPlan:
         """
-        Initializes the parameters for a psychological trial type.
+        Initializes the agent plan of a psychological trial: approach the target, jump over the obstacles on the way
+        and push the agent into the target once close enough.
         """
         velocity = .05
         agent_bounds = np.max(
@@ -33,19 +42,14 @@ class CollisionSimulator(SimulationHandler):
 
         scaled_force = scale_force(get_entity_by_name(self.entities[1]))
 
-        agent_success = False
+        obstacle_extents = [TDWUtils.get_bounds_extents(get_entity_by_name(self.entities[i]).bounds)
+                            for i in range(self.num_objects - 2)]
 
-        obstacle_data = [
-            {
-                "bounds": np.max(TDWUtils.get_bounds_extents(get_entity_by_name(self.entities[i]).bounds)) / 2,
-                "height": TDWUtils.get_bounds_extents(get_entity_by_name(self.entities[i]).bounds)[1],
-                "jump": False,
-                "dist_hor": np.nan,
-                "last_dist_hor": np.nan
-            } for i in range(self.num_objects - 2)
-        ]
-
-        return velocity, total_bounds, scaled_force, agent_success, obstacle_data
+        return AgentPlan(agent_id=self.o_ids[-2], target_id=self.o_ids[-1], speed=velocity,
+                         stop_distance=total_bounds + .4, obstacle_ids=self.o_ids[:self.num_objects - 2],
+                         obstacle_radii=[np.max(extents) / 2 for extents in obstacle_extents],
+                         obstacle_heights=[extents[1] for extents in obstacle_extents],
+                         agent_radius=agent_bounds, push_force=scaled_force)
 
     def _initialize_transitional(self) -> float:
         """
@@ -77,63 +81,20 @@ class CollisionSimulator(SimulationHandler):
             transitions.append(i)
         return transitions
 
-    def _run_psychological(self, velocity: float, total_bounds: float, scaled_force: float, agent_success: bool,
-                           obstacle_data: List[dict], transitions: List[int], i: int) -> Tuple[
-        List[dict], List[int], bool]:
+    def run(self, *args, **kwargs):
         """
-        Executes a frame in a psychological trial type.
+        Run the trials and print the feasibility pre-check statistics of the whole run once at the end.
         """
-        cmds = []
-        response = self.communicate([])
-        if i == 0:
-            # Initial setup commands for the first frame.
-            cmds.extend(
-                [{"$type": "object_look_at", "other_object_id": self.o_ids[-1], "id": self.o_ids[-2]},
-                 {"$type": "teleport_object_by", "position": {"x": 0, "y": 0, "z": velocity}, "id": self.o_ids[-2],
-                  "absolute": False}])
-        elif (calculate_dist(response, self.o_ids[-2], self.o_ids[-1]) - total_bounds) < .4 or agent_success:
-            if not agent_success:
-                cmds.extend(
-                    [{"$type": "object_look_at", "other_object_id": self.o_ids[-1], "id": self.o_ids[-2]},
-                     {"$type": "apply_force_magnitude_to_object",
-                      "magnitude": scaled_force,
-                      "id": self.o_ids[-2]}])
-                agent_success = True
-        else:
-            # Commands for normal operation in subsequent frames.
-            cmds.extend(
-                [{"$type": "object_look_at", "other_object_id": self.o_ids[-1], "id": self.o_ids[-2]},
-                 {"$type": "teleport_object_by", "position": {"x": 0, "y": 0, "z": velocity}, "id": self.o_ids[-2],
-                  "absolute": False}])
-
-            for j, data in enumerate(obstacle_data):
-                if (calculate_dist(response, self.o_ids[j], self.o_ids[-2]) - (
-                        data["bounds"] + obstacle_data[-1]["bounds"])) < (
-                        data["height"] / velocity + velocity * 3):
-                    # Handle obstacles and agent positioning based on horizontal distances.
-                    agent_loc = {val: key for val, key in
-                                 zip(['x', 'y', 'z'], get_mass_loc_rot(response, self.o_ids[-2])[1])}
-                    object_loc = {val: key for val, key in
-                                  zip(['x', 'y', 'z'], get_mass_loc_rot(response, self.o_ids[j])[1])}
-                    agent_loc['y'], object_loc['y'] = 0, 0
-                    data["dist_hor"] = TDWUtils.get_distance(agent_loc, object_loc)
-
-                    if data["dist_hor"] < data["last_dist_hor"]:
-                        cmds.append(
-                            {"$type": "teleport_object_by", "position": {"x": 0, "y": velocity * 2, "z": 0},
-                             "id": self.o_ids[-2], "absolute": True})
-
-                    data["last_dist_hor"] = data["dist_hor"]
-
-        if any(cmd['$type'] == 'teleport_object_by' for cmd in cmds):
-            transitions.append(i)
-        return cmds, transitions, agent_success
+        self.precheck_stats = PrecheckStats()
+        message = super().run(*args, **kwargs)
+        if self.precheck_stats.accepted + self.precheck_stats.rejected:
+            print(f'Feasibility pre-check: {self.precheck_stats}')
+        return message
 
     def run_frame_by_frame(self, trial_type: str, tot_frames: int) -> dict:
         """
         Executes the simulation frame by frame based on the trial type.
         """
-        velocity = [random.choice([-.1, 0, .1]) for _ in range(2)]
         transitions = [] if trial_type != 'physical' else None
         collision = False
 
@@ -141,22 +102,24 @@ class CollisionSimulator(SimulationHandler):
         self.add_ons.append(coll_mngr)
 
         if trial_type == 'psychological':
-            velocity, total_bounds, scaled_force, agent_success, obstacle_data = self._initialize_psychological()
+            plan = self._initialize_psychological()
+            cmds = plan.plan(self.get_positions(self.communicate([]), plan.ids))
         elif trial_type == 'transitional':
             tot_bounds = self._initialize_transitional()
 
         for i in range(tot_frames):
             if trial_type == 'transitional':
-                transitions = self._run_transitional(velocity, tot_bounds, transitions, i)
+                transitions = self._run_transitional(self.dodge_velocity, tot_bounds, transitions, i)
             elif trial_type == 'psychological':
-                cmds, transitions, agent_success = self._run_psychological(velocity, total_bounds, scaled_force,
-                                                                           agent_success, obstacle_data, transitions, i)
-                response = self.communicate(cmds)
+                cmds, moved = self.step_agent_plan(plan, cmds)
+                if moved:
+                    transitions.append(i)
             elif trial_type == 'physical':
                 self.communicate([])
-            if coll_mngr.obj_collisions:
+            if any(pair.int1 in self.o_ids or pair.int2 in self.o_ids for pair in coll_mngr.obj_collisions):
                 collision = True
 
+        self.add_ons.remove(coll_mngr)
         self._cleanup_after_run()
 
         return self._get_results(trial_type, collision, transitions)
@@ -198,9 +161,9 @@ class CollisionSimulator(SimulationHandler):
         """
         Generate a random drop location and its associated location on the ground.
         """
-        drop_loc = {"x": self.generate_random_coordinate(-1, 1),
-                    "y": self.generate_random_coordinate(3, 5),
-                    "z": self.generate_random_coordinate(-1, 1)}
+        drop_loc = {"x": self.sample_uniform('drop_x', -1, 1),
+                    "y": self.sample_uniform('drop_y', 3, 5),
+                    "z": self.sample_uniform('drop_z', -1, 1)}
 
         loc = {axis: drop_loc[axis] + self.generate_random_coordinate(-.1, .1) for axis in ['x', 'z']}
         loc['y'] = 0
@@ -211,11 +174,12 @@ class CollisionSimulator(SimulationHandler):
         Generate random locations for entities called 'patient' and 'collider'.
         """
         coord_range = [-2.2, -1.5, 1.5, 2.2]
-        collider_loc = {"x": random.choice(coord_range), "y": 0, "z": random.choice(coord_range)}
+        collider_loc = {"x": self.sample_choice('collider_x', coord_range), "y": 0,
+                        "z": self.sample_choice('collider_z', coord_range)}
 
-        patient_loc = {"x": self.generate_random_coordinate(-.5, .5),
+        patient_loc = {"x": self.sample_uniform('patient_x', -.5, .5),
                        "y": 0,
-                       "z": self.generate_random_coordinate(-.5, .5)}
+                       "z": self.sample_uniform('patient_z', -.5, .5)}
 
         return [patient_loc, collider_loc]
 
@@ -273,10 +237,71 @@ class CollisionSimulator(SimulationHandler):
         loc, look_at = {"x": -3.0, "y": 3.1, "z": -3.3}, {"x": 0, "y": 0, "z": 0}
         self.camera = ThirdPersonCamera(position=loc,
                                         look_at=look_at,
-                                        avatar_id='frames_temp')
+                                        avatar_id=self.avatar_id)
         self.add_ons.append(self.camera)
         return loc, look_at
 
+    def draw_parameters(self) -> dict:
+        """
+        Draw the type, locations, entities, rotation, force and dodge velocity of a fall or force trial.
+        The values drawn through the adaptive sampler are kept with the draw.
+        """
+        self.sampled = {}
+        collision_type = self.sample_choice('collision_type', ['fall', 'force'])
+        random_rotation = lambda: random.choice([uniform(0, 360), 0])
+        positions = self.set_locs() if collision_type == 'force' else self.set_drop_loc()
+        first = self.sample_choice('entity0', self.entities)
+        second = self.sample_choice('entity1', [name for name in self.entities if name != first])
+        others = [name for name in self.entities if name not in (first, second)]
+        return {'collision_type': collision_type,
+                'positions': positions,
+                'entities': [first, second] + random.sample(others, len(others)),
+                'rotation': {"x": random_rotation(), "y": random_rotation(), "z": random_rotation()}
+                if collision_type == 'fall' else {"x": 0, "y": 0, "z": 0},
+                'magnitude': self.sample_uniform('magnitude', 18, 38) if collision_type == 'force' else None,
+                'dodge': [self.sample_choice(f'dodge_{axis}', [-.1, 0, .1]) for axis in 'xz'],
+                'sampled': self.sampled}
+
+    def precheck(self, draws: List[dict]) -> np.ndarray:
+        """
+        Analytic pre-check of draws: the collider (mass 1) is pushed towards the patient or dropped onto it.
+        """
+        patient = np.array([[draw['positions'][0][axis] for axis in 'xyz'] for draw in draws], dtype=np.float64)
+        mover = np.array([[draw['positions'][1][axis] for axis in 'xyz'] for draw in draws], dtype=np.float64)
+        direction = (patient - mover) * [1, 0, 1]
+        direction /= np.maximum(np.linalg.norm(direction, axis=-1, keepdims=True), 1e-9)
+        magnitude = np.array([draw['magnitude'] or 0 for draw in draws])
+        radius_sum = np.array([get_bounds_radius(draw['entities'][0]) + get_bounds_radius(draw['entities'][1])
+                               for draw in draws])
+        dodge = np.array([[draw['dodge'][0], 0, draw['dodge'][1]] for draw in draws], dtype=np.float64)
+        return check_collision_draws(self.trial_type, mover, direction * magnitude[:, None], patient, radius_sum,
+                                     dodge, self.settings['tot_frames'])
+
+    def draw_feasible_parameters(self) -> dict:
+        """
+        Draw trial parameters in batches until the analytic pre-check accepts one, so the simulation is only run for
+        draws that can lead to the required contact or transition. Rejected draws count as failed attempts for
+        the adaptive sampler.
+        """
+        self.rejected_draws = 0
+        for _ in range(PRECHECK_MAX_BATCHES):
+            draws = [self.draw_parameters() for _ in range(PRECHECK_BATCH)]
+            accepted = self.precheck(draws)
+            self.precheck_stats.record(accepted)
+            if self.sampler:
+                for draw in itertools.compress(draws, ~accepted):
+                    self.sampler.record(draw['sampled'], False)
+            if accepted.any():
+                first = int(np.argmax(accepted))
+                self.rejected_draws += first
+                self.sampled = draws[first]['sampled']
+                return draws[first]
+            self.rejected_draws += len(draws)
+
+        print(console_msg('No draw passed the feasibility pre-check, simulating an unchecked one', 'warning'))
+        self.sampled = draws[0]['sampled']
+        return draws[0]
+
     def init_trial_cmds(self) -> list:
         """
         Initialize commands for a new trial in the simulation.
@@ -284,8 +309,14 @@ class CollisionSimulator(SimulationHandler):
         self.num_objects = 2 if self.trial_type != 'psychological' else random.randint(3, 4)
         self.o_ids = [self.get_unique_id() for _ in range(self.num_objects)]
 
-        collision_type = random.choice(['fall', 'force']) if self.trial_type != 'psychological' else 'psychological'
-        self.positions = self.set_locs() if collision_type != 'fall' else self.set_drop_loc()
+        if self.trial_type == 'psychological':
+            collision_type, magnitude, rot = 'psychological', None, {"x": 0, "y": 0, "z": 0}
+            self.positions = self.set_locs()
+            random.shuffle(self.entities)
+        else:
+            draw = self.draw_feasible_parameters()
+            collision_type, magnitude, rot = draw['collision_type'], draw['magnitude'], draw['rotation']
+            self.positions, self.entities, self.dodge_velocity = draw['positions'], draw['entities'], draw['dodge']
 
         camera_turn = {"x": self.positions[0]['x'], "y": 0, "z": self.positions[0]['z']}
         self.camera.look_at(camera_turn)
@@ -296,16 +327,9 @@ class CollisionSimulator(SimulationHandler):
             self.positions[0:2] = [{k: (v / scale_factors[0] if idx == 0 else -v / scale_factors[1]) for k, v in
                                     self.positions[-1].items()} for idx in range(2)]
 
-        random.shuffle(self.entities)
-
-        random_rotation = lambda: random.choice([uniform(0, 360), 0])
-        rot = {"x": random_rotation(), "y": random_rotation(),
-               "z": random_rotation()} if collision_type == 'fall' else {"x": 0, "y": 0, "z": 0}
-
         cmds = self.spawn_entity(cmds=[], rot=rot)
 
         if collision_type == 'force':
-            magnitude = random.uniform(18, 38)
             cmds.extend([
                 {"$type": "object_look_at", "other_object_id": self.o_ids[0], "id": self.o_ids[1]},
                 {"$type": "apply_force_magnitude_to_object", "magnitude": magnitude, "id": self.o_ids[1]}
@@ -319,21 +343,31 @@ class CollisionSimulator(SimulationHandler):
             self.names = {'entity0': self.entities[0], 'entity1': self.entities[1]}
 
         cmds.extend([
-            {"$type": "send_transforms", "frequency": "always"},
-            {"$type": "send_rigidbodies", "frequency": "always"},
             {"$type": "send_static_rigidbodies", "frequency": "once"},
             {"$type": "send_collisions", "enter": True, "stay": False, "exit": False, "collision_types": ["obj"]}
         ])
 
         return cmds
 
+    def get_output_data(self) -> dict:
+        """
+        Transforms of the objects whose distances decide the trial.
+        """
+        if self.trial_type == 'transitional':
+            return {"send_transforms": self.o_ids[:2]}
+        if self.trial_type == 'psychological':
+            return {"send_transforms": self.o_ids}
+        return {}
 
-if __name__ == "__main__":
-    c = CollisionSimulator()
 
+if __name__ == "__main__":
     args = build_arg_pars()
+    c = CollisionSimulator(port=args.port)
     print(console_msg('add_object_to_scene is set to False', 'warning'))
     success = c.run(num=args.num, pass_masks=args.pass_masks, room=args.room, tot_frames=args.tot_frames,
                     add_object_to_scene=False, trial_type=args.trial_type,
-                    png=args.png, save_frames=args.save_frames, save_mp4=args.save_mp4)
+                    png=args.png, save_frames=args.save_frames, save_mp4=args.save_mp4, tiles=args.tiles,
+                    resolution=args.resolution, render_quality=args.render_quality, pyramid=args.pyramid,
+                    save_trajectory=args.save_trajectory, adaptive_sampling=args.adaptive_sampling,
+                    stream=args.stream)
     print(success)
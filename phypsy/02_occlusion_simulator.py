@@ -1,12 +1,17 @@
 from typing import Union, Any
 from tdw.add_ons.third_person_camera import ThirdPersonCamera
 from simulation_handler import SimulationHandler
+from agent_planner import AgentPlan
+from camera import FIELD_OF_VIEW
 from utils import *
 from tdw.output_data import Transforms, OutputData
 from tdw.librarian import ModelLibrarian
 import numpy as np
 from copy import deepcopy
 
+# largest share of the field of view the occluder may cover
+MAX_OCCLUDER_VIEW = .75
+
 
 class OcclusionSimulator(SimulationHandler):
     def __init__(self, port=1071):
@@ -31,14 +36,15 @@ class OcclusionSimulator(SimulationHandler):
            self.occluded_entity_loc['z'] < freeze and self.direction == 'right':
             cmds = []
             if not transition_complete:
-                velocity = random.choice([random.uniform(0.01, 0.3), 0])
+                velocity = random.choice([self.sample_uniform('speed', 0.01, 0.3), 0])
                 velocity = velocity if self.direction == 'right' else -velocity
                 transition_complete = True
+                self.decision_made()
                 cmds.extend(self.freeze_rigidbody(True))
             else:
                 cmds.extend(self.freeze_rigidbody(False))
             transition.append(i)
-            cmds.extend(self.teleport_object_by(velocity))
+            cmds.append(self.teleport_object_by(velocity))
             self.communicate(cmds)
         else:
             response = self.communicate([])
@@ -46,22 +52,13 @@ class OcclusionSimulator(SimulationHandler):
                 self.occluded_entity_loc[index] = val
         return transition, transition_complete, velocity
 
-    def run_psychological_trial(self, i: int, velocity: float, total_bounds: float, agent_success: bool) -> Tuple[
-        List[int], bool]:
-        """Handle the psychological trial logic."""
-        transition = []
-        response = None  # Initialize response to avoid unresolved reference
-        if i == 0 or not agent_success:
-            response = self.communicate([])  # Fetch response to use it in the next line
-            if (self.calculate_dist(response, self.o_ids[0], self.o_ids[2]) - total_bounds) < .05:
-                cmds = [self.object_look_at(self.o_ids[2], self.o_ids[0]),
-                        self.teleport_object_by(velocity, absolute=False)]
-                response = self.communicate(cmds)
-                transition.append(i)
-        else:
-            response = self.communicate([])
-            agent_success = True
-        return transition, agent_success
+    def plan_psychological_trial(self, velocity: float) -> Tuple[AgentPlan, List[dict]]:
+        """Plan the path of the entity to the target from the positions of the first frame."""
+        agent_bounds = np.max(TDWUtils.get_bounds_extents(get_entity_by_name(self.all_names[0]).bounds)) / 2
+        target_bounds = np.max(TDWUtils.get_bounds_extents(self.target_rec.bounds)) * .2 / 2
+        plan = AgentPlan(agent_id=self.o_ids[0], target_id=self.o_ids[2], speed=velocity,
+                         stop_distance=agent_bounds + target_bounds + .05)
+        return plan, plan.plan(self.get_positions(self.communicate([]), plan.ids))
 
     def freeze_rigidbody(self, is_frozen: bool) -> List[dict]:
         """Generate commands to freeze/unfreeze the rigidbody."""
@@ -75,10 +72,6 @@ class OcclusionSimulator(SimulationHandler):
         return {"$type": "teleport_object_by", "position": {"x": 0, "y": 0, "z": velocity},
                 "id": self.o_ids[0], "absolute": absolute}
 
-    def object_look_at(self, other_object_id: int, object_id: int) -> dict:
-        """Generate look-at command."""
-        return {"$type": "object_look_at", "other_object_id": other_object_id, "id": object_id}
-
     def run_frame_by_frame(self, trial_type: str, tot_frames: int) -> Union[str, Tuple[Union[int, List[int]], bool]]:
         """
         Run the trial frame by frame.
@@ -88,6 +81,8 @@ class OcclusionSimulator(SimulationHandler):
         transition_complete = False
         transition = None if trial_type == 'physical' else []
         freeze = self.calculate_freeze_point()
+        if trial_type == 'psychological':
+            plan, cmds = self.plan_psychological_trial(velocity)
 
         for i in range(tot_frames):
             if trial_type == 'transitional':
@@ -95,8 +90,9 @@ class OcclusionSimulator(SimulationHandler):
             elif trial_type == 'physical':
                 self.communicate([])
             elif trial_type == 'psychological':
-                total_bounds = self.calculate_total_bounds()
-                transition, agent_success = self.run_psychological_trial(i, velocity, total_bounds, agent_success)
+                cmds, moved = self.step_agent_plan(plan, cmds)
+                if moved:
+                    transition.append(i)
 
             if i == 0:
                 if self.is_occluder_blocking_view():
@@ -113,7 +109,8 @@ class OcclusionSimulator(SimulationHandler):
     def set_occluder(self) -> Tuple[List[Dict[str, Any]], Tuple[Any, Any]]:
         recs, cmds = [], []
 
-        recs, bounds = get_random_entity_pair(list1=OCCLUDED_ENTITIES, list2=OCCLUDER_ENTITIES, axes=[1, 2])
+        recs, bounds = get_random_entity_pair(list1=OCCLUDED_ENTITIES, list2=OCCLUDER_ENTITIES, axes=[1, 2],
+                                              first=self.sample_choice('object', OCCLUDED_ENTITIES))
 
         self.all_names = [record.name for record in recs]
         for i, record in enumerate(recs):
@@ -123,6 +120,8 @@ class OcclusionSimulator(SimulationHandler):
             scale_factor = random.uniform(0.9, 1.1)
 
             rotation_y = random.uniform(-90, 90) if i == 0 else 0
+            if i == 1:
+                self.occluder_extents = np.array(bounds[1]) * scale_factor
             cmds.extend(self.get_add_physics_object(model_name=record.name,
                                                     library="models_core.json",
                                                     object_id=object_id,
@@ -136,12 +135,24 @@ class OcclusionSimulator(SimulationHandler):
         self.names = {'object': self.all_names[0], 'collider': self.all_names[1]}
         return cmds, bounds
 
+    def is_occluder_blocking_view(self) -> bool:
+        """Whether the occluder, seen from the camera, is wider than MAX_OCCLUDER_VIEW of the field of view."""
+        distance = max(abs(self.camera_loc['x']), 1e-3)
+        width = 2 * np.degrees(np.arctan(self.occluder_extents[2] / 2 / distance))
+        return width > MAX_OCCLUDER_VIEW * FIELD_OF_VIEW
+
+    def destroy_objects(self) -> None:
+        """Destroy the objects of the trial."""
+        destroy_cmds = self._get_destroy_cmds()
+        destroy_cmds.append({"$type": "send_rigidbodies", "frequency": "never"})
+        self.communicate(destroy_cmds)
+
     def set_camera(self) -> Tuple[Dict[str, float], Dict[str, float]]:
         """Set the camera's location and view direction."""
         look_at = {"x": 0, "y": 0, "z": 0}
         self.camera = ThirdPersonCamera(position=self.camera_loc,
                                         look_at=look_at,
-                                        avatar_id='frames_temp')
+                                        avatar_id=self.avatar_id)
         self.add_ons.append(self.camera)
         return self.camera_loc, look_at
 
@@ -174,10 +185,10 @@ class OcclusionSimulator(SimulationHandler):
     def apply_force_to_entity(self, occluded_entity_id: str) -> List[Dict[str, Any]]:
         """Apply force to the entity."""
         if self.trial_type == 'psychological':
-            magnitude = random.uniform(80, 100)
+            magnitude = self.sample_uniform('force', 80, 100)
         else:
             record_moving = get_entity_by_name(self.all_names[0])
-            magnitude = scale_force(record_moving)
+            magnitude = scale_force(record_moving, offset=self.sample_uniform('force_noise', -5, 5))
 
         return [{"$type": "object_look_at_position",
                  "position": {"x": self.occluded_entity_loc['x'],
@@ -190,6 +201,8 @@ class OcclusionSimulator(SimulationHandler):
 
     def init_trial_cmds(self) -> List[Dict[str, Any]]:
         """Initialize commands for the trial."""
+        # occluded object, occluder and, in psychological trials, the target
+        self.o_ids = [self.get_unique_id() for _ in range(3 if self.trial_type == 'psychological' else 2)]
         self.set_direction()
         self.set_entity_and_occluder_location()
         cmds, bounds = self.set_occluder()
@@ -205,36 +218,41 @@ class OcclusionSimulator(SimulationHandler):
         moving_o_id = self.o_ids[2] if self.trial_type == 'psychological' else self.o_ids[0]
         force_cmds = self.apply_force_to_entity(moving_o_id)
         cmds.extend(force_cmds)
-        cmds.extend(self.get_additional_commands())
+        cmds.append({"$type": "send_static_rigidbodies", "frequency": "once"})
 
         return cmds
 
     def set_direction(self) -> None:
         """Set the direction of the trial."""
-        self.direction = random.choice(['left', 'right'])
+        self.direction = self.sample_choice('direction', ['left', 'right'])
 
     def set_entity_and_occluder_location(self) -> None:
         """Set the locations of the entity and occluder."""
-        z = random.uniform(-5, -4) if self.direction == 'left' else random.uniform(5, 4)
-        self.occluded_entity_loc = {"x": random.uniform(-2.5, -1), "y": 0, "z": z}
-        self.occluder_z_loc = random.uniform(-.5, .5)
-
-    def get_additional_commands(self) -> List[Dict[str, Any]]:
-        """Get the common additional commands for the trial."""
-        return [{"$type": "send_transforms", "frequency": "always"},
-                {"$type": "send_rigidbodies", "frequency": "always"},
-                {"$type": "send_static_rigidbodies", "frequency": "once"}]
+        distance = self.sample_uniform('distance', 4, 5)
+        z = -distance if self.direction == 'left' else distance
+        self.occluded_entity_loc = {"x": self.sample_uniform('x', -2.5, -1), "y": 0, "z": z}
+        self.occluder_z_loc = self.sample_uniform('occluder_z', -.5, .5)
+
+    def get_output_data(self) -> Dict[str, List[int]]:
+        """Transforms of the occluded entity, and of the agent and target in psychological trials."""
+        if self.trial_type == 'transitional':
+            return {"send_transforms": [self.o_ids[0]]}
+        if self.trial_type == 'psychological':
+            return {"send_transforms": [self.o_ids[0], self.o_ids[2]]}
+        return {}
 
 
 if __name__ == "__main__":
-    c = OcclusionSimulator()
-
     args = build_arg_pars()
+    c = OcclusionSimulator(port=args.port)
     if '_mask' not in args.pass_masks:
         args.pass_masks.append('_masks')
         print(console_msg('_mask is added to pass_masks', 'warning'))
     print(console_msg('add_object_to_scene is set to False and tot_frames to 200', 'warning'))
     success = c.run(num=args.num, pass_masks=args.pass_masks, room=args.room, tot_frames=200,
                     add_object_to_scene=False, trial_type=args.trial_type,
-                    png=args.png, save_frames=args.save_frames, save_mp4=args.save_mp4)
+                    png=args.png, save_frames=args.save_frames, save_mp4=args.save_mp4, tiles=args.tiles,
+                    resolution=args.resolution, render_quality=args.render_quality, pyramid=args.pyramid,
+                    save_trajectory=args.save_trajectory, adaptive_sampling=args.adaptive_sampling,
+                    stream=args.stream)
     print(success)
\ No newline at end of file
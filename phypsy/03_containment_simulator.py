@@ -3,6 +3,7 @@ from typing import Any
 
 from tdw.add_ons.third_person_camera import ThirdPersonCamera
 from simulation_handler import SimulationHandler
+from agent_planner import AgentPlan
 from utils import *
 import numpy as np
 
@@ -15,6 +16,19 @@ class ContainmentSimulator(SimulationHandler):
         self.ctrl_id = 'containment'
         self.initialize_coordinates()
         super().__init__(port=port)
+        self.entity_records = {record.name: record for record in self.recs}
+        self.containers = self.get_fitting_containers()
+
+    def get_fitting_containers(self) -> Dict[str, List[str]]:
+        """
+        Containers larger than each contained entity along every axis, the pairs get_random_entity_pair accepts.
+        """
+        extents = {name: TDWUtils.get_bounds_extents(self.entity_records[name].bounds)
+                   for name in CONTAINED_ENTITIES + CONTAINER_ENTITIES}
+        containers = {contained: [container for container in CONTAINER_ENTITIES
+                                  if np.all(extents[container] > extents[contained])]
+                      for contained in CONTAINED_ENTITIES}
+        return {contained: fitting for contained, fitting in containers.items() if fitting}
 
     def initialize_coordinates(self):
         """
@@ -93,7 +107,7 @@ class ContainmentSimulator(SimulationHandler):
 
             if start_transition:
                 transitions.append(i + 1)
-                scaled_force = scale_force(self.o_record) * .225
+                scaled_force = scale_force(self.o_record, offset=self.sample_uniform('force_noise', -5, 5)) * .225
                 cmds = self.create_force_cmds(scaled_force)
                 transitions_skipped = 0
         return cmds
@@ -109,50 +123,25 @@ class ContainmentSimulator(SimulationHandler):
 
     def run_psychological(self, tot_frames: int, frames_until_end: int) -> tuple:
         """
-        Simulates a psychological test for a given number of frames.
+        Simulates a psychological test: after the entity settled, it moves along a precomputed path to the target.
         """
-        # Initialize variables
-        agent_success = False
         agent_bounds = np.max(TDWUtils.get_bounds_extents(self.o_record.bounds)) / 2
         target_bounds = np.max(TDWUtils.get_bounds_extents(self.target_rec.bounds)) * .2 / 2
-        total_bounds = agent_bounds + target_bounds
+        plan = AgentPlan(agent_id=self.o_ids[1], target_id=self.o_ids[2], speed=.05,
+                         stop_distance=agent_bounds + target_bounds + .05)
 
-        # Run the simulation loop
-        for i in range(tot_frames):
+        # Let the entity settle, then plan its path from where it came to rest
+        response = []
+        for _ in range(frames_until_end):
             response = self.communicate([])
-            response = self.communicate_psychological(i, total_bounds, agent_success, response, frames_until_end)
-            if (calculate_dist(response, self.o_ids[1], self.o_ids[2]) - total_bounds) < .05:
-                agent_success = True
+        cmds = plan.plan(self.get_positions(response, plan.ids))
+
+        for _ in range(frames_until_end, tot_frames):
+            cmds, _ = self.step_agent_plan(plan, cmds)
 
         # Cleanup and return results
         return self.cleanup(frames_until_end)
 
-    def communicate_psychological(self, i: int, total_bounds: float, agent_success: bool, response: dict, frames_until_end: int) -> dict:
-        """
-        Executes psychological communication commands.
-        """
-        cmds = self.get_psychological_cmds(i, total_bounds, agent_success, response, frames_until_end)
-        return self.communicate(cmds)
-
-    def get_psychological_cmds(self, i: int, total_bounds: float, agent_success: bool, response: dict, frames_until_end: int) -> list:
-        """
-        Generates psychological command sets based on current state.
-        """
-        # Initialize velocities
-        velocity, vertical_velocity = .05, .05
-        vertical_velocity -= .005 if vertical_velocity > 0 else 0
-        cmds = [{"$type": "teleport_object_by", "position": {"x": 0, "y": vertical_velocity, "z": 0},
-                 "id": self.o_ids[1], "absolute": True},
-                {"$type": "teleport_object_by", "position": {"x": 0, "y": 0, "z": velocity},
-                 "id": self.o_ids[1], "absolute": False},
-                {"$type": "object_look_at", "other_object_id": self.o_ids[2], "id": self.o_ids[1]}, ]
-
-        # Check conditions for termination or continuation
-        if (calculate_dist(response, self.o_ids[1], self.o_ids[2]) - total_bounds) < .05 or i < frames_until_end or agent_success:
-            return []
-
-        return cmds
-
     def run_physical(self, tot_frames: int, frames_until_end: int) -> tuple:
         """
         Simulates a physical test for a given number of frames.
@@ -252,7 +241,7 @@ class ContainmentSimulator(SimulationHandler):
         """
         loc = {"x": self.x + uniform(-0.8, 0.8), "y": uniform(3.1, 3.5), "z": self.z + uniform(-0.8, 0.8)}
         look_at = {"x": self.x, "y": 1.0, "z": self.z}
-        camera = ThirdPersonCamera(position=loc, look_at=look_at, avatar_id='frames_temp')
+        camera = ThirdPersonCamera(position=loc, look_at=look_at, avatar_id=self.avatar_id)
         self.add_ons.append(camera)
         return loc, look_at
 
@@ -262,9 +251,13 @@ class ContainmentSimulator(SimulationHandler):
         """
         cmds = []
 
-        entities, self.bounds = get_random_entity_pair(list1=CONTAINED_ENTITIES, list2=CONTAINER_ENTITIES)
+        # the container is drawn given the contained entity, so the sampler learns the combinations
+        contained = self.sample_choice('contained', list(self.containers))
+        container = self.sample_choice('container', self.containers[contained], given=contained)
+        entities = [self.entity_records[contained], self.entity_records[container]]
+        self.bounds = [TDWUtils.get_bounds_extents(record.bounds) for record in entities]
         h = self.foundation_height
-        y = h + random.uniform(.15, .25)
+        y = h + self.sample_uniform('height', .15, .25)
 
         container_entity_id = self.get_unique_id()
         cmds.extend(self.add_physics_object(entities[1].name, 'models_core.json', container_entity_id,
@@ -284,18 +277,27 @@ class ContainmentSimulator(SimulationHandler):
             cmds = self.spawn_target_entity(cmds)
             self.names['target'] = self.target_rec.name
 
-        cmds.extend([{"$type": "send_rigidbodies", "frequency": "always"},
-                     {"$type": "send_transforms", "frequency": "always"}])
-
         return cmds
 
+    def get_output_data(self) -> Dict[str, List[int]]:
+        """
+        Transforms of the container and entity, or of the agent and target in psychological trials.
+        """
+        if self.trial_type == 'transitional':
+            return {"send_transforms": self.o_ids[:2]}
+        if self.trial_type == 'psychological':
+            return {"send_transforms": self.o_ids[1:3]}
+        return {}
 
-if __name__ == "__main__":
-    c = ContainmentSimulator()
 
+if __name__ == "__main__":
     args = build_arg_pars()
+    c = ContainmentSimulator(port=args.port)
     print(console_msg('default: tot_frames = 200, add_object_to_scene = True', 'warning'))
     success = c.run(num=args.num, pass_masks=args.pass_masks, room=args.room, tot_frames=200,
                     add_object_to_scene=True, trial_type=args.trial_type,
-                    png=args.png, save_frames=args.save_frames, save_mp4=args.save_mp4)
+                    png=args.png, save_frames=args.save_frames, save_mp4=args.save_mp4, tiles=args.tiles,
+                    resolution=args.resolution, render_quality=args.render_quality, pyramid=args.pyramid,
+                    save_trajectory=args.save_trajectory, adaptive_sampling=args.adaptive_sampling,
+                    stream=args.stream)
     print(success)
\ No newline at end of file
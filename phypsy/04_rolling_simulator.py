@@ -2,18 +2,20 @@ from typing import Union
 
 from tdw.add_ons.third_person_camera import ThirdPersonCamera
 from simulation_handler import SimulationHandler
+from agent_planner import AgentPlan
 from utils import *
 
 
 class RollingSimulator(SimulationHandler):
-    def __init__(self):
+    def __init__(self, port: int = 1071):
         """
         Initialize the RollingSimulator with default settings.
         """
-        super().__init__(port=1071)
+        super().__init__(port=port)
         self.ctrl_id = 'rolling'
-        self.entities = ["orange", "golf", "apple"]
-        self.entities.extend(ROLLING_ENTITIES)
+        # only models of models_core.json, the library the rolling entity is added from
+        available = {record.name for record in self.recs}
+        self.entities = [name for name in ["orange", "golf", "apple"] + ROLLING_ENTITIES if name in available]
 
     def apply_transitional_force(self, response: Dict, rolling_entity_id: int, barrier_id: int) -> Tuple[List[Dict], bool]:
         """
@@ -28,21 +30,12 @@ class RollingSimulator(SimulationHandler):
                      "relative_torque": {"x": 0, "y": 0, "z": 0}}], True
         return [], False
 
-    def apply_psychological_interaction(self, response: Dict) -> List[Dict]:
+    def plan_psychological_interaction(self) -> Tuple[AgentPlan, List[Dict]]:
         """
-        Apply psychological interactions based on the current state of the simulation.
+        Plan the path of the agent up the ramp to the target from the positions of the first frame.
         """
-        commands = [{"$type": "object_look_at",
-                     "other_object_id": self.o_ids[1],
-                     "id": self.o_ids[0]},
-                    {"$type": "teleport_object_by",
-                     "position": {"x": 0, "y": 0, "z": self.velocity},
-                     "id": self.o_ids[0], "absolute": False}]
-
-        if not self.initial_response or (
-                calculate_dist(response, self.o_ids[0], self.o_ids[1]) >= .1 and not self.agent_success):
-            return commands
-        return []
+        plan = AgentPlan(agent_id=self.o_ids[0], target_id=self.o_ids[1], speed=self.velocity, stop_distance=.1)
+        return plan, plan.plan(self.get_positions(self.communicate([]), plan.ids))
 
     def destroy_entities(self) -> None:
         """
@@ -57,24 +50,26 @@ class RollingSimulator(SimulationHandler):
         Run the simulation frame by frame and handle actions based on trial type.
         """
         self.transition_started = False
-        self.scaled_force = scale_force(get_entity_by_name(self.entity_selection))
+        self.scaled_force = scale_force(get_entity_by_name(self.entity_selection),
+                                        offset=self.sample_uniform('force_noise', -5, 5))
         self.velocity = .05
-        self.initial_response = False
-        self.agent_success = False
         rolling_entity_id, barrier_id = self.o_ids[0], self.scene_o_ids[1]
 
         trial_success = True
         transitions = [] if trial_type != 'physical' else None
+        if trial_type == 'psychological':
+            plan, commands = self.plan_psychological_interaction()
 
         for i in range(tot_frames):
             try:
+                if trial_type == 'psychological':
+                    commands, moved = self.step_agent_plan(plan, commands)
+                    if moved: transitions.append(i)
+                    continue
                 if i >= 1 and trial_type == 'transitional':
                     commands, started = self.apply_transitional_force(response, rolling_entity_id, barrier_id)
                     self.transition_started = started
                     if started: transitions.append(i)
-                elif trial_type == 'psychological':
-                    commands = self.apply_psychological_interaction(response)
-                    if commands: transitions.append(i)
                 else:
                     commands = []
                 response = self.communicate(commands)
@@ -172,7 +167,7 @@ class RollingSimulator(SimulationHandler):
         z = -2 if self.trial_type == 'psychological' else -1
         loc = {"x": 0, "y": 1.2, "z": z}
         look_at = {"x": 0, "y": 0, "z": 0}
-        camera = ThirdPersonCamera(position=loc, look_at=look_at, avatar_id='frames_temp')
+        camera = ThirdPersonCamera(position=loc, look_at=look_at, avatar_id=self.avatar_id)
         self.add_ons.append(camera)
         return loc, look_at
 
@@ -183,7 +178,7 @@ class RollingSimulator(SimulationHandler):
         entity_id = self.get_unique_id()
         self.o_ids = [entity_id, self.get_unique_id()] if self.trial_type == 'psychological' else [entity_id]
         cmds = []
-        self.entity_selection = random.choice(self.entities)
+        self.entity_selection = self.sample_choice('entity', self.entities)
         self.names = {'object': self.entity_selection}
         rot_x = random.choice([80, -80]) if self.entity_selection in ROLLING_ENTITIES else 0
 
@@ -208,26 +203,32 @@ class RollingSimulator(SimulationHandler):
         cmds.extend(self._add_physics_object(self.entity_selection, 'models_core.json', entity_id,
                                              position=self.entity_loc, rotation={"x": rot_x, "y": 0, "z": 0}))
 
-        # Commands to continuously send updates about the objects and environment
-        cmds.extend([{
-            "$type": "send_transforms",
-            "frequency": "always"
-        }, {
-            "$type": "send_rigidbodies",
-            "frequency": "always"
-        }, {
+        # Commands to send the static data of the objects once, per-frame data is requested by get_output_data
+        cmds.append({
             "$type": "send_static_rigidbodies",
             "frequency": "once"
-        }])
+        })
         return cmds
 
+    def get_output_data(self) -> Dict[str, List[int]]:
+        """
+        Transforms of the rolling entity and the barrier, or of the agent and target in psychological trials.
+        """
+        if self.trial_type == 'transitional':
+            return {"send_transforms": [self.o_ids[0], self.scene_o_ids[1]]}
+        if self.trial_type == 'psychological':
+            return {"send_transforms": self.o_ids[:2]}
+        return {}
+
 
 if __name__ == "__main__":
-    c = RollingSimulator()
-
     args = build_arg_pars()
+    c = RollingSimulator(port=args.port)
     print(console_msg('add_object_to_scene is set to True', 'warning'))
     success = c.run(num=args.num, pass_masks=args.pass_masks, room=args.room, tot_frames=args.tot_frames,
                     add_object_to_scene=True, trial_type=args.trial_type,
-                    png=args.png, save_frames=args.save_frames, save_mp4=args.save_mp4)
+                    png=args.png, save_frames=args.save_frames, save_mp4=args.save_mp4, tiles=args.tiles,
+                    resolution=args.resolution, render_quality=args.render_quality, pyramid=args.pyramid,
+                    save_trajectory=args.save_trajectory, adaptive_sampling=args.adaptive_sampling,
+                    stream=args.stream)
     print(success)
\ No newline at end of file
@@ -5,13 +5,20 @@ from tdw.add_ons.third_person_camera import ThirdPersonCamera
 from random import uniform, choice
 from utils import *
 
+SPAWN_INTERVAL = 10  # frames between the spawns of the objects of one trial
+SPAWN_SPREAD = 1.5  # half width of the square the objects of one trial are spawned in
+SPAWN_HEIGHT = 4
+
 
 class ObjectShowerSimulator(SimulationHandler):
-    def __init__(self, port: int = 1071):
+    def __init__(self, port: int = 1071, objects_per_trial: int = 1):
         """
         Initialize the ObjectShowerSimulator with a set of predefined entity types.
+        With objects_per_trial > 1, every trial drops or pushes that many objects, spawned one after the other.
         """
         self.ctrl_id: str = 'shower'
+        self.objects_per_trial: int = objects_per_trial
+        self.spawn_cmds: Dict[int, List[Dict[str, Any]]] = {}
         lib = ModelLibrarian('models_core.json')
         self.recs: Dict[str, Any] = {record.name: record for record in lib.records}
 
@@ -21,18 +28,27 @@ class ObjectShowerSimulator(SimulationHandler):
         self.camera_loc: Dict[str, float] = {"x": uniform(1.0, 2), "y": uniform(1.0, 2), "z": uniform(-0.5, 1)}
         super().__init__(port=port)
 
-    def apply_force(self, cmds: Optional[List[Dict[str, Union[str, int, float, Dict[str, float]]]]] = None) -> List[Dict[str, Union[str, int, float, Dict[str, float]]]]:
+    def make_tile(self, tile_index: int, tiles: int) -> SimulationHandler:
+        """
+        Create a tile that draws from its own share of the entities, so tiles do not repeat objects.
+        """
+        tile = super().make_tile(tile_index, tiles)
+        tile.entities = self.entities[tile_index::tiles]
+        return tile
+
+    def apply_force(self, cmds: Optional[List[Dict[str, Union[str, int, float, Dict[str, float]]]]] = None,
+                    index: int = 0) -> List[Dict[str, Union[str, int, float, Dict[str, float]]]]:
         """
-        Apply force or force at a position to an entity.
+        Apply force or force at a position to the entity at index of the trial.
         """
         cmds = cmds or []
 
-        force: float = scale_force(get_entity_by_name(self.entities[0]))
+        force: float = scale_force(get_entity_by_name(self.entities[index]))
 
         if self._random_boolean():
-            self._apply_direct_force(cmds, force)
+            self._apply_direct_force(cmds, force, self.o_ids[index])
         else:
-            self._apply_positional_force(cmds, force)
+            self._apply_positional_force(cmds, force, self.o_ids[index])
 
         return cmds
 
@@ -42,7 +58,8 @@ class ObjectShowerSimulator(SimulationHandler):
         """
         return choice([True, False])
 
-    def _apply_direct_force(self, cmds: List[Dict[str, Union[str, int, float, Dict[str, float]]]], force: float) -> None:
+    def _apply_direct_force(self, cmds: List[Dict[str, Union[str, int, float, Dict[str, float]]]], force: float,
+                            object_id: int) -> None:
         """
           Applies a direct force to the object.
         """
@@ -50,22 +67,23 @@ class ObjectShowerSimulator(SimulationHandler):
             {
                 "$type": "object_look_at_position",
                 "position": self._random_position(y_fixed=True),
-                "id": self.o_ids[0]
+                "id": object_id
             },
             {
                 "$type": "apply_force_magnitude_to_object",
                 "magnitude": force,
-                "id": self.o_ids[0]
+                "id": object_id
             }
         ])
 
-    def _apply_positional_force(self, cmds: List[Dict[str, Union[str, int, float, Dict[str, float]]]], force: float) -> None:
+    def _apply_positional_force(self, cmds: List[Dict[str, Union[str, int, float, Dict[str, float]]]], force: float,
+                                object_id: int) -> None:
         """
         Applies a force at a random position to the object.
         """
         cmds.append({
             "$type": "apply_force_at_position",
-            "id": self.o_ids[0],
+            "id": object_id,
             "force": {
                 "x": force if self._random_boolean() else 0,
                 "y": force if self._random_boolean() else 0,
@@ -74,14 +92,14 @@ class ObjectShowerSimulator(SimulationHandler):
             "position": self._random_position()
         })
 
-    def _random_position(self, y_fixed: bool = False) -> Dict[str, float]:
+    def _random_position(self, y_fixed: bool = False, spread: float = 10, height: float = 10) -> Dict[str, float]:
         """
-        Returns a random position. If y_fixed is set, y is fixed at 0.
+        Returns a random position within spread on x and z and below height. If y_fixed is set, y is fixed at 0.
         """
         position: Dict[str, float] = {
-            "x": uniform(-10, 10),
-            "y": 0 if y_fixed else uniform(0, 10),
-            "z": uniform(-10, 10)
+            "x": uniform(-spread, spread),
+            "y": 0 if y_fixed else uniform(0, height),
+            "z": uniform(-spread, spread)
         }
         return position
 
@@ -90,43 +108,83 @@ class ObjectShowerSimulator(SimulationHandler):
         Set the camera to a third person view.
         """
         camera_look_at: Dict[str, int] = {"x": 0, "y": 0, "z": 0}
-        self.camera = ThirdPersonCamera(position=self.camera_loc, look_at=camera_look_at, avatar_id='frames_temp')
+        self.camera = ThirdPersonCamera(position=self.camera_loc, look_at=camera_look_at, avatar_id=self.avatar_id)
         self.add_ons.append(self.camera)
         return self.camera_loc, camera_look_at
 
-    def init_trial_cmds(self) -> List[Dict[str, Union[str, int, float, Dict[str, float]]]]:
-        """
-        Initialize trial commands based on a randomized scenario type.
-        """
-        scenario_type: List[str] = choice([['fall'], ['force'], ['fall', 'force']])
-        self.o_ids = [self.get_unique_id()]
-        cmds: List[Dict[str, Union[str, int, float, Dict[str, float]]]] = []
+    def init_trial_cmds(self) -> Union[List[Dict[str, Union[str, int, float, Dict[str, float]]]], str]:
+        """
+        Initialize trial commands based on a randomized scenario type per object. The commands of the first object
+        are returned, those of the other objects are kept in spawn_cmds for their staggered spawn frames.
+        """
+        n_objects = min(self.objects_per_trial, len(self.entities))
+        if n_objects == 0:
+            return console_msg('All entities have been used', 'error')
+        self.o_ids = [self.get_unique_id() for _ in range(n_objects)]
+        interval = min(SPAWN_INTERVAL, self.settings['tot_frames'] // (2 * n_objects))
+        self.spawn_cmds = {}
+        objects = []
+
+        for index in range(n_objects):
+            scenario_type: List[str] = choice([['fall'], ['force'], ['fall', 'force']])
+            cmds: List[Dict[str, Union[str, int, float, Dict[str, float]]]] = []
+
+            if n_objects == 1:
+                loc: Dict[str, float] = {"x": 0, "z": 0, "y": uniform(0, 4) if 'fall' in scenario_type else 0}
+            else:
+                loc = self._random_position(y_fixed='fall' not in scenario_type, spread=SPAWN_SPREAD,
+                                            height=SPAWN_HEIGHT)
+            rot: Dict[str, float] = {
+                axis: uniform(0, 360) if choice([True, False]) and 'fall' in scenario_type else 0
+                for axis in ["x", "y", "z"]
+            }
 
-        loc: Dict[str, float] = {"x": 0, "z": 0, "y": uniform(0, 4) if 'fall' in scenario_type else 0}
-        rot: Dict[str, float] = {
-            axis: uniform(0, 360) if choice([True, False]) and 'fall' in scenario_type else 0
-            for axis in ["x", "y", "z"]
-        }
+            cmds.extend(self.get_add_physics_object(model_name=self.entities[index],
+                                                    library='models_core.json',
+                                                    object_id=self.o_ids[index],
+                                                    position=loc,
+                                                    rotation=rot))
+            if 'force' in scenario_type:
+                cmds = self.apply_force(cmds, index)
 
-        cmds.extend(self.get_add_physics_object(model_name=self.entities[0],
-                                                library='models_core.json',
-                                                object_id=self.o_ids[0],
-                                                position=loc,
-                                                rotation=rot))
-        self.names = {'object': self.entities.pop(0)}
+            spawn_frame = index * interval
+            self.spawn_cmds.setdefault(spawn_frame, []).extend(cmds)
+            objects.append({'name': self.entities[index], 'id': self.o_ids[index], 'spawn_frame': spawn_frame,
+                            'scenario': scenario_type, 'position': loc, 'rotation': rot})
 
-        if 'force' in scenario_type:
-            cmds = self.apply_force(cmds)
+        self.names = {'object': objects[0]['name']}
+        if self.objects_per_trial > 1:
+            # single-object trials keep the log layout of before
+            self.names['objects'] = objects
+        del self.entities[:n_objects]
 
-        return cmds
+        return self.spawn_cmds.pop(0)
+
+    def run_frame_by_frame(self, trial_type: str, tot_frames: int) -> Tuple[Optional[str], bool]:
+        """
+        Execute the simulation frame by frame, adding the remaining objects of the trial at their spawn frames.
+        """
+        for frame in range(tot_frames):
+            self.communicate(self.spawn_cmds.pop(frame + 1, []))
+
+        destroy_cmds = self._get_destroy_cmds()
+        destroy_cmds.append({"$type": "send_rigidbodies", "frequency": "never"})
+
+        self.communicate(destroy_cmds)
+        return None, True
 
 
 if __name__ == "__main__":
-    c = ObjectShowerSimulator()
-    args = build_arg_pars()
+    args = build_arg_pars(extra_arguments=[
+        {"flags": ["--objects_per_trial"], "type": int, "default": 1,
+         "help": "Objects dropped or pushed per trial, spawned one after the other"}])
+    c = ObjectShowerSimulator(port=args.port, objects_per_trial=args.objects_per_trial)
     print(console_msg('The trial_type param is ignored', 'warning'))
     success = c.run(num=args.num, pass_masks=args.pass_masks, room=args.room, tot_frames=args.tot_frames,
                     add_object_to_scene=args.add_object_to_scene,
-                    png=args.png, save_frames=args.save_frames, save_mp4=args.save_mp4)
+                    png=args.png, save_frames=args.save_frames, save_mp4=args.save_mp4, tiles=args.tiles,
+                    resolution=args.resolution, render_quality=args.render_quality, pyramid=args.pyramid,
+                    save_trajectory=args.save_trajectory, adaptive_sampling=args.adaptive_sampling,
+                    stream=args.stream)
     print(success)
 
@@ -0,0 +1,91 @@
+"""
+Rejection-rate-driven sampling of trial parameters.
+
+Every parameter a simulator draws through SimulationHandler.sample_uniform or sample_choice is tracked per value
+region: ranges are split into equal bins, choices are tracked per option. A choice conditioned on the value of
+another parameter (e.g. the container given the contained object) is tracked under its own name per value, so the
+bins cover the combinations. After each attempt the sampler records
+whether it succeeded, and later draws prefer the regions with the higher estimated success probability. A coverage
+floor keeps a share of the probability spread uniformly over the original range, so no region is ever dropped.
+The state is kept per scenario and trial type in the batch directory and carries over to the next batch.
+"""
+
+import json
+import random
+from typing import Any, Dict, List
+
+BINS = 8
+COVERAGE_FLOOR = .25
+
+
+class AdaptiveSampler:
+    """
+    Samples parameters with weights following their success rates, estimated with a Beta(1, 1) prior per region.
+    """
+
+    def __init__(self, bins: int = BINS, floor: float = COVERAGE_FLOOR):
+        self.bins = bins
+        self.floor = floor
+        self.ranges: Dict[str, dict] = {}
+        self.choices: Dict[str, Dict[str, List[int]]] = {}
+
+    def _get_weights(self, counts: List[List[int]]) -> List[float]:
+        """Sampling probability of each region: the coverage floor plus a share of the estimated success rates."""
+        rates = [(successes + 1) / (attempts + 2) for successes, attempts in counts]
+        total = sum(rates)
+        return [self.floor / len(rates) + (1 - self.floor) * rate / total for rate in rates]
+
+    def uniform(self, name: str, low: float, high: float) -> float:
+        """Draw a value between low and high."""
+        param = self.ranges.get(name)
+        if param is None or param['low'] != low or param['high'] != high:
+            param = self.ranges[name] = {'low': low, 'high': high, 'counts': [[0, 0] for _ in range(self.bins)]}
+        weights = self._get_weights(param['counts'])
+        b = random.choices(range(self.bins), weights=weights)[0]
+        return low + (b + random.random()) * (high - low) / self.bins
+
+    def choice(self, name: str, options: List[Any]) -> Any:
+        """Choose one of the options."""
+        if not options:
+            raise ValueError(f'No options to choose {name} from')
+        counts = self.choices.setdefault(name, {})
+        weights = self._get_weights([counts.get(str(option), [0, 0]) for option in options])
+        return random.choices(options, weights=weights)[0]
+
+    def record(self, sampled: Dict[str, Any], success: bool) -> None:
+        """Record the outcome of an attempt with the given parameter values."""
+        for name, value in sampled.items():
+            if name in self.ranges:
+                param = self.ranges[name]
+                span = (param['high'] - param['low']) or 1
+                b = min(max(int((value - param['low']) / span * self.bins), 0), self.bins - 1)
+                counts = param['counts'][b]
+            else:
+                counts = self.choices.setdefault(name, {}).setdefault(str(value), [0, 0])
+            counts[0] += int(success)
+            counts[1] += 1
+
+    def get_weights(self) -> Dict[str, Any]:
+        """Current sampling probabilities, per bin for ranges and per option seen so far for choices."""
+        weights = {name: [round(w, 3) for w in self._get_weights(param['counts'])]
+                   for name, param in self.ranges.items()}
+        for name, counts in self.choices.items():
+            if counts:
+                weights[name] = dict(zip(counts, [round(w, 3) for w in self._get_weights(list(counts.values()))]))
+        return weights
+
+    def save(self, path: str) -> None:
+        with open(path, 'w') as f:
+            json.dump({'bins': self.bins, 'floor': self.floor, 'ranges': self.ranges, 'choices': self.choices}, f)
+
+    @classmethod
+    def load(cls, path: str) -> 'AdaptiveSampler':
+        """Load the state of a previous batch, or start a new sampler."""
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return cls()
+        sampler = cls(state['bins'], state['floor'])
+        sampler.ranges, sampler.choices = state['ranges'], state['choices']
+        return sampler
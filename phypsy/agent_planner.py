@@ -0,0 +1,150 @@
+"""
+Precomputed agent paths for psychological trials.
+
+Instead of reading the scene every frame to steer the agent, the whole path is planned once from the positions of
+the agent, the target and the obstacles: a straight approach towards the target, a jump arc over every obstacle in
+the way and an optional push at the end. The path is computed as one NumPy array and streamed as a single
+teleport_object per frame. The scene is only read every few frames to check that agent and target are where the
+plan expects them, and the rest of the path is replanned if they are not.
+
+All positions are local to the trial, i.e. without the cell offset of a tiled run.
+"""
+
+import numpy as np
+from typing import Dict, List, Optional
+
+CHECK_INTERVAL = 10
+DEVIATION_TOLERANCE = .15
+JUMP_CLEARANCE = .1
+JUMP_MARGIN = .15
+
+
+def plan_agent_path(start: np.ndarray, target: np.ndarray, speed: float, stop_distance: float,
+                    obstacles: Optional[np.ndarray] = None, obstacle_radii: Optional[np.ndarray] = None,
+                    obstacle_heights: Optional[np.ndarray] = None, agent_radius: float = 0.) -> np.ndarray:
+    """
+    Positions (T, 3) of an agent moving at speed per frame from start towards target until it is stop_distance
+    away. The agent jumps over every obstacle whose bounds cross its path, on a parabola peaking just above it.
+    """
+    start, target = np.asarray(start, dtype=np.float64), np.asarray(target, dtype=np.float64)
+    offset = target - start
+    distance = np.linalg.norm(offset)
+    n = int(np.ceil(max(distance - stop_distance, 0) / speed))
+    if n == 0:
+        return np.zeros((0, 3))
+
+    travelled = np.minimum(np.arange(1, n + 1) * speed, distance - stop_distance)
+    direction = offset / distance
+    path = start + travelled[:, None] * direction
+
+    if obstacles is not None and len(obstacles):
+        obstacles = np.asarray(obstacles, dtype=np.float64)
+        radii, heights = np.asarray(obstacle_radii), np.asarray(obstacle_heights)
+        ground = np.array([direction[0], 0, direction[2]])
+        ground_length = np.linalg.norm(ground) or 1
+        ground = ground / ground_length
+
+        # Distance along the ground track where each obstacle is passed, and how far it is from the track.
+        relative = (obstacles - start) * [1, 0, 1]
+        along = relative @ ground
+        across = np.linalg.norm(relative - along[:, None] * ground, axis=-1)
+        in_way = (across < radii + agent_radius) & (along > 0)
+
+        half_width = radii + agent_radius + JUMP_MARGIN
+        s = travelled * ground_length
+        arcs = 1 - ((s[:, None] - along[None]) / half_width[None]) ** 2
+        arcs = np.clip(arcs, 0, None) * (heights + JUMP_CLEARANCE)[None] * in_way[None]
+        path[:, 1] += arcs.max(axis=1)
+    return path
+
+
+class AgentPlan:
+    """
+    Streams a planned agent path as commands and replans it when agent or target deviate from the plan.
+    """
+
+    def __init__(self, agent_id: int, target_id: int, speed: float, stop_distance: float,
+                 obstacle_ids: List[int] = (), obstacle_radii: List[float] = (), obstacle_heights: List[float] = (),
+                 agent_radius: float = 0., push_force: Optional[float] = None):
+        self.agent_id = agent_id
+        self.target_id = target_id
+        self.speed = speed
+        self.stop_distance = stop_distance
+        self.obstacle_ids = list(obstacle_ids)
+        self.obstacle_radii = np.array(obstacle_radii, dtype=np.float64)
+        self.obstacle_heights = np.array(obstacle_heights, dtype=np.float64)
+        self.agent_radius = agent_radius
+        self.push_force = push_force
+        self.path = np.zeros((0, 3))
+        self.target = None
+        self.step = 0
+        self.replans = 0
+        self.done = False
+
+    @property
+    def ids(self) -> List[int]:
+        """Objects whose positions the plan is computed from."""
+        return [self.agent_id, self.target_id] + self.obstacle_ids
+
+    def plan(self, positions: Dict[int, np.ndarray]) -> List[dict]:
+        """
+        Plan the rest of the path from the current positions of agent, target and obstacles and return the commands
+        that hand the agent over to the plan.
+        """
+        self.step = 0
+        if self.agent_id not in positions or self.target_id not in positions:
+            self.path = np.zeros((0, 3))
+            return []
+
+        self.target = positions[self.target_id]
+        known = [i for i, o_id in enumerate(self.obstacle_ids) if o_id in positions]
+        obstacles = np.array([positions[self.obstacle_ids[i]] for i in known]).reshape(-1, 3)
+        self.path = plan_agent_path(positions[self.agent_id], self.target, self.speed, self.stop_distance,
+                                    obstacles, self.obstacle_radii[known], self.obstacle_heights[known],
+                                    self.agent_radius)
+        return [{"$type": "set_kinematic_state", "id": self.agent_id, "is_kinematic": True, "use_gravity": False},
+                {"$type": "object_look_at_position", "id": self.agent_id,
+                 "position": dict(zip('xyz', map(float, self.target)))}]
+
+    def get_commands(self) -> List[dict]:
+        """
+        Commands of the next frame: a teleport along the path, then the release of the agent (and the push) once
+        the path ends, then nothing.
+        """
+        if self.done:
+            return []
+        if self.step < len(self.path):
+            position = self.path[self.step]
+            self.step += 1
+            return [{"$type": "teleport_object", "id": self.agent_id,
+                     "position": dict(zip('xyz', map(float, position)))}]
+
+        self.done = True
+        cmds = [{"$type": "set_kinematic_state", "id": self.agent_id, "is_kinematic": False, "use_gravity": True}]
+        if self.push_force is not None:
+            cmds.extend([{"$type": "object_look_at", "other_object_id": self.target_id, "id": self.agent_id},
+                         {"$type": "apply_force_magnitude_to_object", "magnitude": self.push_force,
+                          "id": self.agent_id}])
+        return cmds
+
+    @property
+    def moving(self) -> bool:
+        """Whether the agent is moved along the path in the current frame."""
+        return not self.done and self.step < len(self.path)
+
+    def needs_check(self) -> bool:
+        """Whether the positions should be compared with the plan after the current frame."""
+        return self.moving and self.step > 0 and self.step % CHECK_INTERVAL == 0
+
+    def check(self, positions: Dict[int, np.ndarray]) -> List[dict]:
+        """
+        Compare the agent and target with the plan and replan if either moved away from it.
+        """
+        agent, target = positions.get(self.agent_id), positions.get(self.target_id)
+        if agent is None or target is None or np.isnan(agent).any() or np.isnan(target).any():
+            return []
+        deviation = max(np.linalg.norm(agent - self.path[self.step - 1]), np.linalg.norm(target - self.target))
+        if deviation < DEVIATION_TOLERANCE:
+            return []
+        self.replans += 1
+        return self.plan(positions)
@@ -0,0 +1,137 @@
+"""
+Vectorized 2D annotations of a trial from its _id pass.
+
+The _id frames of a trial are read as one (T, H, W, 3) array and, for every object and frame, the visible pixel
+count, bounding box, centroid and occlusion ratio are computed in bulk with NumPy. The results are saved as compact
+arrays next to the trial, so evaluation and trial filtering can use visibility without decoding the images again.
+"""
+
+import argparse
+import glob
+import numpy as np
+from PIL import Image
+from typing import Dict, Optional, Tuple
+
+CHUNK_FRAMES = 32
+
+
+def load_pass_stack(frames_dir: str, pass_mask: str = '_id') -> np.ndarray:
+    """
+    Read all frames of a pass into a (T, H, W, 3) uint8 array.
+    """
+    files = sorted(glob.glob(f'{frames_dir}/{pass_mask[1:]}_*.png'))
+    if not files:
+        return np.zeros((0, 0, 0, 3), dtype=np.uint8)
+
+    first = np.asarray(Image.open(files[0]).convert('RGB'))
+    stack = np.empty((len(files),) + first.shape, dtype=np.uint8)
+    stack[0] = first
+    for i, file in enumerate(files[1:], 1):
+        stack[i] = np.asarray(Image.open(file).convert('RGB'))
+    return stack
+
+
+def color_keys(colors: np.ndarray) -> np.ndarray:
+    """
+    Pack RGB colors of shape (..., 3) into single integers.
+    """
+    colors = colors.astype(np.int32)
+    return (colors[..., 0] << 16) | (colors[..., 1] << 8) | colors[..., 2]
+
+
+def discover_colors(stack: np.ndarray) -> np.ndarray:
+    """
+    Segmentation colors present in the stack, without the black background.
+    """
+    keys = np.unique(color_keys(stack))
+    keys = keys[keys != 0]
+    return np.stack([(keys >> 16) & 255, (keys >> 8) & 255, keys & 255], axis=-1).astype(np.uint8)
+
+
+def _annotate_chunk(stack: np.ndarray, colors: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Pixel counts, bounding boxes and centroids of the objects in a chunk of frames.
+    """
+    t, h, w, _ = stack.shape
+    k = len(colors)
+
+    # Label every pixel with the index of its object color, k for background or unknown colors.
+    keys = color_keys(colors)
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    pixel_keys = color_keys(stack)
+    pos = np.minimum(np.searchsorted(sorted_keys, pixel_keys), k - 1)
+    labels = np.where(sorted_keys[pos] == pixel_keys, order[pos], k)
+
+    # One bin per (frame, object) so a single bincount covers the whole chunk.
+    bins = (labels + np.arange(t)[:, None, None] * (k + 1)).ravel()
+    n_bins = t * (k + 1)
+    ys = np.broadcast_to(np.arange(h)[None, :, None], (t, h, w)).ravel()
+    xs = np.broadcast_to(np.arange(w)[None, None, :], (t, h, w)).ravel()
+
+    counts = np.bincount(bins, minlength=n_bins).reshape(t, k + 1)[:, :k]
+    sum_y = np.bincount(bins, weights=ys, minlength=n_bins).reshape(t, k + 1)[:, :k]
+    sum_x = np.bincount(bins, weights=xs, minlength=n_bins).reshape(t, k + 1)[:, :k]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        centroid = np.stack([sum_x / counts, sum_y / counts], axis=-1).astype(np.float32)
+
+    rows = np.bincount(bins * h + ys, minlength=n_bins * h).reshape(t, k + 1, h)[:, :k] > 0
+    cols = np.bincount(bins * w + xs, minlength=n_bins * w).reshape(t, k + 1, w)[:, :k] > 0
+    bbox = np.stack([cols.argmax(axis=-1), rows.argmax(axis=-1),
+                     w - 1 - cols[..., ::-1].argmax(axis=-1), h - 1 - rows[..., ::-1].argmax(axis=-1)], axis=-1)
+    bbox[counts == 0] = -1
+
+    return counts.astype(np.int32), bbox.astype(np.int16), centroid
+
+
+def annotate_id_stack(stack: np.ndarray, colors: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Per-object per-frame annotations of an _id stack for the given (K, 3) segmentation colors.
+
+    The occlusion ratio is the share of an object's largest visible area within the trial that is hidden in a
+    frame; objects that are never visible count as fully occluded.
+    """
+    t, k = len(stack), len(colors)
+    if k == 0 or t == 0:
+        return {'visible_pixels': np.zeros((t, k), dtype=np.int32),
+                'bbox': np.full((t, k, 4), -1, dtype=np.int16),
+                'centroid': np.full((t, k, 2), np.nan, dtype=np.float32),
+                'occlusion_ratio': np.ones((t, k), dtype=np.float16)}
+
+    chunks = [_annotate_chunk(stack[i:i + CHUNK_FRAMES], colors) for i in range(0, t, CHUNK_FRAMES)]
+    counts, bbox, centroid = (np.concatenate(arrays) for arrays in zip(*chunks))
+
+    max_counts = counts.max(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        occlusion_ratio = np.where(max_counts > 0, 1 - counts / max_counts, 1)
+
+    return {'visible_pixels': counts, 'bbox': bbox, 'centroid': centroid,
+            'occlusion_ratio': occlusion_ratio.astype(np.float16)}
+
+
+def annotate_trial(frames_dir: str, output: str, segmentation_colors: Optional[Dict[int, np.ndarray]] = None) -> bool:
+    """
+    Annotate the _id frames of a trial and save the arrays to output (.npz).
+    Without segmentation colors, every color found in the frames is treated as an object of unknown id (-1).
+    """
+    stack = load_pass_stack(frames_dir, '_id')
+    if len(stack) == 0:
+        return False
+
+    if segmentation_colors:
+        object_ids = np.array(list(segmentation_colors.keys()), dtype=np.int32)
+        colors = np.array(list(segmentation_colors.values()), dtype=np.uint8).reshape(-1, 3)
+    else:
+        colors = discover_colors(stack)
+        object_ids = np.full(len(colors), -1, dtype=np.int32)
+
+    np.savez_compressed(output, object_ids=object_ids, colors=colors, **annotate_id_stack(stack, colors))
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Annotate a trial from the frames of its _id pass.")
+    parser.add_argument("frames_dir", help="Directory containing the id_*.png frames")
+    parser.add_argument("output", help="Path of the .npz file to write")
+    args = parser.parse_args()
+    print(annotate_trial(args.frames_dir, args.output))
@@ -0,0 +1,825 @@
+"""
+Vectorized batch physics for primitive-shape versions of the phypsy scenarios.
+
+Thousands of trials are stepped at once on the CPU with NumPy, without a TDW build: every trial of a batch has the
+same number of object slots, and positions, velocities, rotations and flags are (B, N, k) arrays. The scenarios
+reproduce the logic of the five simulators (spawn ranges, force scaling, transitions and agent paths), with spheres,
+boxes and cylinders instead of the TDW models:
+
+    python batch_physics.py collision --trial_type transitional --num 10000 --batch_size 1024
+
+The physics is deliberately simple. Objects take forces as impulses as in TDW (see feasibility.py and mock_tdw.py),
+fall under gravity, slide with Coulomb friction or roll with rolling resistance on the floor and on ramps, and
+collide as axis-aligned boxes of their extents (spheres against spheres as spheres); rotations are integrated from
+the angular velocity but do not change the contact shapes. Containers are open boxes whose floor and walls hold the
+objects inside their footprint. Positions are bottom-centre pivots, like those of the TDW models.
+
+Every successful trial is saved like a TDW trial: a trajectory in the format of trajectories.py, with the shapes and
+extents of the objects added, and a row in the log.csv of the output directory with the columns of the simulators.
+"""
+
+import argparse
+import os
+import random
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+from agent_planner import plan_agent_path
+from camera import FIELD_OF_VIEW, look_at_matrix, perspective_matrix
+from simulation_handler import LOG_COLUMNS
+from utils import console_msg
+
+SPHERE, BOX, CYLINDER = 0, 1, 2
+WEDGE, CONTAINER = 3, 4  # boxes flagged as ramp or container, only in the saved shapes
+SHAPES = ['sphere', 'box', 'cylinder', 'wedge', 'container']
+GRAVITY = 9.81
+FRAME_TIME = .01  # physics time per frame, the default time step of TDW
+SUBSTEPS = 4
+FRICTION = .5  # dynamic friction of the default physic material
+ROLLING_FRICTION = .05
+RESTITUTION = .4
+BOUNCE_SPEED = .5  # slower impacts do not bounce
+ANGULAR_DRAG = 1.
+CONTACT_SLOP = 1e-3
+CONTAINER_WALL = .01
+SLEEP_SPEED = .01
+SLEEP_FRAMES = 10
+FRAMERATE = 30
+DEFAULT_SIZE = (256, 256)
+TRIAL_TYPES = ['physical', 'transitional', 'psychological']
+MAX_BATCHES = 100  # batches simulated without reaching num successful trials before generate gives up
+
+
+def euler_to_quaternion(euler: np.ndarray) -> np.ndarray:
+    """
+    Quaternions (..., 4) as x, y, z, w of Unity euler angles (..., 3) in degrees, applied in the order z, x, y.
+    """
+    half = np.radians(euler) / 2
+    c, s = np.cos(half), np.sin(half)
+    qx = np.stack([s[..., 0], 0 * s[..., 0], 0 * s[..., 0], c[..., 0]], axis=-1)
+    qy = np.stack([0 * s[..., 1], s[..., 1], 0 * s[..., 1], c[..., 1]], axis=-1)
+    qz = np.stack([0 * s[..., 2], 0 * s[..., 2], s[..., 2], c[..., 2]], axis=-1)
+    return quaternion_multiply(quaternion_multiply(qy, qx), qz)
+
+
+def quaternion_multiply(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Hamilton product of quaternions (..., 4) stored as x, y, z, w."""
+    av, aw, bv, bw = a[..., :3], a[..., 3:], b[..., :3], b[..., 3:]
+    vector = aw * bv + bw * av + np.cross(av, bv)
+    scalar = aw * bw - np.sum(av * bv, axis=-1, keepdims=True)
+    return np.concatenate([vector, scalar], axis=-1)
+
+
+def primitive_force(extents: np.ndarray, offset: np.ndarray) -> np.ndarray:
+    """
+    The force of utils.scale_force for primitives of the given extents (..., 3), whose unit scale is one over their
+    largest extent, with the noise given as offset.
+    """
+    unit_scale = 1 / np.max(extents, axis=-1)
+    return (-unit_scale * 1.9 + 48) / 1.8 + (np.prod(extents, axis=-1) * 12 + 13) / 2.1 - 3.8 + offset
+
+
+class BatchWorld:
+    """
+    State of N object slots in each of B trials. Slots that are not active take no part in the simulation.
+    """
+
+    def __init__(self, batch: int, num_objects: int):
+        shape = (batch, num_objects)
+        self.batch, self.num_objects = batch, num_objects
+        self.shape = np.full(shape, BOX, dtype=np.int64)
+        self.extents = np.full(shape + (3,), .2)
+        self.mass = np.ones(shape)
+        self.restitution = np.full(shape, RESTITUTION)
+        self.friction = np.full(shape, FRICTION)
+        self.position = np.zeros(shape + (3,))
+        self.rotation = np.tile([0., 0., 0., 1.], shape + (1,))
+        self.velocity = np.zeros(shape + (3,))
+        self.angular_velocity = np.zeros(shape + (3,))
+        self.constant_force = np.zeros(shape + (3,))
+        self.active = np.zeros(shape, dtype=bool)
+        self.static = np.zeros(shape, dtype=bool)
+        self.kinematic = np.zeros(shape, dtype=bool)
+        self.container = np.zeros(shape, dtype=bool)
+        self.ramp = np.zeros(shape, dtype=bool)  # static wedges whose top descends towards +x over their length
+        self.still_frames = np.zeros(shape, dtype=np.int64)
+        self.trials = np.arange(batch)
+
+    def add(self, slot: int, shape: np.ndarray, extents: np.ndarray, position: np.ndarray,
+            rotation: Optional[np.ndarray] = None, mask: Optional[np.ndarray] = None, static: bool = False,
+            container: bool = False, ramp: bool = False, restitution: float = RESTITUTION) -> None:
+        """
+        Add an object to a slot of the trials in mask (all by default); shape (B,), extents and position (B, 3) and
+        the euler rotation (B, 3) in degrees are given for all trials.
+        """
+        mask = np.ones(self.batch, dtype=bool) if mask is None else mask
+        self.shape[mask, slot] = np.broadcast_to(shape, (self.batch,))[mask]
+        self.extents[mask, slot] = np.broadcast_to(extents, (self.batch, 3))[mask]
+        self.position[mask, slot] = np.broadcast_to(position, (self.batch, 3))[mask]
+        if rotation is not None:
+            self.rotation[mask, slot] = euler_to_quaternion(np.broadcast_to(rotation, (self.batch, 3)))[mask]
+        self.velocity[mask, slot] = self.angular_velocity[mask, slot] = self.constant_force[mask, slot] = 0
+        self.restitution[mask, slot] = restitution
+        self.active[mask, slot] = True
+        self.static[mask, slot] = static or ramp
+        self.container[mask, slot] = container
+        self.ramp[mask, slot] = ramp
+        self.still_frames[mask, slot] = 0
+
+    @property
+    def dynamic(self) -> np.ndarray:
+        return self.active & ~self.static & ~self.kinematic
+
+    @property
+    def sleeping(self) -> np.ndarray:
+        return self.still_frames >= SLEEP_FRAMES
+
+    def push(self, slot: int, impulse: np.ndarray, mask: np.ndarray) -> None:
+        """Apply forces (B, 3) to a slot of the trials in mask as impulses, the way TDW applies forces."""
+        mask = mask & self.dynamic[:, slot]
+        self.velocity[mask, slot] += impulse[mask] / self.mass[mask, slot, None]
+        self.still_frames[mask, slot] = 0
+
+    def teleport_by(self, slot: int, offset: np.ndarray, mask: np.ndarray) -> None:
+        self.position[mask, slot] += offset[mask]
+
+    def centres(self) -> np.ndarray:
+        return self.position + self.extents * [0, .5, 0]
+
+    def step(self) -> np.ndarray:
+        """Advance all trials by one frame and return the object pairs (B, N, N) that touched during it."""
+        contacts = np.zeros((self.batch, self.num_objects, self.num_objects), dtype=bool)
+        for _ in range(SUBSTEPS):
+            contacts |= self._substep(FRAME_TIME / SUBSTEPS)
+        moving = np.linalg.norm(self.velocity, axis=-1) > SLEEP_SPEED
+        self.still_frames = np.where(moving | ~self.dynamic, 0, self.still_frames + 1)
+        return contacts
+
+    def _substep(self, dt: float) -> np.ndarray:
+        dynamic = self.dynamic[..., None]
+        acceleration = self.constant_force / self.mass[..., None] - [0, GRAVITY, 0]
+        self.velocity = np.where(dynamic, self.velocity + acceleration * dt, 0)
+        self.position = self.position + self.velocity * dt
+
+        supported = np.zeros(self.active.shape, dtype=bool)
+        normal = np.zeros(self.position.shape) + [0, 1, 0]
+        inside, over = self._resolve_containers(supported)
+        contacts = self._resolve_pairs(supported, over) | inside
+        self._resolve_supports(supported, normal)
+        self._apply_friction(supported, normal, dt)
+        return contacts
+
+    def _resolve_pairs(self, supported: np.ndarray, over: np.ndarray) -> np.ndarray:
+        """
+        Separate touching objects along the axis of least penetration and exchange momentum along it. Containers do
+        not collide as boxes with the objects over their footprint, which fall into them instead.
+        """
+        centres, half = self.centres(), self.extents / 2
+        offset = centres[:, None] - centres[:, :, None]  # from object i to object j
+        overlap = half[:, :, None] + half[:, None] - np.abs(offset)
+        touching = np.all(overlap > 0, axis=-1)
+
+        spheres = (self.shape == SPHERE)[:, :, None] & (self.shape == SPHERE)[:, None]
+        distance = np.linalg.norm(offset, axis=-1)
+        radii = half[..., 1][:, :, None] + half[..., 1][:, None]
+        touching = np.where(spheres, distance < radii, touching)
+
+        movable = self.dynamic
+        pair = self.active[:, :, None] & self.active[:, None] & (movable[:, :, None] | movable[:, None])
+        pair &= ~self.ramp[:, :, None] & ~self.ramp[:, None] & ~over & ~np.swapaxes(over, 1, 2)
+        touching &= pair & np.triu(np.ones((self.num_objects, self.num_objects), dtype=bool), k=1)
+        if not touching.any():
+            return touching
+
+        axis = np.argmin(overlap, axis=-1)
+        box_normal = np.eye(3)[axis] * np.sign(np.take_along_axis(offset, axis[..., None], axis=-1))
+        box_depth = np.take_along_axis(overlap, axis[..., None], axis=-1)[..., 0]
+        sphere_normal = offset / np.maximum(distance, 1e-9)[..., None]
+        normal = np.where(spheres[..., None], sphere_normal, box_normal)
+        depth = np.where(spheres, radii - distance, box_depth) * touching
+
+        inverse_mass = np.where(movable, 1 / self.mass, 0)
+        w_i, w_j = inverse_mass[:, :, None], inverse_mass[:, None]
+        share = np.divide(1, w_i + w_j, out=np.zeros_like(w_i + w_j), where=(w_i + w_j) > 0)
+        correction = (depth * share)[..., None] * normal
+        self.position += np.sum(correction * w_j[..., None], axis=1) - np.sum(correction * w_i[..., None], axis=2)
+
+        approach = np.sum((self.velocity[:, None] - self.velocity[:, :, None]) * normal, axis=-1)
+        restitution = (self.restitution[:, :, None] + self.restitution[:, None]) / 2
+        restitution = np.where(-approach > BOUNCE_SPEED, restitution, 0)
+        impulse = (np.where(touching & (approach < 0), -(1 + restitution) * approach, 0) * share)[..., None] * normal
+        self.velocity += np.sum(impulse * w_j[..., None], axis=1) - np.sum(impulse * w_i[..., None], axis=2)
+
+        # objects resting on top of others are supported by them
+        on_top = touching & (normal[..., 1] > .5)
+        supported |= np.any(on_top, axis=1) | np.any(touching & (normal[..., 1] < -.5), axis=2)
+        return touching | np.swapaxes(touching, 1, 2)
+
+    def _resolve_containers(self, supported: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Keep the objects inside the footprint of a container between its walls and on its floor. Returns the
+        (container, object) pairs (B, N, N) in contact this way and those of objects over the container footprint.
+        """
+        over = np.zeros((self.batch, self.num_objects, self.num_objects), dtype=bool)
+        if not self.container.any():
+            return over, over
+        half = self.extents / 2
+        offset = self.position[:, None] - self.position[:, :, None]  # from container i to object j
+        room = np.maximum(half[:, :, None] - CONTAINER_WALL - half[:, None], 0)
+        floor = self.position[:, :, 1] + CONTAINER_WALL
+        rim = self.position[:, :, None, 1] + self.extents[:, :, None, 1]
+        over = (self.container[:, :, None] & self.dynamic[:, None] & ~self.container[:, None]
+                & np.all(np.abs(offset[..., [0, 2]]) < half[:, :, None, [0, 2]], axis=-1))
+        inside = over & (self.position[:, None, :, 1] < rim) & (self.position[:, None, :, 1] > floor[:, :, None] - half[:, :, None, 1])
+        if not inside.any():
+            return inside, over
+
+        b, c, j = np.nonzero(inside)
+        clamped = np.clip(offset[b, c, j][:, [0, 2]], -room[b, c, j][:, [0, 2]], room[b, c, j][:, [0, 2]])
+        hit_wall = clamped != offset[b, c, j][:, [0, 2]]
+        self.position[b, j, 0] = self.position[b, c, 0] + clamped[:, 0]
+        self.position[b, j, 2] = self.position[b, c, 2] + clamped[:, 1]
+        self.velocity[b, j, 0] *= np.where(hit_wall[:, 0], -self.restitution[b, j], 1)
+        self.velocity[b, j, 2] *= np.where(hit_wall[:, 1], -self.restitution[b, j], 1)
+
+        on_floor = self.position[b, j, 1] <= floor[b, c] + CONTACT_SLOP
+        self.position[b, j, 1] = np.maximum(self.position[b, j, 1], floor[b, c])
+        self.velocity[b, j, 1] = np.where(on_floor, np.maximum(self.velocity[b, j, 1], 0), self.velocity[b, j, 1])
+        supported[b[on_floor], j[on_floor]] = True
+
+        touching = np.zeros_like(inside)
+        touching[b, c, j] = on_floor | hit_wall.any(axis=-1)
+        return touching, over
+
+    def _resolve_supports(self, supported: np.ndarray, normal: np.ndarray) -> None:
+        """Keep objects above the floor and the ramps and bounce them off."""
+        support = np.zeros(self.active.shape)
+        if self.ramp.any():
+            x, z = self.position[:, :, None, 0], self.position[:, :, None, 2]
+            ramp_x, ramp_z = self.position[:, None, :, 0], self.position[:, None, :, 2]
+            length, height, depth = (self.extents[:, None, :, axis] for axis in range(3))
+            over = self.ramp[:, None] & (np.abs(x - ramp_x) < length / 2) & (np.abs(z - ramp_z) < depth / 2)
+            heights = np.where(over, self.position[:, None, :, 1] +
+                               height * np.clip((ramp_x + length / 2 - x) / length, 0, 1), 0)
+            ramp = np.argmax(heights, axis=-1)
+            support = np.take_along_axis(heights, ramp[..., None], axis=-1)[..., 0]
+            angle = np.arctan2(np.take_along_axis(height[:, 0], ramp, axis=-1),
+                               np.take_along_axis(length[:, 0], ramp, axis=-1))
+            on_ramp = support > 0
+            normal[on_ramp] = np.stack([np.sin(angle), np.cos(angle), np.zeros_like(angle)], axis=-1)[on_ramp]
+
+        dynamic = self.dynamic
+        below = dynamic & (self.position[..., 1] < support)
+        self.position[..., 1] = np.where(below, support, self.position[..., 1])
+        approach = np.sum(self.velocity * normal, axis=-1)
+        bounce = np.where(-approach > BOUNCE_SPEED, 1 + self.restitution, 1)
+        self.velocity -= (np.where(below & (approach < 0), approach * bounce, 0))[..., None] * normal
+        supported |= dynamic & (self.position[..., 1] <= support + CONTACT_SLOP)
+
+    def _apply_friction(self, supported: np.ndarray, normal: np.ndarray, dt: float) -> None:
+        """Slow down supported objects along their support; spheres and cylinders roll instead of sliding."""
+        rolls = (self.shape == SPHERE) | (self.shape == CYLINDER)
+        approach = np.sum(self.velocity * normal, axis=-1, keepdims=True)
+        tangential = self.velocity - approach * normal
+        speed = np.linalg.norm(tangential, axis=-1)
+        friction = np.where(rolls, ROLLING_FRICTION, self.friction) * GRAVITY * normal[..., 1] * dt
+        scale = np.divide(np.maximum(speed - friction, 0), speed, out=np.zeros_like(speed), where=speed > 0)
+        self.velocity = np.where(supported[..., None], approach * normal + tangential * scale[..., None],
+                                 self.velocity)
+
+        radius = np.maximum(self.extents[..., 1] / 2, 1e-3)[..., None]
+        rolling = np.cross(normal, tangential * scale[..., None]) / radius
+        self.angular_velocity = np.where((supported & rolls)[..., None], rolling,
+                                         self.angular_velocity * (1 - ANGULAR_DRAG * dt))
+        self.angular_velocity[~self.dynamic] = 0
+        spin = np.concatenate([self.angular_velocity, np.zeros(self.active.shape + (1,))], axis=-1)
+        rotation = self.rotation + .5 * dt * quaternion_multiply(spin, self.rotation)
+        self.rotation = rotation / np.linalg.norm(rotation, axis=-1, keepdims=True)
+
+
+class AgentPaths:
+    """
+    Agent paths of psychological trials, planned per trial with plan_agent_path and streamed to the agents of all
+    trials at once: the agent is kinematic while it follows its path, then it is released and optionally pushed
+    towards its target.
+    """
+
+    def __init__(self, world: BatchWorld, frames: int, agent: int, target: int):
+        self.world = world
+        self.agent, self.target = agent, target
+        self.paths = np.zeros((world.batch, frames, 3))
+        self.lengths = np.zeros(world.batch, dtype=np.int64)
+        self.steps = np.zeros(world.batch, dtype=np.int64)
+        self.planned = np.zeros(world.batch, dtype=bool)
+        self.done = np.zeros(world.batch, dtype=bool)
+        self.push_force = np.full(world.batch, np.nan)
+
+    def plan(self, trials: np.ndarray, speed: float, stop_distance: np.ndarray,
+             obstacles: Optional[List[int]] = None, agent_radius: Optional[np.ndarray] = None) -> None:
+        """Plan the paths of the given trials from the current positions of agent, target and obstacles."""
+        world = self.world
+        for b in trials:
+            slots = [slot for slot in obstacles or [] if world.active[b, slot]]
+            path = plan_agent_path(world.position[b, self.agent], world.position[b, self.target], speed,
+                                   stop_distance[b], world.position[b, slots],
+                                   np.max(world.extents[b, slots], axis=-1) / 2 if slots else None,
+                                   world.extents[b, slots, 1] if slots else None,
+                                   agent_radius[b] if agent_radius is not None else 0.)[:self.paths.shape[1]]
+            self.paths[b, :len(path)] = path
+            self.lengths[b] = len(path)
+        self.planned[trials] = True
+        self.steps[trials] = 0
+        world.kinematic[trials, self.agent] = True
+
+    def step(self) -> np.ndarray:
+        """Move the agents along their paths and return the trials whose agent moved this frame."""
+        world = self.world
+        following = self.planned & ~self.done
+        moving = following & (self.steps < self.lengths)
+        b = np.flatnonzero(moving)
+        position = self.paths[b, self.steps[b]]
+        world.velocity[b, self.agent] = (position - world.position[b, self.agent]) / FRAME_TIME
+        world.position[b, self.agent] = position
+        self.steps[b] += 1
+
+        released = following & ~moving
+        world.kinematic[released, self.agent] = False
+        world.velocity[released, self.agent] = 0
+        direction = (world.position[:, self.target] - world.position[:, self.agent]) * [1, 0, 1]
+        direction /= np.maximum(np.linalg.norm(direction, axis=-1, keepdims=True), 1e-9)
+        world.push(self.agent, direction * np.nan_to_num(self.push_force)[:, None],
+                   released & ~np.isnan(self.push_force))
+        self.done |= released
+        return moving
+
+
+class BatchScenario:
+    """
+    A phypsy scenario over a batch of trials. Subclasses set up the objects in setup(), steer the trials every frame
+    in control() and decide their success in success().
+    """
+    ctrl_id = None
+    num_objects = 0
+    trial_types = TRIAL_TYPES
+
+    def __init__(self, batch: int, trial_type: str, frames: int, rng: np.random.Generator):
+        self.batch, self.trial_type, self.frames, self.rng = batch, trial_type, frames, rng
+        self.world = BatchWorld(batch, self.num_objects)
+        self.transitions = np.zeros((batch, frames), dtype=bool)
+        self.contacts = np.zeros((batch, self.num_objects, self.num_objects), dtype=bool)
+        self.roles: List[Tuple[str, int]] = []
+        self.camera_loc = np.zeros((batch, 3))
+        self.camera_look_at = np.zeros((batch, 3))
+        self.agent: Optional[AgentPaths] = None
+        self.setup()
+
+    def uniform(self, low: float, high: float, size: tuple = ()) -> np.ndarray:
+        return self.rng.uniform(low, high, (self.batch,) + size)
+
+    def choice(self, options: list, size: tuple = ()) -> np.ndarray:
+        return np.asarray(options)[self.rng.integers(0, len(options), (self.batch,) + size)]
+
+    def primitives(self, low: float, high: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Random shapes (B,) with extents (B, 3) in [low, high]; spheres and upright cylinders are round."""
+        # wedges and containers are only static scenery, the physics moves everything else as a box
+        shape = self.choice([SPHERE, BOX, CYLINDER])
+        extents = self.uniform(low, high, (3,))
+        round_shape = shape != BOX
+        extents[round_shape, 2] = extents[round_shape, 0]
+        extents[shape == SPHERE] = extents[shape == SPHERE, :1]
+        return shape, extents
+
+    def setup(self) -> None:
+        raise NotImplementedError
+
+    def control(self, frame: int) -> None:
+        pass
+
+    def success(self) -> np.ndarray:
+        return np.ones(self.batch, dtype=bool)
+
+    def run(self) -> Dict[str, np.ndarray]:
+        """Simulate all frames and return the trajectories (T, B, N, k) of the batch."""
+        world = self.world
+        frames = {name: [] for name in ['positions', 'rotations', 'velocities', 'angular_velocities', 'sleeping']}
+        for frame in range(self.frames):
+            self.control(frame)
+            self.contacts |= world.step()
+            for name, value in zip(frames, [world.position, world.rotation, world.velocity,
+                                            world.angular_velocity, world.sleeping]):
+                frames[name].append(np.where(world.active[..., None], value, np.nan) if value.ndim == 3 else
+                                    value.copy())
+        return {name: np.stack(values) for name, values in frames.items()}
+
+    def get_names(self, b: int) -> Dict[str, str]:
+        return {role: SHAPES[self.world.shape[b, slot]] for role, slot in self.roles if self.world.active[b, slot]}
+
+
+class CollisionScenario(BatchScenario):
+    """
+    Collisions of a collider pushed towards or dropped onto a patient, which dodges in transitional trials; in
+    psychological trials an agent jumps over one or two obstacles towards a target and pushes it.
+    """
+    ctrl_id = 'collision'
+    num_objects = 4  # patient or first obstacle, collider or second obstacle, agent, target
+
+    def setup(self) -> None:
+        world, batch = self.world, self.batch
+        for slot in range(2):
+            world.add(slot, *self.primitives(.1, .45), np.zeros((batch, 3)))
+        self.camera_loc[:] = [-3.0, 3.1, -3.3]
+
+        coords = [-2.2, -1.5, 1.5, 2.2]
+        collider = np.stack([self.choice(coords), np.zeros(batch), self.choice(coords)], axis=-1)
+        patient = np.stack([self.uniform(-.5, .5), np.zeros(batch), self.uniform(-.5, .5)], axis=-1)
+
+        if self.trial_type == 'psychological':
+            self._setup_psychological(collider, patient)
+            return
+
+        fall = self.rng.random(batch) < .5
+        drop = np.stack([self.uniform(-1, 1), self.uniform(3, 5), self.uniform(-1, 1)], axis=-1)
+        below = drop * [1, 0, 1] + np.stack([self.uniform(-.1, .1), np.zeros(batch), self.uniform(-.1, .1)], -1)
+        world.position[:, 0] = np.where(fall[:, None], below, patient)
+        world.position[:, 1] = np.where(fall[:, None], drop, collider)
+        rotation = np.where(self.rng.random((batch, 3)) < .5, self.uniform(0, 360, (3,)), 0)
+        world.rotation[:, 1] = np.where(fall[:, None], euler_to_quaternion(rotation), world.rotation[:, 1])
+        self.camera_look_at[:] = world.position[:, 0] * [1, 0, 1]
+
+        direction = (world.position[:, 0] - world.position[:, 1]) * [1, 0, 1]
+        direction /= np.maximum(np.linalg.norm(direction, axis=-1, keepdims=True), 1e-9)
+        world.push(1, direction * self.uniform(18, 38)[:, None], ~fall)
+
+        self.dodge = np.stack([self.choice([-.1, 0, .1]), np.zeros(batch), self.choice([-.1, 0, .1])], axis=-1)
+        self.radius_sum = np.max(world.extents[:, 0], axis=-1) / 2 + np.max(world.extents[:, 1], axis=-1) / 2
+        self.roles = [('entity0', 0), ('entity1', 1)]
+
+    def _setup_psychological(self, collider: np.ndarray, patient: np.ndarray) -> None:
+        world, batch = self.world, self.batch
+        two_obstacles = self.rng.random(batch) < .5
+        scale = self.uniform(1.3, 3.1, (2,))
+        world.position[:, 0] = np.where(two_obstacles[:, None], collider / scale[:, :1], patient)
+        world.position[:, 1] = -collider / scale[:, 1:]
+        world.active[:, 1] = two_obstacles
+        world.add(2, *self.primitives(.1, .45), collider)
+
+        displacement = self.uniform(.2, .4)[:, None]
+        target = -collider
+        target[:, [0, 2]] += np.where(target[:, [0, 2]] < 0, displacement, -displacement)
+        world.add(3, SPHERE, np.full((batch, 3), .2), target)
+        self.camera_look_at[:] = world.position[:, 0] * [1, 0, 1]
+
+        agent_radius = np.max(world.extents[:, 2], axis=-1) / 2
+        self.agent = AgentPaths(world, self.frames, agent=2, target=3)
+        self.agent.push_force = primitive_force(world.extents[:, 1], self.uniform(-5, 5))
+        self.agent.plan(np.arange(batch), .05, agent_radius + .2 * .2 / 2 + .4, obstacles=[0, 1],
+                        agent_radius=agent_radius)
+        self.roles = [('obstacle0', 0), ('obstacle1', 1), ('agent', 2), ('target', 3)]
+
+    def control(self, frame: int) -> None:
+        if self.trial_type == 'psychological':
+            self.transitions[:, frame] = self.agent.step()
+        elif self.trial_type == 'transitional':
+            world = self.world
+            gap = np.linalg.norm(world.position[:, 0] - world.position[:, 1], axis=-1) - self.radius_sum
+            dodging = gap < self.uniform(.5, .6)
+            world.teleport_by(0, self.dodge, dodging)
+            self.transitions[:, frame] = dodging
+
+    def success(self) -> np.ndarray:
+        collision = self.contacts[:, 0, 1]
+        if self.trial_type == 'physical':
+            return collision
+        if self.trial_type == 'transitional':
+            return ~collision
+        return np.ones(self.batch, dtype=bool)
+
+
+class OcclusionScenario(BatchScenario):
+    """
+    An object pushed along behind an occluder, which stops and moves back or freezes in transitional trials; in
+    psychological trials it follows a pushed target.
+    """
+    ctrl_id = 'occlusion'
+    num_objects = 3  # occluded object, occluder, target
+
+    def setup(self) -> None:
+        world, batch = self.world, self.batch
+        self.left = self.rng.random(batch) < .5
+        z = np.where(self.left, self.uniform(-5, -4), self.uniform(4, 5))
+        start = np.stack([self.uniform(-2.5, -1), np.zeros(batch), z], axis=-1)
+        self.occluder_z = self.uniform(-.5, .5)
+
+        shape, extents = self.primitives(.1, .45)
+        occluder = np.stack([self.uniform(.3, .6), np.maximum(extents[:, 1] * 1.2, self.uniform(.6, 1.5)),
+                             np.maximum(extents[:, 2] * 1.2, self.uniform(.5, 1.2))], axis=-1)
+        extents *= self.uniform(.9, 1.1)[:, None]
+        occluder *= self.uniform(.9, 1.1)[:, None]
+        world.add(0, shape, extents, start, np.stack([np.zeros(batch), self.uniform(-90, 90), np.zeros(batch)], -1))
+        world.add(1, BOX, occluder, np.stack([np.zeros(batch), np.zeros(batch), self.occluder_z], axis=-1))
+        self.roles = [('object', 0), ('collider', 1)]
+
+        self.camera_loc = np.stack([-start[:, 0], self.uniform(occluder[:, 1] / 2, occluder[:, 1]),
+                                    self.uniform(-.8, .8)], axis=-1)
+        freeze = np.abs(self.occluder_z - self.camera_loc[:, 2])
+        self.freeze = np.where(self.camera_loc[:, 2] > self.occluder_z, self.occluder_z - freeze,
+                               self.occluder_z + freeze)
+        self.frozen = np.zeros(batch, dtype=bool)
+        self.dodge = np.zeros((batch, 3))
+
+        moving = 0
+        if self.trial_type == 'psychological':
+            displacement = self.uniform(.3, 1)
+            target = start.copy()
+            target[:, 2] += np.where(self.left, extents[:, 2] / 2 + displacement, -extents[:, 2] / 2 - displacement)
+            target[:, 0] += self.uniform(-.8, .8)
+            world.add(2, SPHERE, np.full((batch, 3), .2), target)
+            self.roles.append(('target', 2))
+            moving = 2
+
+        direction = (start * [1, 0, 0] - world.position[:, moving]) * [1, 0, 1]
+        direction /= np.maximum(np.linalg.norm(direction, axis=-1, keepdims=True), 1e-9)
+        magnitude = self.uniform(80, 100) if moving else primitive_force(extents, self.uniform(-5, 5))
+        world.push(moving, direction * magnitude[:, None], np.ones(batch, dtype=bool))
+
+        if self.trial_type == 'psychological':
+            radius = np.max(extents, axis=-1) / 2
+            self.agent = AgentPaths(world, self.frames, agent=0, target=2)
+            self.agent.plan(np.arange(batch), .04, radius + .2 * .2 / 2 + .05)
+
+    def control(self, frame: int) -> None:
+        world = self.world
+        if self.trial_type == 'psychological':
+            self.transitions[:, frame] = self.agent.step()
+        elif self.trial_type == 'transitional':
+            z = world.position[:, 0, 2]
+            passed = np.where(self.left, z > self.freeze, z < self.freeze)
+            first = passed & ~self.frozen
+            speed = np.where(self.rng.random(self.batch) < .5, self.uniform(.01, .3), 0)
+            self.dodge[first, 2] = np.where(self.left, -speed, speed)[first]
+            world.velocity[first, 0] = 0
+            world.teleport_by(0, self.dodge, passed)
+            self.frozen |= first
+            self.transitions[:, frame] = passed
+
+
+class ContainmentScenario(BatchScenario):
+    """
+    An object dropped into a container on a fixed foundation; in transitional trials it jumps out once it rests
+    inside, in psychological trials it climbs out towards a target.
+    """
+    ctrl_id = 'containment'
+    num_objects = 4  # container, contained object, target, foundation
+
+    def setup(self) -> None:
+        world, batch = self.world, self.batch
+        centre = np.stack([self.uniform(-2.8, 2.8), np.zeros(batch), self.uniform(-2.8, 2.8)], axis=-1)
+        foundation = self.uniform(.25, .5, (3,))
+        world.add(3, BOX, foundation, centre, static=True)
+
+        shape, extents = self.primitives(.05, .2)
+        container = extents * self.uniform(1.3, 2.5, (3,))
+        height = foundation[:, 1] + self.uniform(.15, .25)
+        world.add(0, BOX, container, centre + height[:, None] * [0, 1, 0], self.uniform(-8, 8, (3,)), container=True)
+        world.add(1, shape, extents, centre + [0, .75, 0], self.uniform(-45, 45, (3,)))
+        self.roles = [('object', 1), ('container', 0)]
+
+        self.camera_loc = centre * [1, 0, 1] + np.stack([self.uniform(-.8, .8), self.uniform(3.1, 3.5),
+                                                         self.uniform(-.8, .8)], axis=-1)
+        self.camera_look_at = centre + [0, 1, 0]
+        self.wait = self.rng.integers(18, 43, batch)
+        self.force = primitive_force(extents, self.uniform(-5, 5)) * .225
+
+        if self.trial_type == 'psychological':
+            offset = self.uniform(.5, 1, (2,)) * np.where(self.rng.random((batch, 2)) < .5, 1, -1)
+            target = centre + np.stack([offset[:, 0], self.uniform(0, .3), offset[:, 1]], axis=-1)
+            world.add(2, SPHERE, np.full((batch, 3), .2), target)
+            self.roles.append(('target', 2))
+            self.agent = AgentPaths(world, self.frames, agent=1, target=2)
+            self.stop_distance = np.max(extents, axis=-1) / 2 + .2 * .2 / 2 + .05
+
+    def control(self, frame: int) -> None:
+        world = self.world
+        if self.trial_type == 'psychological':
+            settled = np.flatnonzero(self.wait == frame)
+            if len(settled):
+                self.agent.plan(settled, .05, self.stop_distance)
+            self.transitions[:, frame] = self.agent.step()
+        elif self.trial_type == 'transitional':
+            relative = np.abs(world.position[:, 0] - world.position[:, 1])
+            resting = np.linalg.norm(world.velocity[:, 1], axis=-1) < BOUNCE_SPEED
+            inside = (frame > self.wait) & resting & np.all(relative < world.extents[:, 0], axis=-1)
+            # TDW pushes off-centre and the torque tips the object out, here the push lifts it over the rim
+            world.push(1, self.force[:, None] * [1, 1, 1], inside)
+            self.transitions[:, frame] = inside
+
+
+class RollingScenario(BatchScenario):
+    """
+    A round object dropped onto a ramp that rolls down against a bouncy barrier, and is pushed back up in
+    transitional trials; in psychological trials it moves up the ramp to a target.
+    """
+    ctrl_id = 'rolling'
+    num_objects = 4  # rolling object, target, ramp, barrier
+    ROUND_OBJECTS = {'orange': (SPHERE, .075), 'golf': (SPHERE, .043), 'apple': (SPHERE, .08),
+                     'can': (CYLINDER, .066), 'battery': (CYLINDER, .015), 'bottle': (CYLINDER, .03)}
+
+    def setup(self) -> None:
+        world, batch = self.world, self.batch
+        kinds = list(self.ROUND_OBJECTS.values())
+        kind = self.rng.integers(0, len(kinds), batch)
+        shape = np.array([kinds[k][0] for k in kind])
+        diameter = np.array([kinds[k][1] for k in kind])
+        # cylinders lie on their side along z, as the rolling entities rotated by 80 degrees around x
+        extents = np.stack([diameter, diameter, np.where(shape == CYLINDER, diameter * 2.5, diameter)], axis=-1)
+
+        psychological = self.trial_type == 'psychological'
+        angle = np.radians(np.full(batch, 64.) if psychological else self.uniform(32, 52))
+        ramp = np.stack([np.full(batch, .89), .89 * np.tan(angle), np.full(batch, .89)], axis=-1)
+        world.add(2, BOX, ramp, np.array([-.45, 0, 0]), ramp=True)
+        if not psychological:
+            world.add(3, BOX, np.array([.1, .25, .9]), np.array([.5, 0, 0]), static=True, restitution=1.)
+
+        start = np.stack([self.uniform(-.14, -.11), self.uniform(3.8, 4.5), self.uniform(-.14, .14)], axis=-1)
+        self.camera_loc[:] = [0, 1.2, -2 if psychological else -1]
+        self.force = primitive_force(extents, self.uniform(-5, 5))
+        self.roles = [('object', 0)]
+
+        if psychological:
+            target = np.stack([self.uniform(-.425, -.375), self.uniform(1.3, 1.6), start[:, 2]], axis=-1)
+            world.add(1, SPHERE, np.full((batch, 3), .2), target)
+            start = np.stack([self.uniform(2.5, 3), self.uniform(0, .5), self.uniform(-.15, .15)], axis=-1)
+            self.roles.append(('target', 1))
+        world.add(0, shape, extents, start)
+
+        if psychological:
+            self.agent = AgentPaths(world, self.frames, agent=0, target=1)
+            self.agent.plan(np.arange(batch), .05, np.full(batch, .1))
+
+    def control(self, frame: int) -> None:
+        world = self.world
+        if self.trial_type == 'psychological':
+            self.transitions[:, frame] = self.agent.step()
+        elif self.trial_type == 'transitional' and frame >= 1:
+            close = np.linalg.norm(world.position[:, 0] - world.position[:, 3], axis=-1) < .225
+            world.constant_force[close, 0] = (-self.force[:, None] * [1, 0, 0])[close]
+            self.transitions[:, frame] = close
+
+
+class ObjectShowerScenario(BatchScenario):
+    """
+    Objects dropped, pushed or both, spawned one after the other.
+    """
+    ctrl_id = 'shower'
+    trial_types = ['physical']  # showers have no transitions or agents
+    SPAWN_INTERVAL = 10
+    SPAWN_SPREAD = 1.5
+    SPAWN_HEIGHT = 4
+
+    def __init__(self, batch: int, trial_type: str, frames: int, rng: np.random.Generator,
+                 objects_per_trial: int = 1):
+        self.num_objects = objects_per_trial
+        super().__init__(batch, trial_type, frames, rng)
+
+    def setup(self) -> None:
+        world, batch, n = self.world, self.batch, self.num_objects
+        interval = min(self.SPAWN_INTERVAL, self.frames // (2 * n))
+        self.spawn_frames = np.arange(n) * interval
+        self.camera_loc = np.stack([self.uniform(1, 2), self.uniform(1, 2), self.uniform(-.5, 1)], axis=-1)
+        self.spawns = []
+
+        for index in range(n):
+            scenario = self.rng.integers(0, 3, batch)  # fall, force, fall and force
+            fall, force = scenario != 1, scenario != 0
+            if n == 1:
+                position = np.stack([np.zeros(batch), np.where(fall, self.uniform(0, 4), 0), np.zeros(batch)], -1)
+            else:
+                position = np.stack([self.uniform(-self.SPAWN_SPREAD, self.SPAWN_SPREAD),
+                                     np.where(fall, self.uniform(0, self.SPAWN_HEIGHT), 0),
+                                     self.uniform(-self.SPAWN_SPREAD, self.SPAWN_SPREAD)], axis=-1)
+            rotation = np.where(fall[:, None] & (self.rng.random((batch, 3)) < .5), self.uniform(0, 360, (3,)), 0)
+            shape, extents = self.primitives(.1, .45)
+            world.add(index, shape, extents, position, rotation)
+            world.active[:, index] = index == 0
+
+            magnitude = primitive_force(extents, self.uniform(-5, 5))
+            towards = np.stack([self.uniform(-10, 10), np.zeros(batch), self.uniform(-10, 10)], axis=-1)
+            direct = (towards - position) * [1, 0, 1]
+            direct = direct / np.maximum(np.linalg.norm(direct, axis=-1, keepdims=True), 1e-9) * magnitude[:, None]
+            positional = np.where(self.rng.random((batch, 3)) < .5, magnitude[:, None], 0)
+            impulse = np.where((self.rng.random(batch) < .5)[:, None], direct, positional)
+            self.spawns.append((force, impulse))
+            self.roles.append((f'object{index}', index))
+
+        self.control(-1)
+
+    def control(self, frame: int) -> None:
+        for index in np.flatnonzero(self.spawn_frames == frame + 1):
+            force, impulse = self.spawns[index]
+            self.world.active[:, index] = True
+            self.world.push(index, impulse, force)
+
+
+SCENARIOS = {scenario.ctrl_id: scenario for scenario in [CollisionScenario, OcclusionScenario, ContainmentScenario,
+                                                           RollingScenario, ObjectShowerScenario]}
+
+
+def get_transitions(transitions: np.ndarray):
+    """Transition frames of a trial as logged by the simulators: a list of frames, -1 if there are none."""
+    frames = np.flatnonzero(transitions).tolist()
+    return frames if frames else -1
+
+
+def save_batch(scenario: BatchScenario, trajectories: Dict[str, np.ndarray], trials: np.ndarray, path: str,
+               size: Tuple[int, int], trial_id: int, first_trial: int) -> List[tuple]:
+    """
+    Save the trajectories of the given trials of a simulated batch in the format of trajectories.py and return
+    their log rows.
+    """
+    videos_path = f'{path}/videos/{scenario.ctrl_id}/{scenario.trial_type}'
+    os.makedirs(videos_path, exist_ok=True)
+    projection = perspective_matrix(FIELD_OF_VIEW, size[0] / size[1]).astype(np.float32)
+    world, rows = scenario.world, []
+
+    for n_trial, b in enumerate(trials, start=first_trial):
+        slots = np.flatnonzero(world.active[b])
+        camera = look_at_matrix(scenario.camera_loc[b], scenario.camera_look_at[b]).astype(np.float32)
+        trajectory_path = f'{videos_path}/{trial_id}_trial_{n_trial}_trajectory.npz'
+        np.savez_compressed(
+            trajectory_path, object_ids=slots.astype(np.int64) + 1, offset=np.zeros(3, dtype=np.float32),
+            camera_matrices=np.repeat(camera[None], scenario.frames, axis=0),
+            projection_matrices=np.repeat(projection[None], scenario.frames, axis=0),
+            shapes=np.select([world.ramp[b, slots], world.container[b, slots]], [WEDGE, CONTAINER],
+                             world.shape[b, slots]), extents=world.extents[b, slots].astype(np.float32),
+            **{name: values[:, b, slots].astype(values.dtype if name == 'sleeping' else np.float32)
+               for name, values in trajectories.items()})
+
+        rows.append((trial_id, n_trial, [], None, scenario.trial_type, scenario.get_names(b), False, [],
+                     FRAMERATE, 'empty', scenario.frames, False, False, False,
+                     get_transitions(scenario.transitions[b]),
+                     dict(zip('xyz', map(float, scenario.camera_loc[b]))),
+                     dict(zip('xyz', map(float, scenario.camera_look_at[b]))), list(size), None, trajectory_path,
+                     None, None, None))
+    return rows
+
+
+def generate(ctrl_id: str, num: int, trial_type: str = 'physical', frames: int = 200, batch_size: int = 1024,
+             path: str = 'data/batch_physics', size: Tuple[int, int] = DEFAULT_SIZE, seed: Optional[int] = None,
+             max_batches: int = MAX_BATCHES, **kwargs) -> Tuple[int, int]:
+    """
+    Simulate batches of a scenario until num trials succeeded, or max_batches batches were simulated, save them and
+    append them to the log of path. Returns the numbers of simulated and of saved trials.
+    """
+    if trial_type not in SCENARIOS[ctrl_id].trial_types:
+        raise ValueError(console_msg(f'{ctrl_id} has no {trial_type} trials, use one of '
+                                     f'{SCENARIOS[ctrl_id].trial_types}', 'error'))
+    rng = np.random.default_rng(seed)
+    trial_id = random.Random(seed).randint(10 ** 16, 10 ** 17 - 1)
+    log_path = f'{path}/log.csv'
+    os.makedirs(path, exist_ok=True)
+
+    rows, simulated = [], 0
+    for _ in range(max_batches):
+        if len(rows) >= num:
+            break
+        scenario = SCENARIOS[ctrl_id](batch_size, trial_type, frames, rng, **kwargs)
+        trajectories = scenario.run()
+        succeeded = np.flatnonzero(scenario.success())[:num - len(rows)]
+        rows.extend(save_batch(scenario, trajectories, succeeded, path, size, trial_id, len(rows)))
+        simulated += batch_size
+        print(f'{ctrl_id} {trial_type}: {len(rows)}/{num} trials, {len(succeeded)}/{batch_size} of the batch succeeded')
+
+    if len(rows) < num:
+        print(console_msg(f'{ctrl_id} {trial_type}: only {len(rows)}/{num} trials succeeded in {max_batches} '
+                          f'batches, giving up', 'warning'))
+
+    log = pd.DataFrame(rows, columns=LOG_COLUMNS)
+    log.to_csv(log_path, mode='a', header=not os.path.exists(log_path), index=False)
+    return simulated, len(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate primitive-shape phypsy trials in batches with NumPy.")
+    parser.add_argument("scenario", choices=list(SCENARIOS))
+    parser.add_argument("--trial_type", type=str, default="physical", choices=TRIAL_TYPES,
+                        help="The object shower only has physical trials")
+    parser.add_argument("--num", type=int, default=1000, help="Number of successful trials")
+    parser.add_argument("--tot_frames", type=int, default=200)
+    parser.add_argument("--batch_size", type=int, default=1024, help="Trials simulated at once")
+    parser.add_argument("--path", type=str, default="data/batch_physics", help="Output directory")
+    parser.add_argument("--resolution", type=str, default="256x256",
+                        help="WxH of the projection matrices stored with the trajectories")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--max_batches", type=int, default=MAX_BATCHES,
+                        help="Batches simulated at most before giving up on num successful trials")
+    parser.add_argument("--objects_per_trial", type=int, default=1, help="Objects per object shower trial")
+    args = parser.parse_args()
+    if args.trial_type not in SCENARIOS[args.scenario].trial_types:
+        parser.error(f'{args.scenario} has no {args.trial_type} trials')
+
+    kwargs = {'objects_per_trial': args.objects_per_trial} if args.scenario == 'shower' else {}
+    size = tuple(int(value) for value in args.resolution.split('x'))
+    simulated, saved = generate(args.scenario, args.num, args.trial_type, args.tot_frames, args.batch_size, args.path, size,
+                         args.seed, args.max_batches, **kwargs)
+    print(console_msg(f'Simulated {simulated} trials for {saved} successful ones', 'success' if saved == args.num else
+                      'warning'))
@@ -0,0 +1,175 @@
+"""
+Benchmark of the Python side of trial generation, run against the mock TDW build of mock_tdw.py.
+
+Every simulator is run for each trial type in a temporary working directory. Reported per run:
+    - setup_ms: time per trial attempt spent in init_trial_cmds and start_trial
+    - frame_overhead_ms: Python time per frame of run_frame_by_frame, without the mock build and the image capture
+    - save_ms: time per saved trial spent in save_trial (annotations, trajectory, mp4 and log)
+    - io_mb_s: throughput of the image capture add-on writing the frames
+
+Usage:
+    python benchmark.py --num 3 --simulators 01_collision_simulator,05_object_shower_simulator --json results.json
+"""
+
+import mock_tdw
+
+mock_tdw.install()
+
+import argparse
+import importlib
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import numpy as np
+from simulation_handler import SimulationHandler
+from utils import console_msg
+
+SIMULATORS = ['01_collision_simulator', '02_occlusion_simulator', '03_containment_simulator',
+              '04_rolling_simulator', '05_object_shower_simulator']
+TRIAL_TYPES = ['physical', 'transitional', 'psychological']
+RUN_SETTINGS = {'02_occlusion_simulator': {'tot_frames': 200},
+                '03_containment_simulator': {'add_object_to_scene': True, 'tot_frames': 200},
+                '04_rolling_simulator': {'add_object_to_scene': True}}
+MIN_TRANSITIONAL_FRAMES = 100  # validate_inputs rejects shorter transitional trials
+TIMED_METHODS = ['init_trial_cmds', 'start_trial', 'run_frame_by_frame', 'save_trial']
+
+
+class BenchmarkTimings:
+    """
+    Accumulated time and calls of the timed methods, with the mock build and capture time spent inside them.
+    """
+
+    def __init__(self):
+        self.time = {name: 0. for name in TIMED_METHODS}
+        self.calls = {name: 0 for name in TIMED_METHODS}
+        self.frames = {name: 0 for name in TIMED_METHODS}
+        self.mock_time = {name: 0. for name in TIMED_METHODS}
+
+
+def _timed(name: str, method):
+    def wrapper(self, *args, **kwargs):
+        _, stats = self._get_world()
+        frames, mock_time = stats.frames, stats.step_time + stats.capture_time
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            timings = self.benchmark_timings
+            timings.time[name] += time.perf_counter() - start
+            timings.calls[name] += 1
+            timings.frames[name] += stats.frames - frames
+            timings.mock_time[name] += stats.step_time + stats.capture_time - mock_time
+    return wrapper
+
+
+def get_simulator_class(module_name: str) -> type:
+    """
+    The SimulationHandler subclass defined in a simulator module.
+    """
+    module = importlib.import_module(module_name)
+    classes = [value for value in vars(module).values() if isinstance(value, type) and
+               issubclass(value, SimulationHandler) and value.__module__ == module.__name__]
+    return classes[0]
+
+
+def benchmark_run(module_name: str, trial_type: str, num: int, run_kwargs: dict) -> dict:
+    """
+    Run one simulator for num trials of a trial type and return its timings.
+    """
+    simulator_class = get_simulator_class(module_name)
+    timed_class = type(f'Timed{simulator_class.__name__}', (simulator_class,),
+                       {name: _timed(name, getattr(simulator_class, name)) for name in TIMED_METHODS})
+    simulator = timed_class()
+    simulator.benchmark_timings = timings = BenchmarkTimings()
+
+    kwargs = dict(run_kwargs, **RUN_SETTINGS.get(module_name, {}))
+    if trial_type == 'transitional' and kwargs['tot_frames'] < MIN_TRANSITIONAL_FRAMES:
+        print(console_msg(f'{module_name}: transitional trials are run with {MIN_TRANSITIONAL_FRAMES} frames', 'warning'))
+        kwargs['tot_frames'] = MIN_TRANSITIONAL_FRAMES
+    start = time.perf_counter()
+    try:
+        message = simulator.run(num=num, trial_type=trial_type, **kwargs)
+        error = None
+    except Exception as e:
+        message, error = None, f'{type(e).__name__}: {e}'
+    total = time.perf_counter() - start
+
+    _, stats = simulator._get_world()
+    attempts = max(timings.calls['init_trial_cmds'], 1)
+    trials = max(timings.calls['save_trial'], 1)
+    frames = max(timings.frames['run_frame_by_frame'], 1)
+    frame_overhead = timings.time['run_frame_by_frame'] - timings.mock_time['run_frame_by_frame']
+    return {'simulator': module_name, 'trial_type': trial_type, 'trials': timings.calls['save_trial'],
+            'attempts': timings.calls['init_trial_cmds'], 'frames': stats.frames, 'total_s': total,
+            'setup_ms': 1000 * (timings.time['init_trial_cmds'] + timings.time['start_trial']) / attempts,
+            'frame_overhead_ms': 1000 * frame_overhead / frames,
+            'mock_frame_ms': 1000 * stats.step_time / max(stats.frames, 1),
+            'save_ms': 1000 * timings.time['save_trial'] / trials,
+            'io_mb_s': stats.image_bytes / 1e6 / stats.capture_time if stats.capture_time else 0.,
+            'message': message, 'error': error}
+
+
+def is_failed(result: dict) -> bool:
+    """A run that raised, or that returned without saving a trial, e.g. after rejecting its settings."""
+    return bool(result['error']) or result['trials'] == 0
+
+
+def print_results(results: list) -> None:
+    columns = ['simulator', 'trial_type', 'trials', 'frames', 'setup_ms', 'frame_overhead_ms', 'save_ms', 'io_mb_s']
+    print(' '.join(f'{column:>18}' for column in columns))
+    for result in results:
+        if result['error']:
+            print(console_msg(f"{result['simulator']} {result['trial_type']}: {result['error']}", 'error'))
+            continue
+        if is_failed(result):
+            # the message of the simulator is already formatted
+            print(f"{result['simulator']} {result['trial_type']}: {result['message']}")
+            continue
+        print(' '.join(f'{result[column]:>18.2f}' if isinstance(result[column], float) else
+                       f'{result[column]:>18}' for column in columns))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the simulators against the mock TDW build.")
+    parser.add_argument("--num", type=int, default=3, help="Trials per simulator and trial type")
+    parser.add_argument("--simulators", type=str, default=','.join(SIMULATORS), help="Simulator modules to run")
+    parser.add_argument("--trial_types", type=str, default=','.join(TRIAL_TYPES), help="Trial types to run")
+    parser.add_argument("--tot_frames", type=int, default=200, help="Frames per trial")
+    parser.add_argument("--pass_masks", type=str, default="_img,_mask", help="Output masks")
+    parser.add_argument("--resolution", type=str, default="default", help="Render size as WxH or a preset")
+    parser.add_argument("--pyramid", type=int, default=1, help="Number of resolution levels")
+    parser.add_argument("--tiles", type=int, default=1, help="Trial instances simulated side by side")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random parameter draws")
+    parser.add_argument("--json", type=str, default=None, help="Write the results to this file")
+    args = parser.parse_args()
+
+    run_kwargs = {'pass_masks': args.pass_masks.split(','), 'room': 'empty', 'tot_frames': args.tot_frames,
+                  'png': True, 'save_frames': True, 'save_mp4': False, 'tiles': args.tiles,
+                  'resolution': args.resolution, 'pyramid': args.pyramid}
+    results = []
+    cwd = os.getcwd()
+    for module_name in args.simulators.split(','):
+        trial_types = ['physical'] if module_name == '05_object_shower_simulator' else args.trial_types.split(',')
+        for trial_type in trial_types:
+            random.seed(args.seed)
+            np.random.seed(args.seed)
+            work_dir = tempfile.mkdtemp(prefix='phypsy_benchmark_')
+            os.chdir(work_dir)
+            try:
+                results.append(benchmark_run(module_name, trial_type, args.num, run_kwargs))
+            finally:
+                os.chdir(cwd)
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    failed = [result for result in results if is_failed(result)]
+    if failed:
+        print(console_msg(f"{len(failed)} of {len(results)} benchmark runs failed", 'error'))
+        raise SystemExit(1)
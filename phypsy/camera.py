@@ -0,0 +1,36 @@
+"""
+Pinhole camera matrices of TDW avatars.
+
+The matrices follow the convention of the CameraMatrices output data of TDW, i.e. of Unity: the world to camera
+matrix looks down -z (OpenGL) and the projection maps camera space to clip space.
+"""
+
+import numpy as np
+
+FIELD_OF_VIEW = 54.43223  # default vertical field of view of a TDW avatar
+
+
+def look_at_matrix(eye: np.ndarray, target: np.ndarray) -> np.ndarray:
+    """
+    World to camera matrix of a camera at eye looking at target, with the OpenGL convention of Unity (looking down -z).
+    """
+    forward = target - eye
+    forward = forward / (np.linalg.norm(forward) or 1)
+    right = np.cross(forward, [0, 1, 0])
+    right = right / (np.linalg.norm(right) or 1)
+    up = np.cross(right, forward)
+    matrix = np.eye(4)
+    matrix[0, :3], matrix[1, :3], matrix[2, :3] = right, up, -forward
+    matrix[:3, 3] = -matrix[:3, :3] @ eye
+    return matrix
+
+
+def perspective_matrix(field_of_view: float, aspect: float, near: float = .1, far: float = 100.) -> np.ndarray:
+    """
+    Projection matrix of a perspective camera with a vertical field of view in degrees.
+    """
+    f = 1 / np.tan(np.radians(field_of_view) / 2)
+    return np.array([[f / aspect, 0, 0, 0],
+                     [0, f, 0, 0],
+                     [0, 0, (far + near) / (near - far), 2 * far * near / (near - far)],
+                     [0, 0, -1, 0]])
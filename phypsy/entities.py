@@ -47,7 +47,7 @@ CONTAINED_ENTITIES = [
     'b03_cocacola_can_cage', 'b04_3d_jar_180_gr_01', 'b03_pen_01_001', 'b03_toothbrush', 'b03_spoon_001', 'b03_pen'
 ]
 
-ROLLING_ENTITIES = ['16.9v_battery', '1.102_pepsi_can_12_fl_oz_vray', '50.b03_cocacola_can_cage', '17.aaa_battery', '91.b04_bottle_20ml', '2.104_sprite_can_12_fl_oz_vray',]
+ROLLING_ENTITIES = ['9v_battery', '102_pepsi_can_12_fl_oz_vray', 'b03_cocacola_can_cage', 'aaa_battery', 'b04_bottle_20ml', '104_sprite_can_12_fl_oz_vray']
 
 ENVIRONMENT_ENTITIES = ['pipe', 'pentagon', 'cone', 'bowl', 'platonic', 'pyramid', 'torus', 'sphere', 'dumbbell', 'octahedron', 'cube', 'cylinder', 'triangular_prism']
 
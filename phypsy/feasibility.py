@@ -0,0 +1,102 @@
+"""
+Analytic feasibility pre-check of collision trial parameters.
+
+A collision trial only shows after the whole simulation whether the objects touched (physical trials) or whether the
+patient got away after the transition (transitional trials). The pre-check approximates the sampled parameters
+instead: the moving object is a point mass with the radius of its bounds that slides with friction after the push, or
+falls freely when dropped, and the patient dodges with its sampled velocity once the moving object comes close, as
+in CollisionSimulator._run_transitional. Draws that cannot lead to the required outcome are rejected before the
+controller is touched. Many draws are evaluated at once, frame by frame, with NumPy.
+"""
+
+import numpy as np
+from functools import lru_cache
+from typing import Dict
+from tdw.tdw_utils import TDWUtils
+from utils import get_entity_by_name
+
+GRAVITY = 9.81
+FRICTION = .5  # dynamic friction of the default physic material
+FRAME_TIME = .01  # physics time per communicate, the default time step of TDW
+TRANSITION_GAP = .55  # middle of the distance range at which the patient of a transitional trial starts to dodge
+
+
+@lru_cache(maxsize=None)
+def get_bounds_radius(name: str) -> float:
+    """
+    Half the largest bounds extent of a model, the radius used for distances in the collision trials.
+    """
+    return float(np.max(TDWUtils.get_bounds_extents(get_entity_by_name(name).bounds)) / 2)
+
+
+def mover_positions(start: np.ndarray, velocity: np.ndarray, frames: int,
+                    frame_time: float = FRAME_TIME) -> np.ndarray:
+    """
+    Positions (N, T, 3) of N point masses starting at start (N, 3) with velocity (N, 3): on the ground they slide
+    and stop under friction, above it they fall freely until they reach the ground.
+    """
+    t = np.arange(1, frames + 1) * frame_time
+    speed = np.linalg.norm(velocity * [1, 0, 1], axis=-1)
+    direction = np.divide(velocity * [1, 0, 1], speed[:, None], out=np.zeros_like(velocity),
+                          where=speed[:, None] > 0)
+
+    stop_time = speed / (FRICTION * GRAVITY)
+    t_slide = np.minimum(t[None], stop_time[:, None])
+    travelled = speed[:, None] * t_slide - .5 * FRICTION * GRAVITY * t_slide ** 2
+
+    positions = start[:, None] + travelled[..., None] * direction[:, None]
+    positions[..., 1] = np.maximum(start[:, 1, None] - .5 * GRAVITY * t[None] ** 2, 0)
+    return positions
+
+
+def check_collision_draws(trial_type: str, mover_start: np.ndarray, mover_velocity: np.ndarray,
+                          patient_start: np.ndarray, radius_sum: np.ndarray, dodge_velocity: np.ndarray,
+                          frames: int) -> np.ndarray:
+    """
+    Boolean mask of the draws that can succeed. Physical trials need contact between mover and patient;
+    transitional trials need the patient to start dodging and to avoid contact afterwards.
+    All arguments are batched over the draws: positions and velocities (N, 3), radius sums (N,), and the dodge
+    velocity (N, 3) per frame of the patient.
+    """
+    movers = mover_positions(mover_start, mover_velocity, frames)
+    patient = np.array(patient_start, dtype=np.float64)
+    contact = np.zeros(len(patient), dtype=bool)
+    transitioned = np.zeros(len(patient), dtype=bool)
+
+    for frame in range(frames):
+        gap = np.linalg.norm(movers[:, frame] - patient, axis=-1) - radius_sum
+        contact |= gap <= 0
+        if trial_type != 'transitional':
+            continue
+        dodging = gap < TRANSITION_GAP
+        transitioned |= dodging
+        patient += dodge_velocity * dodging[:, None]
+
+    if trial_type == 'physical':
+        return contact
+    if trial_type == 'transitional':
+        return transitioned & ~contact
+    return np.ones(len(patient), dtype=bool)
+
+
+class PrecheckStats:
+    """
+    Accepted and rejected draws of a run.
+    """
+
+    def __init__(self):
+        self.accepted = 0
+        self.rejected = 0
+
+    def record(self, accepted: np.ndarray) -> None:
+        self.accepted += int(accepted.sum())
+        self.rejected += int((~accepted).sum())
+
+    def as_dict(self) -> Dict[str, float]:
+        total = self.accepted + self.rejected
+        return {'accepted': self.accepted, 'rejected': self.rejected,
+                'rejection_rate': self.rejected / total if total else 0.}
+
+    def __str__(self) -> str:
+        stats = self.as_dict()
+        return f"accepted {stats['accepted']}, rejected {stats['rejected']} ({stats['rejection_rate']:.0%})"
@@ -0,0 +1,272 @@
+"""
+Declarative generation plans and a retry-aware scheduler.
+
+A plan file (JSON, or YAML if PyYAML is installed) lists target trial counts per (scenario, trial_type, room) cell
+together with the render and pass options of the run:
+
+    {
+        "output": "data/plan",
+        "workers": 4,
+        "options": {"resolution": "256x256", "pass_masks": "_img,_id", "tot_frames": 200},
+        "cells": [
+            {"scenario": "collision", "trial_type": "physical", "room": "empty", "count": 100},
+            {"scenario": "containment", "trial_type": "transitional", "count": 40, "options": {"tiles": 4}}
+        ]
+    }
+
+Cells are generated in chunks, each chunk a simulator process in its own directory below the output directory and
+with its own build port, so workers never share a log or a frames directory. The scheduler measures the wall time per
+accepted trial of every cell, which includes its retries, and gives each free worker to the cell with the most
+estimated remaining time per worker. Chunks are sized to take about chunk_seconds, so all cells finish at about the
+same time. The logs of all chunks are merged into the log.csv of the output directory.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+import pandas as pd
+from typing import Dict, List, Optional
+from utils import console_msg
+
+SCENARIOS = {'collision': '01_collision_simulator.py', 'occlusion': '02_occlusion_simulator.py',
+             'containment': '03_containment_simulator.py', 'rolling': '04_rolling_simulator.py',
+             'object_shower': '05_object_shower_simulator.py'}
+DEFAULT_OPTIONS = {'framerate': 30, 'pass_masks': '_img,_mask', 'png': True, 'tot_frames': 200,
+                   'add_object_to_scene': False, 'save_frames': True, 'save_mp4': False, 'tiles': 1,
+                   'resolution': 'default', 'render_quality': 5, 'pyramid': 1, 'save_trajectory': True,
+                   'adaptive_sampling': True}
+PATH_COLUMNS = ['videos_path', 'frames_path', 'annotations_path', 'trajectory_path']
+PROBE_TRIALS = 2
+CHUNK_SECONDS = 600
+MAX_FAILED_CHUNKS = 3
+POLL_INTERVAL = 1.
+
+
+def build_command(script: str, trial_type: str, num: int, room: str, options: dict,
+                  port: Optional[int] = None) -> List[str]:
+    """
+    Command line of a simulator run with the given options, in the format of build_arg_pars.
+    """
+    options = dict(DEFAULT_OPTIONS, **options)
+    cmd = [sys.executable, script, '--trial_type', trial_type, '--num', str(num), '--room', room]
+    for name in ['framerate', 'pass_masks', 'png', 'tot_frames', 'add_object_to_scene', 'save_frames', 'save_mp4',
+                 'tiles', 'resolution', 'render_quality', 'pyramid']:
+        cmd.extend([f'--{name}', str(options[name])])
+    if not options['save_trajectory']:
+        cmd.append('--no_trajectory')
+    if not options['adaptive_sampling']:
+        cmd.append('--no_adaptive_sampling')
+    if port is not None:
+        cmd.extend(['--port', str(port)])
+    return cmd
+
+
+def load_plan(path: str) -> dict:
+    """
+    Read a plan file and fill in the defaults.
+    """
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError(console_msg('Reading YAML plans requires PyYAML, use a JSON plan instead', 'error'))
+            plan = yaml.safe_load(f)
+        else:
+            plan = json.load(f)
+
+    plan.setdefault('output', 'data/plan')
+    plan.setdefault('workers', 1)
+    plan.setdefault('port', 1071)
+    plan.setdefault('chunk_seconds', CHUNK_SECONDS)
+    plan.setdefault('options', {})
+    for cell in plan['cells']:
+        if cell['scenario'] not in SCENARIOS and cell['scenario'] not in SCENARIOS.values():
+            raise ValueError(console_msg(f"Unknown scenario {cell['scenario']}, use one of {list(SCENARIOS)}",
+                                         'error'))
+        unknown = set(cell.get('options', {})) - set(DEFAULT_OPTIONS)
+        if unknown:
+            raise ValueError(console_msg(f'Unknown options {sorted(unknown)}', 'error'))
+        cell.setdefault('room', 'empty')
+        cell.setdefault('trial_type', 'physical')
+    return plan
+
+
+class PlanCell:
+    """
+    Target and progress of one (scenario, trial_type, room) cell of a plan.
+    """
+
+    def __init__(self, scenario: str, trial_type: str, room: str, count: int, options: dict):
+        self.script = SCENARIOS.get(scenario, scenario)
+        self.scenario = scenario
+        self.trial_type = trial_type
+        self.room = room
+        self.count = count
+        self.options = options
+        self.done = 0
+        self.running = 0
+        self.in_flight = 0
+        self.attempts = 0
+        self.seconds = 0.
+        self.chunks = 0
+        self.failed_chunks = 0
+        self.sampler_state = None
+
+    @property
+    def name(self) -> str:
+        return f'{self.scenario}_{self.trial_type}_{self.room}'.replace('.py', '')
+
+    @property
+    def pending(self) -> int:
+        return 0 if self.failed_chunks >= MAX_FAILED_CHUNKS else self.count - self.done - self.in_flight
+
+    def cost(self, default: float) -> float:
+        """Wall time per accepted trial, including the attempts that were retried."""
+        return self.seconds / self.done if self.done else default
+
+    def retry_rate(self) -> float:
+        return 1 - self.done / self.attempts if self.attempts else 0.
+
+    def as_dict(self) -> dict:
+        return {'cell': self.name, 'count': self.count, 'done': self.done, 'attempts': self.attempts,
+                'retry_rate': round(self.retry_rate(), 3), 'seconds': round(self.seconds, 1),
+                'seconds_per_trial': round(self.cost(0.), 2), 'chunks': self.chunks,
+                'failed_chunks': self.failed_chunks}
+
+
+class PlanScheduler:
+    """
+    Runs the cells of a plan on a fixed number of workers, allocated by the remaining time of each cell.
+    """
+
+    def __init__(self, plan: dict, phypsy_dir: str):
+        self.plan = plan
+        self.phypsy_dir = phypsy_dir
+        self.output = os.path.abspath(plan['output'])
+        self.cells = [PlanCell(cell['scenario'], cell['trial_type'], cell['room'], cell['count'],
+                               dict(plan['options'], **cell.get('options', {}))) for cell in plan['cells']]
+        self.free_ports = [plan['port'] + worker for worker in range(plan['workers'])]
+        self.jobs = []
+
+    def _default_cost(self) -> float:
+        """Cost assumed for cells without finished chunks: the mean of the measured cells."""
+        costs = [cell.cost(0.) for cell in self.cells if cell.done]
+        return sum(costs) / len(costs) if costs else 1.
+
+    def next_cell(self) -> Optional[PlanCell]:
+        """The cell with the most remaining time per worker if it gets one more worker."""
+        default = self._default_cost()
+        cells = [cell for cell in self.cells if cell.pending > 0]
+        if not cells:
+            return None
+        return max(cells, key=lambda cell: cell.pending * cell.cost(default) / (cell.running + 1))
+
+    def chunk_size(self, cell: PlanCell) -> int:
+        """Trials of the next chunk of a cell, sized to take about chunk_seconds once its cost is known."""
+        if not cell.done:
+            return min(cell.pending, PROBE_TRIALS)
+        return max(1, min(cell.pending, round(self.plan['chunk_seconds'] / cell.cost(1.))))
+
+    def launch(self, cell: PlanCell) -> None:
+        num = self.chunk_size(cell)
+        port = self.free_ports.pop(0)
+        work_dir = f'{self.output}/{cell.name}/chunk_{cell.chunks:03}'
+        os.makedirs(f'{work_dir}/data/batch', exist_ok=True)
+        if cell.sampler_state:
+            shutil.copy(cell.sampler_state, f'{work_dir}/data/batch')
+
+        cmd = build_command(os.path.join(self.phypsy_dir, cell.script), cell.trial_type, num, cell.room,
+                            cell.options, port)
+        print(' '.join(cmd))
+        with open(f'{work_dir}/stdout.txt', 'w') as stdout:
+            process = subprocess.Popen(cmd, cwd=work_dir, stdout=stdout, stderr=subprocess.STDOUT)
+        cell.chunks += 1
+        cell.running += 1
+        cell.in_flight += num
+        self.jobs.append({'process': process, 'cell': cell, 'num': num, 'port': port, 'work_dir': work_dir,
+                          'start': time.time()})
+
+    def finish(self, job: dict) -> None:
+        """Account the trials and attempts of a finished chunk to its cell."""
+        cell = job['cell']
+        cell.running -= 1
+        cell.in_flight -= job['num']
+        cell.seconds += time.time() - job['start']
+        self.free_ports.append(job['port'])
+
+        trials, attempts = 0, 0
+        try:
+            log = pd.read_csv(f"{job['work_dir']}/data/batch/log.csv", index_col=False)
+            trials = len(log)
+            attempts = int(log['attempts'].fillna(1).sum()) if 'attempts' in log else trials
+        except FileNotFoundError:
+            pass
+        cell.done += trials
+        cell.attempts += attempts
+
+        sampler_states = [name for name in os.listdir(f"{job['work_dir']}/data/batch") if name.startswith('sampler_')]
+        if sampler_states:
+            cell.sampler_state = f"{job['work_dir']}/data/batch/{sampler_states[0]}"
+
+        if trials == 0:
+            cell.failed_chunks += 1
+            print(console_msg(f"Chunk of {cell.name} produced no trials (exit code {job['process'].returncode}), "
+                              f"see {job['work_dir']}/stdout.txt", 'error'))
+        else:
+            cell.failed_chunks = 0
+        print(f'{cell.name}: {cell.done}/{cell.count} trials, retry rate {cell.retry_rate():.0%}, '
+              f'{cell.cost(0.):.1f} s per trial')
+
+    def run(self) -> List[dict]:
+        """Run the plan to completion and return the statistics of every cell."""
+        while True:
+            while self.free_ports and self.next_cell() is not None:
+                self.launch(self.next_cell())
+            if not self.jobs:
+                break
+            time.sleep(POLL_INTERVAL)
+            for job in [job for job in self.jobs if job['process'].poll() is not None]:
+                self.jobs.remove(job)
+                self.finish(job)
+
+        for cell in self.cells:
+            if cell.done < cell.count:
+                print(console_msg(f'{cell.name} stopped at {cell.done}/{cell.count} trials after '
+                                  f'{MAX_FAILED_CHUNKS} chunks without trials', 'error'))
+        self.merge_logs()
+        stats = [cell.as_dict() for cell in self.cells]
+        with open(f'{self.output}/schedule.json', 'w') as f:
+            json.dump(stats, f, indent=2)
+        return stats
+
+    def merge_logs(self) -> None:
+        """Merge the logs of all chunks into the log of the output directory, with paths relative to it."""
+        logs = []
+        for cell in self.cells:
+            for chunk in range(cell.chunks):
+                chunk_dir = f'{cell.name}/chunk_{chunk:03}'
+                try:
+                    log = pd.read_csv(f'{self.output}/{chunk_dir}/data/batch/log.csv', index_col=False)
+                except FileNotFoundError:
+                    continue
+                for column in PATH_COLUMNS:
+                    if column in log:
+                        log[column] = log[column].map(
+                            lambda path: f'{chunk_dir}/{path}' if isinstance(path, str) else path)
+                log['cell'] = cell.name
+                logs.append(log)
+        if logs:
+            pd.concat(logs, ignore_index=True).to_csv(f'{self.output}/log.csv', index=False)
+
+
+def run_plan(path: str) -> Dict[str, dict]:
+    """
+    Run the plan file at path with the simulators next to this module.
+    """
+    plan = load_plan(path)
+    stats = PlanScheduler(plan, os.path.dirname(os.path.abspath(__file__))).run()
+    return {cell['cell']: cell for cell in stats}
@@ -0,0 +1,588 @@
+"""
+Stand-in for a TDW build, so the Python side of trial generation can run on machines without one.
+
+MockController answers communicate() with synthetic output data from a simple kinematic model: objects fall under
+gravity, bounce off the floor, take forces as impulses and collide as spheres of their bounds. Transforms, Rigidbodies,
+StaticRigidbodies, Collision, SegmentationColors, CameraMatrices and Images are sent with the same type ids and
+request semantics (frequency, ids) as TDW, and ImageCapture writes placeholder images of the requested passes.
+
+The payloads carry the TDW type id at the same offset, so OutputData.get_data_type_id() works unchanged, but their
+body is a compact NumPy layout instead of TDW's FlatBuffers tables; install() swaps the readers of tdw.output_data for
+ones that parse it. Call install() before the simulators are imported:
+
+    import mock_tdw
+    mock_tdw.install()
+    from simulation_handler import SimulationHandler
+"""
+
+import io
+import json
+import struct
+import sys
+import time
+import numpy as np
+from typing import Dict, List, Tuple, Union
+from PIL import Image
+from scipy.spatial.transform import Rotation
+from tdw.controller import Controller
+from tdw.librarian import ModelLibrarian
+from tdw.add_ons.image_capture import ImageCapture
+import tdw.output_data
+from camera import FIELD_OF_VIEW, look_at_matrix, perspective_matrix
+
+HEADER = struct.Struct('<I4sI')  # reserved, type id as at bytes 4:8 of TDW output data, length of the meta data
+GRAVITY = np.array([0, -9.81, 0])
+DRAG = .3
+FLOOR_FRICTION = .9
+RESTITUTION = .4
+SLEEP_SPEED = .01
+SLEEP_FRAMES = 10
+DEFAULT_RADIUS = .25
+DEFAULT_SCREEN_SIZE = (256, 256)
+MODEL_LIBRARIES = ['models_core.json', 'models_full.json', 'models_flex.json']
+PASS_COLORS = {'_img': (128, 128, 128), '_albedo': (160, 160, 160), '_id': (0, 0, 0), '_mask': (0, 0, 0),
+               '_category': (0, 0, 0), '_flow': (128, 128, 128), '_depth': (255, 255, 255)}
+
+
+def pack_output_data(type_id: str, meta: dict = None, **arrays: np.ndarray) -> bytes:
+    """
+    Pack arrays and JSON meta data into an output data payload with the given four-letter type id.
+    """
+    meta = dict(meta or {})
+    layout, chunks, offset = {}, [], 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        layout[name] = [array.dtype.str, list(array.shape), offset]
+        chunks.append(array.tobytes())
+        offset += array.nbytes
+    meta['_arrays'] = layout
+    meta_bytes = json.dumps(meta).encode('utf-8')
+    return HEADER.pack(0, type_id.encode('utf-8'), len(meta_bytes)) + meta_bytes + b''.join(chunks)
+
+
+def unpack_output_data(data: bytes) -> Tuple[dict, Dict[str, np.ndarray]]:
+    """
+    Meta data and read-only array views of a payload written by pack_output_data().
+    """
+    _, _, meta_length = HEADER.unpack_from(data)
+    meta = json.loads(data[HEADER.size:HEADER.size + meta_length].decode('utf-8'))
+    start = HEADER.size + meta_length
+    arrays = {}
+    for name, (dtype, shape, offset) in meta.pop('_arrays').items():
+        count = int(np.prod(shape))
+        arrays[name] = np.frombuffer(data, dtype=dtype, count=count, offset=start + offset).reshape(shape) \
+            if count else np.zeros(shape, dtype=dtype)
+    return meta, arrays
+
+
+class MockOutputData:
+    """
+    Base of the readers of mock payloads.
+    """
+
+    def __init__(self, b: bytes):
+        self.bytes = b
+        self.meta, self.arrays = unpack_output_data(b)
+
+    def get_num(self) -> int:
+        return len(self.arrays['ids'])
+
+    def get_id(self, index: int) -> int:
+        return int(self.arrays['ids'][index])
+
+
+class MockTransforms(MockOutputData):
+    def get_position(self, index: int) -> np.ndarray:
+        return self.arrays['positions'][index]
+
+    def get_rotation(self, index: int) -> np.ndarray:
+        return self.arrays['rotations'][index]
+
+    def get_forward(self, index: int) -> np.ndarray:
+        return self.arrays['forwards'][index]
+
+
+class MockRigidbodies(MockOutputData):
+    def get_velocity(self, index: int) -> np.ndarray:
+        return self.arrays['velocities'][index]
+
+    def get_angular_velocity(self, index: int) -> np.ndarray:
+        return self.arrays['angular_velocities'][index]
+
+    def get_sleeping(self, index: int) -> bool:
+        return bool(self.arrays['sleeping'][index])
+
+
+class MockStaticRigidbodies(MockOutputData):
+    def get_mass(self, index: int) -> float:
+        return float(self.arrays['masses'][index])
+
+    def get_kinematic(self, index: int) -> bool:
+        return bool(self.arrays['kinematic'][index])
+
+    def get_dynamic_friction(self, index: int) -> float:
+        return FLOOR_FRICTION
+
+    def get_static_friction(self, index: int) -> float:
+        return FLOOR_FRICTION
+
+    def get_bounciness(self, index: int) -> float:
+        return RESTITUTION
+
+
+class MockCollision(MockOutputData):
+    def get_collider_id(self) -> int:
+        return self.meta['collider_id']
+
+    def get_collidee_id(self) -> int:
+        return self.meta['collidee_id']
+
+    def get_state(self) -> str:
+        return self.meta['state']
+
+    def get_relative_velocity(self) -> np.ndarray:
+        return self.arrays['relative_velocity']
+
+    def get_impulse(self) -> np.ndarray:
+        return self.arrays['impulse']
+
+    def get_num_contacts(self) -> int:
+        return len(self.arrays['points'])
+
+    def get_contact_point(self, index: int) -> np.ndarray:
+        return self.arrays['points'][index]
+
+    def get_contact_normal(self, index: int) -> np.ndarray:
+        return self.arrays['normals'][index]
+
+
+class MockSegmentationColors(MockOutputData):
+    def get_object_id(self, index: int) -> int:
+        return self.get_id(index)
+
+    def get_object_color(self, index: int) -> np.ndarray:
+        return self.arrays['colors'][index]
+
+    def get_object_name(self, index: int) -> str:
+        return self.meta['names'][index]
+
+    def get_object_category(self, index: int) -> str:
+        return self.meta['names'][index]
+
+
+class MockCameraMatrices(MockOutputData):
+    def get_avatar_id(self) -> str:
+        return self.meta['avatar_id']
+
+    def get_sensor_name(self) -> str:
+        return 'SensorContainer'
+
+    def get_camera_matrix(self) -> np.ndarray:
+        return self.arrays['camera_matrix']
+
+    def get_projection_matrix(self) -> np.ndarray:
+        return self.arrays['projection_matrix']
+
+
+class MockImages(MockOutputData):
+    def get_avatar_id(self) -> str:
+        return self.meta['avatar_id']
+
+    def get_sensor_name(self) -> str:
+        return 'SensorContainer'
+
+    def get_num_passes(self) -> int:
+        return len(self.meta['passes'])
+
+    def get_pass_mask(self, index: int) -> str:
+        return self.meta['passes'][index]
+
+    def get_extension(self, index: int) -> str:
+        return self.meta['extensions'][index]
+
+    def get_image(self, index: int) -> np.ndarray:
+        # encoded bytes as a uint8 array, like tdw.output_data.Images
+        return self.arrays[f'image_{index}']
+
+    def get_width(self) -> int:
+        return self.meta['width']
+
+    def get_height(self) -> int:
+        return self.meta['height']
+
+
+READERS = {'Transforms': MockTransforms, 'Rigidbodies': MockRigidbodies, 'StaticRigidbodies': MockStaticRigidbodies,
+           'Collision': MockCollision, 'SegmentationColors': MockSegmentationColors,
+           'CameraMatrices': MockCameraMatrices, 'Images': MockImages}
+
+
+class MockBody:
+    """
+    Kinematic state of an object in the mock scene.
+    """
+
+    def __init__(self, object_id: int, name: str, position: Dict[str, float], rotation: Dict[str, float],
+                 radius: float):
+        self.id = object_id
+        self.name = name
+        self.position = np.array([position.get(axis, 0) for axis in 'xyz'], dtype=np.float64)
+        self.rotation = Rotation.from_euler('xyz', [rotation.get(axis, 0) for axis in 'xyz'], degrees=True)
+        self.velocity = np.zeros(3)
+        self.constant_force = np.zeros(3)
+        self.frozen = np.zeros(3, dtype=bool)
+        self.mass = 1.
+        self.radius = radius
+        self.kinematic = False
+        self.still_frames = 0
+
+    @property
+    def forward(self) -> np.ndarray:
+        return self.rotation.apply([0, 0, 1])
+
+    @property
+    def sleeping(self) -> bool:
+        return self.still_frames >= SLEEP_FRAMES
+
+    def look_at(self, target: np.ndarray) -> None:
+        direction = target - self.position
+        self.rotation = Rotation.from_euler('y', np.arctan2(direction[0], direction[2]))
+
+    def push(self, force: np.ndarray) -> None:
+        """Apply a force as an impulse, the way TDW applies forces to objects."""
+        self.velocity += np.where(self.frozen, 0, force / self.mass)
+        self.still_frames = 0
+
+
+def _vector(value: Dict[str, float]) -> np.ndarray:
+    return np.array([value.get('x', 0), value.get('y', 0), value.get('z', 0)], dtype=np.float64)
+
+
+class MockWorld:
+    """
+    Scene state of the mock build: objects, avatars and the output data that is requested.
+    """
+
+    def __init__(self, dt: float = 1 / 30):
+        self.dt = dt
+        self.bodies: Dict[int, MockBody] = {}
+        self.avatars: Dict[str, dict] = {}
+        self.requests: Dict[str, dict] = {}
+        self.collision_flags = {}
+        self.contacts = set()
+        self.screen_size = DEFAULT_SCREEN_SIZE
+        self.png = True
+        self.frame = 0
+        self.radii: Dict[str, float] = {}
+        self.librarians: Dict[str, ModelLibrarian] = {}
+        self.placeholders: Dict[Tuple[str, Tuple[int, int], str], bytes] = {}
+        self.unhandled: Dict[str, int] = {}
+
+    def get_radius(self, name: str) -> float:
+        """Half the largest bounds extent of a model record, cached per model name."""
+        if name not in self.radii:
+            self.radii[name] = DEFAULT_RADIUS
+            for library in MODEL_LIBRARIES:
+                if library not in self.librarians:
+                    self.librarians[library] = ModelLibrarian(library)
+                record = self.librarians[library].get_record(name)
+                if record is not None:
+                    bounds = record.bounds
+                    self.radii[name] = max(abs(bounds['right']['x'] - bounds['left']['x']),
+                                           abs(bounds['top']['y'] - bounds['bottom']['y']),
+                                           abs(bounds['front']['z'] - bounds['back']['z'])) / 2
+                    break
+        return self.radii[name]
+
+    def apply(self, cmd: dict) -> None:
+        """Apply a single command to the scene."""
+        cmd_type = cmd['$type']
+        body = self.bodies.get(cmd.get('id'))
+        avatar = self.avatars.get(cmd.get('avatar_id', 'a'))
+
+        if cmd_type == 'add_object':
+            self.bodies[cmd['id']] = MockBody(cmd['id'], cmd.get('name', ''), cmd.get('position', {}),
+                                              cmd.get('rotation', {}), self.get_radius(cmd.get('name', '')))
+        elif cmd_type == 'destroy_object':
+            self.bodies.pop(cmd['id'], None)
+        elif cmd_type.startswith('send_'):
+            self.request(cmd)
+        elif cmd_type == 'create_avatar':
+            self.avatars[cmd['id']] = {'position': np.zeros(3), 'look_at': np.array([0, 0, 1.]), 'passes': [],
+                                       'enabled': True}
+        elif avatar is not None and cmd_type in ('teleport_avatar_to', 'look_at_position', 'look_at',
+                                                 'set_pass_masks', 'enable_image_sensor'):
+            if cmd_type == 'teleport_avatar_to':
+                avatar['position'] = _vector(cmd['position'])
+            elif cmd_type == 'look_at_position':
+                avatar['look_at'] = _vector(cmd['position'])
+            elif cmd_type == 'look_at' and cmd.get('object_id') in self.bodies:
+                avatar['look_at'] = self.bodies[cmd['object_id']].position.copy()
+            elif cmd_type == 'set_pass_masks':
+                avatar['passes'] = list(cmd['pass_masks'])
+            else:
+                avatar['enabled'] = cmd['enable']
+        elif cmd_type == 'set_screen_size':
+            self.screen_size = (cmd['width'], cmd['height'])
+        elif cmd_type == 'set_img_pass_encoding':
+            self.png = cmd['value']
+        elif cmd_type == 'terminate':
+            self.bodies.clear()
+        elif body is not None:
+            self.apply_to_body(body, cmd_type, cmd)
+        else:
+            self.unhandled[cmd_type] = self.unhandled.get(cmd_type, 0) + 1
+
+    def apply_to_body(self, body: MockBody, cmd_type: str, cmd: dict) -> None:
+        """Apply a command addressed to one object."""
+        if cmd_type == 'set_mass':
+            body.mass = max(cmd['mass'], 1e-3)
+        elif cmd_type == 'scale_object':
+            scale = cmd['scale_factor']
+            body.radius *= max(_vector(scale)) if isinstance(scale, dict) else scale
+        elif cmd_type == 'set_kinematic_state':
+            body.kinematic = cmd.get('is_kinematic', False)
+        elif cmd_type == 'teleport_object':
+            body.position = _vector(cmd['position'])
+        elif cmd_type == 'teleport_object_by':
+            delta = _vector(cmd['position'])
+            body.position = body.position + (delta if cmd.get('absolute', True) else body.rotation.apply(delta))
+        elif cmd_type == 'object_look_at' and cmd['other_object_id'] in self.bodies:
+            body.look_at(self.bodies[cmd['other_object_id']].position)
+        elif cmd_type == 'object_look_at_position':
+            body.look_at(_vector(cmd['position']))
+        elif cmd_type == 'rotate_object_to_euler_angles':
+            body.rotation = Rotation.from_euler('xyz', _vector(cmd['euler_angles']), degrees=True)
+        elif cmd_type == 'apply_force_magnitude_to_object':
+            body.push(body.forward * cmd['magnitude'])
+        elif cmd_type in ('apply_force_to_object', 'apply_force_at_position'):
+            body.push(_vector(cmd['force']))
+        elif cmd_type == 'add_constant_force':
+            body.constant_force = _vector(cmd['force'])
+        elif cmd_type == 'set_rigidbody_constraints':
+            body.frozen = _vector(cmd.get('freeze_position_axes', {})).astype(bool)
+            body.velocity[body.frozen] = 0
+        else:
+            self.unhandled[cmd_type] = self.unhandled.get(cmd_type, 0) + 1
+
+    def request(self, cmd: dict) -> None:
+        """Keep an output data request; like TDW, a later request of the same type replaces the earlier one."""
+        if cmd['$type'] == 'send_collisions':
+            self.collision_flags = {state: cmd.get(state, False) for state in ('enter', 'stay', 'exit')}
+            if 'obj' not in cmd.get('collision_types', ['obj']):
+                self.collision_flags = {}
+            return
+        self.requests[cmd['$type']] = {'frequency': cmd.get('frequency', 'once'), 'ids': cmd.get('ids')}
+
+    def step(self) -> Dict[Tuple[int, int], str]:
+        """Advance the scene by one frame and return the state of every object pair in contact."""
+        dt = self.dt
+        bodies = list(self.bodies.values())
+        for body in bodies:
+            if body.kinematic or body.frozen.all():
+                continue
+            body.velocity += (GRAVITY + body.constant_force / body.mass) * dt
+            body.velocity *= 1 - DRAG * dt
+            body.velocity[body.frozen] = 0
+            body.position = body.position + body.velocity * dt
+            if body.position[1] < 0:
+                body.position[1] = 0
+                body.velocity[1] = -body.velocity[1] * RESTITUTION
+                body.velocity[[0, 2]] *= FLOOR_FRICTION
+            moving = np.linalg.norm(body.velocity) > SLEEP_SPEED
+            body.still_frames = 0 if moving else body.still_frames + 1
+
+        contacts = set()
+        if len(bodies) > 1:
+            positions = np.stack([body.position for body in bodies])
+            radii = np.array([body.radius for body in bodies])
+            offsets = positions[None] - positions[:, None]
+            distances = np.linalg.norm(offsets, axis=-1)
+            overlap = np.triu(distances < radii[None] + radii[:, None], k=1)
+            for i, j in zip(*np.nonzero(overlap)):
+                self._resolve(bodies[i], bodies[j], offsets[i, j], distances[i, j])
+                contacts.add((bodies[i].id, bodies[j].id))
+
+        states = {pair: 'enter' for pair in contacts - self.contacts}
+        states.update({pair: 'stay' for pair in contacts & self.contacts})
+        states.update({pair: 'exit' for pair in self.contacts - contacts})
+        self.contacts = contacts
+        self.frame += 1
+        return states
+
+    @staticmethod
+    def _resolve(a: MockBody, b: MockBody, offset: np.ndarray, distance: float) -> None:
+        """Separate two overlapping objects and exchange momentum along the contact normal."""
+        normal = offset / distance if distance > 0 else np.array([0, 1., 0])
+        approach = np.dot(b.velocity - a.velocity, normal)
+        if approach < 0:
+            impulse = -(1 + RESTITUTION) * approach / (1 / a.mass + 1 / b.mass)
+            a.push(-impulse * normal)
+            b.push(impulse * normal)
+        correction = (a.radius + b.radius - distance) / 2 * normal
+        a.position = a.position - correction
+        b.position = b.position + correction
+
+    def _selected(self, send_type: str, keys: List) -> List:
+        """Keys of the objects or avatars a request covers this frame, switching off requests sent once."""
+        request = self.requests.get(send_type)
+        if request is None or request['frequency'] == 'never':
+            return []
+        if request['frequency'] == 'once':
+            request['frequency'] = 'never'
+        ids = request['ids']
+        return [key for key in keys if key in ids] if ids else list(keys)
+
+    def get_placeholder(self, pass_mask: str, extension: str) -> bytes:
+        """Encoded placeholder image of a pass, created once per pass, screen size and format."""
+        key = (pass_mask, self.screen_size, extension)
+        if key not in self.placeholders:
+            image = Image.new('RGB', self.screen_size, PASS_COLORS.get(pass_mask, (0, 0, 0)))
+            buffer = io.BytesIO()
+            image.save(buffer, format='PNG' if extension == 'png' else 'JPEG')
+            self.placeholders[key] = buffer.getvalue()
+        return self.placeholders[key]
+
+    def get_output_data(self, collision_states: Dict[Tuple[int, int], str]) -> List[bytes]:
+        """Payloads of the output data requested for this frame, followed by the frame number like in TDW."""
+        resp = []
+        ids = self._selected('send_transforms', self.bodies)
+        if ids:
+            bodies = [self.bodies[i] for i in ids]
+            resp.append(pack_output_data(
+                'tran', ids=np.array(ids, dtype=np.int32),
+                positions=np.array([body.position for body in bodies], dtype=np.float32),
+                rotations=np.array([body.rotation.as_quat() for body in bodies], dtype=np.float32),
+                forwards=np.array([body.forward for body in bodies], dtype=np.float32)))
+        ids = self._selected('send_rigidbodies', self.bodies)
+        if ids:
+            bodies = [self.bodies[i] for i in ids]
+            resp.append(pack_output_data(
+                'rigi', ids=np.array(ids, dtype=np.int32),
+                velocities=np.array([body.velocity for body in bodies], dtype=np.float32),
+                angular_velocities=np.zeros((len(ids), 3), dtype=np.float32),
+                sleeping=np.array([body.sleeping for body in bodies], dtype=bool)))
+        ids = self._selected('send_static_rigidbodies', self.bodies)
+        if ids:
+            bodies = [self.bodies[i] for i in ids]
+            resp.append(pack_output_data(
+                'srig', ids=np.array(ids, dtype=np.int32),
+                masses=np.array([body.mass for body in bodies], dtype=np.float32),
+                kinematic=np.array([body.kinematic for body in bodies], dtype=bool)))
+        ids = self._selected('send_segmentation_colors', self.bodies)
+        if ids:
+            resp.append(pack_output_data(
+                'segm', {'names': [self.bodies[i].name for i in ids]}, ids=np.array(ids, dtype=np.int32),
+                colors=np.array([np.random.RandomState(i & 0xffffffff).randint(1, 256, 3) for i in ids],
+                                dtype=np.uint8)))
+
+        for (collider, collidee), state in collision_states.items():
+            if self.collision_flags.get(state) and collider in self.bodies and collidee in self.bodies:
+                a, b = self.bodies[collider], self.bodies[collidee]
+                normal = b.position - a.position
+                normal = normal / (np.linalg.norm(normal) or 1)
+                resp.append(pack_output_data(
+                    'coll', {'collider_id': int(collider), 'collidee_id': int(collidee), 'state': state},
+                    relative_velocity=(b.velocity - a.velocity).astype(np.float32),
+                    impulse=np.zeros(3, dtype=np.float32),
+                    points=(a.position + normal * a.radius).astype(np.float32)[None],
+                    normals=normal.astype(np.float32)[None]))
+
+        width, height = self.screen_size
+        for avatar_id in self._selected('send_camera_matrices', self.avatars):
+            avatar = self.avatars[avatar_id]
+            resp.append(pack_output_data(
+                'cama', {'avatar_id': avatar_id},
+                camera_matrix=look_at_matrix(avatar['position'], avatar['look_at']).astype(np.float32).ravel(),
+                projection_matrix=perspective_matrix(FIELD_OF_VIEW, width / height).astype(np.float32).ravel()))
+        for avatar_id in self._selected('send_images', self.avatars):
+            avatar = self.avatars[avatar_id]
+            if not avatar['enabled'] or not avatar['passes']:
+                continue
+            extensions = ['jpg' if pass_mask == '_img' and not self.png else 'png' for pass_mask in avatar['passes']]
+            images = {f'image_{i}': np.frombuffer(self.get_placeholder(pass_mask, extension), dtype=np.uint8)
+                      for i, (pass_mask, extension) in enumerate(zip(avatar['passes'], extensions))}
+            resp.append(pack_output_data(
+                'imag', {'avatar_id': avatar_id, 'passes': avatar['passes'], 'extensions': extensions,
+                         'width': width, 'height': height}, **images))
+
+        resp.append(self.frame.to_bytes(4, byteorder='big'))
+        return resp
+
+
+class MockStats:
+    """
+    Time spent in the mock build and in the image capture add-ons, for benchmarks to separate from Python overhead.
+    """
+
+    def __init__(self):
+        self.frames = 0
+        self.step_time = 0.
+        self.capture_time = 0.
+        self.image_bytes = 0
+
+
+class MockController(Controller):
+    """
+    Controller that runs the mock scene in-process instead of connecting to a TDW build.
+    """
+
+    def __init__(self, port: int = 1071, check_version: bool = True, launch_build: bool = True, **kwargs):
+        self.add_ons = []
+        self.world = MockWorld()
+        self.mock_stats = MockStats()
+
+    def _get_world(self) -> Tuple[MockWorld, MockStats]:
+        # Some simulators do not call the Controller constructor, so the scene is created on first use.
+        if getattr(self, 'world', None) is None:
+            self.world = MockWorld()
+            self.mock_stats = MockStats()
+        return self.world, self.mock_stats
+
+    def communicate(self, commands: Union[dict, List[dict]]) -> list:
+        """Send the commands of a frame, with the commands of the add-ons, to the mock scene."""
+        world, stats = self._get_world()
+        commands = [commands] if isinstance(commands, dict) else list(commands)
+        for add_on in self.add_ons:
+            if not add_on.initialized:
+                commands.extend(add_on.get_initialization_commands())
+                add_on.initialized = True
+            else:
+                commands.extend(add_on.commands)
+                add_on.commands.clear()
+        for add_on in self.add_ons:
+            add_on.before_send(commands)
+
+        start = time.perf_counter()
+        for cmd in commands:
+            world.apply(cmd)
+        resp = world.get_output_data(world.step())
+        stats.step_time += time.perf_counter() - start
+        stats.frames += 1
+
+        for add_on in self.add_ons:
+            if isinstance(add_on, ImageCapture):
+                start = time.perf_counter()
+                add_on.on_send(resp=resp)
+                stats.capture_time += time.perf_counter() - start
+                stats.image_bytes += sum(len(data) for data in resp[:-1]
+                                         if tdw.output_data.OutputData.get_data_type_id(data) == 'imag')
+            else:
+                add_on.on_send(resp=resp)
+        return resp
+
+
+def install() -> None:
+    """
+    Replace the TDW Controller and output data readers by the mock versions, in tdw and in every module that already
+    imported them.
+    """
+    import tdw.controller
+    replacements = {tdw.controller.Controller: MockController}
+    for name, reader in READERS.items():
+        replacements[getattr(tdw.output_data, name)] = reader
+    for module in list(sys.modules.values()):
+        if module is None or module.__name__ == __name__:
+            continue
+        for attribute, value in list(vars(module).items()):
+            if isinstance(value, type) and value in replacements:
+                setattr(module, attribute, replacements[value])
@@ -0,0 +1,339 @@
+"""
+Vectorized software renderer for the primitive-shape trials of batch_physics.py.
+
+Frames are ray cast with NumPy for many trials and frames at once, without a GPU or a TDW build. Every pixel casts a
+ray from the pinhole camera stored with the trajectory (the placements of the third person cameras of the scenarios,
+with the field of view of camera.py) and takes the colour and instance id of the nearest primitive: spheres, boxes,
+cylinders, the wedge of the rolling ramp and open-top containers, posed with the positions and rotations of every
+frame. Objects are shaded with one directional light over a checkered floor; the background of a trial is the floor
+and sky without objects.
+
+    python rasterizer.py data/batch_physics --size 64x64
+
+writes the frames, backgrounds and instance masks of all trials of the log of a batch_physics.py run as uint8
+arrays in the layout of the Loci PhyPsyDataset (phypsy-WxH.frames.npy, .backgrounds.npy, .index.npz), next to the
+log, plus their instance masks (phypsy-WxH.masks.npy, 0 for the background and the object slot + 1 otherwise).
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+from batch_physics import SPHERE, BOX, CYLINDER, WEDGE, CONTAINER
+from trajectories import load_trajectory
+from utils import console_msg
+from validate import parse_log_value, resolve_path
+
+LIGHT = np.array([.3, 1., .2]) / np.linalg.norm([.3, 1., .2])
+AMBIENT = .35
+FLOOR_COLORS = np.array([[150, 150, 150], [120, 120, 120]], dtype=np.float32)
+SKY_COLORS = np.array([[200, 210, 225], [140, 165, 200]], dtype=np.float32)  # at the horizon and straight up
+PALETTE = np.array([[220, 60, 50], [50, 120, 220], [60, 180, 80], [230, 190, 40], [170, 80, 200], [40, 190, 190],
+                    [240, 130, 40], [200, 200, 200]], dtype=np.float32)
+EPSILON = 1e-6
+
+
+def quaternion_to_matrix(q: np.ndarray) -> np.ndarray:
+    """Rotation matrices (..., 3, 3) of quaternions (..., 4) stored as x, y, z, w."""
+    x, y, z, w = np.moveaxis(q / np.linalg.norm(q, axis=-1, keepdims=True), -1, 0)
+    return np.stack([np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)], axis=-1),
+                     np.stack([2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)], axis=-1),
+                     np.stack([2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)], axis=-1)], axis=-2)
+
+
+def cylinder_axes(extents: np.ndarray) -> np.ndarray:
+    """
+    Axis (...) of cylinders: the one extent that differs from the two equal ones, y if all are equal; upright
+    cylinders are round in x and z, rolling ones lie along z.
+    """
+    ex, ey, ez = np.moveaxis(extents, -1, 0)
+    return np.where(np.isclose(ex, ez), 1, np.where(np.isclose(ex, ey), 2, 0))
+
+
+def camera_rays(camera_matrices: np.ndarray, projection_matrices: np.ndarray,
+                size: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Origins (F, 3) and normalized directions (F, P, 3) of the rays through the P = W * H pixel centres of F cameras.
+    The vertical field of view is the one of the projection matrices and the aspect ratio the one of size.
+    """
+    width, height = size
+    u = (np.arange(width) + .5) / width * 2 - 1
+    v = 1 - (np.arange(height) + .5) / height * 2
+    u, v = np.meshgrid(u, v)
+    focal = projection_matrices[:, 1, 1]
+    directions = np.stack(np.broadcast_arrays(u.ravel() * width / height / focal[:, None],
+                                              v.ravel() / focal[:, None], -np.ones((1, width * height))), axis=-1)
+    rotation, translation = camera_matrices[:, :3, :3], camera_matrices[:, :3, 3]
+    origins = -np.einsum('fji,fj->fi', rotation, translation)
+    directions = np.einsum('fji,fpj->fpi', rotation, directions)
+    return origins, directions / np.linalg.norm(directions, axis=-1, keepdims=True)
+
+
+def _convex_hits(o: np.ndarray, d: np.ndarray, shape: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Ray parameters and unit-space normals where rays (..., 3) hit the unit box [-1, 1]^3, cut by the plane x + y = 0
+    for wedges and open at the top for containers; inf where they miss.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t1, t2 = (-1 - o) / d, (1 - o) / d
+    parallel = np.abs(d) < EPSILON
+    inside = np.abs(o) <= 1
+    t_min = np.where(parallel, np.where(inside, -np.inf, np.inf), np.minimum(t1, t2))
+    t_max = np.where(parallel, np.where(inside, np.inf, -np.inf), np.maximum(t1, t2))
+    near_axis, far_axis = np.argmax(t_min, axis=-1), np.argmin(t_max, axis=-1)
+    t_near, t_far = np.max(t_min, axis=-1), np.min(t_max, axis=-1)
+    near_normal, far_normal = np.eye(3)[near_axis], np.eye(3)[far_axis]
+
+    # the slope of wedges descends towards +x, the solid is below x + y = 0
+    wedge = shape == WEDGE
+    denominator, numerator = d[..., 0] + d[..., 1], -(o[..., 0] + o[..., 1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_plane = numerator / denominator
+    entering = wedge & (denominator < -EPSILON) & (t_plane > t_near)
+    t_near = np.where(entering, t_plane, t_near)
+    near_normal = np.where(entering[..., None], [1., 1., 0.], near_normal)
+    t_far = np.where(wedge & (denominator > EPSILON), np.minimum(t_far, t_plane), t_far)
+    t_far = np.where(wedge & (np.abs(denominator) <= EPSILON) & (numerator < 0), -np.inf, t_far)
+
+    # rays entering containers through their open top see the inner walls or the floor
+    through_top = (shape == CONTAINER) & (near_axis == 1) & (d[..., 1] < 0)
+    t = np.where(through_top, t_far, t_near)
+    normal = np.where(through_top[..., None], far_normal, near_normal)
+    return np.where((t_near <= t_far) & (t > EPSILON), t, np.inf), normal
+
+
+def _sphere_hits(o: np.ndarray, d: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    a, b, c = np.sum(d * d, axis=-1), np.sum(o * d, axis=-1), np.sum(o * o, axis=-1) - 1
+    discriminant = b * b - a * c
+    t = (-b - np.sqrt(np.maximum(discriminant, 0))) / np.maximum(a, EPSILON)
+    t = np.where((discriminant >= 0) & (t > EPSILON), t, np.inf)
+    return t, o + np.nan_to_num(t, posinf=0)[..., None] * d
+
+
+def _cylinder_hits(o: np.ndarray, d: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Hits of the unit cylinder x^2 + z^2 <= 1, |y| <= 1."""
+    a = d[..., 0] ** 2 + d[..., 2] ** 2
+    b = o[..., 0] * d[..., 0] + o[..., 2] * d[..., 2]
+    c = o[..., 0] ** 2 + o[..., 2] ** 2 - 1
+    discriminant = b * b - a * c
+    root = np.sqrt(np.maximum(discriminant, 0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        side_near, side_far = (-b - root) / a, (-b + root) / a
+        cap_1, cap_2 = (-1 - o[..., 1]) / d[..., 1], (1 - o[..., 1]) / d[..., 1]
+    vertical = a < EPSILON
+    side_near = np.where(vertical, np.where(c <= 0, -np.inf, np.inf), side_near)
+    side_far = np.where(vertical, np.where(c <= 0, np.inf, -np.inf), side_far)
+    side_far = np.where(~vertical & (discriminant < 0), -np.inf, side_far)
+    flat = np.abs(d[..., 1]) < EPSILON
+    cap_near = np.where(flat, np.where(np.abs(o[..., 1]) <= 1, -np.inf, np.inf), np.minimum(cap_1, cap_2))
+    cap_far = np.where(flat, np.where(np.abs(o[..., 1]) <= 1, np.inf, -np.inf), np.maximum(cap_1, cap_2))
+
+    t_near, t_far = np.maximum(side_near, cap_near), np.minimum(side_far, cap_far)
+    t = np.where((t_near <= t_far) & (t_near > EPSILON), t_near, np.inf)
+    point = o + np.nan_to_num(t, posinf=0)[..., None] * d
+    normal = np.where((side_near > cap_near)[..., None], point * [1, 0, 1], [0., 1., 0.])
+    return t, normal
+
+
+def render(positions: np.ndarray, rotations: np.ndarray, shapes: np.ndarray, extents: np.ndarray,
+           camera_matrices: np.ndarray, projection_matrices: np.ndarray, size: Tuple[int, int],
+           chunk: int = 32) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Render F frames of up to N objects at size (W, H).
+
+    positions (F, N, 3) are the bottom-centre pivots and rotations (F, N, 4) the quaternions of the objects, shapes
+    (F, N) and extents (F, N, 3) their primitives; objects with non-finite positions are not drawn. camera_matrices
+    and projection_matrices (F, 4, 4) are those of the trajectories. Returns RGB frames (F, H, W, 3) and instance
+    masks (F, H, W) with the object slot + 1, both uint8, rendered in chunks of frames to bound the memory.
+    """
+    width, height = size
+    frames = len(positions)
+    rgb = np.zeros((frames, height, width, 3), dtype=np.uint8)
+    masks = np.zeros((frames, height, width), dtype=np.uint8)
+    for start in range(0, frames, chunk):
+        window = slice(start, min(start + chunk, frames))
+        colors, ids = _render_chunk(positions[window], rotations[window], shapes[window], extents[window],
+                                    camera_matrices[window], projection_matrices[window], size)
+        rgb[window] = colors.reshape(-1, height, width, 3)
+        masks[window] = ids.reshape(-1, height, width)
+    return rgb, masks
+
+
+def render_background(camera_matrices: np.ndarray, projection_matrices: np.ndarray,
+                      size: Tuple[int, int]) -> np.ndarray:
+    """RGB images (F, H, W, 3) of the empty scene seen by F cameras."""
+    origins, directions = camera_rays(camera_matrices, projection_matrices, size)
+    colors, _ = _shade_scene(origins, directions, np.full(directions.shape[:2], np.inf), None)
+    return colors.reshape(len(origins), size[1], size[0], 3)
+
+
+def _render_chunk(positions, rotations, shapes, extents, camera_matrices, projection_matrices, size):
+    origins, directions = camera_rays(camera_matrices, projection_matrices, size)
+    visible = np.all(np.isfinite(positions), axis=-1) & np.all(extents > 0, axis=-1)
+    half = np.where(visible[..., None], extents / 2, 1)
+    centres = np.nan_to_num(positions) + half * [0, 1, 0]
+    rotation = quaternion_to_matrix(np.where(visible[..., None], rotations, [0., 0., 0., 1.]))
+
+    # rays in the frame of each object, scaled to its unit primitive: (F, P, N, 3)
+    o = np.einsum('fnji,fnj->fni', rotation, origins[:, None] - centres)[:, None] / half[:, None]
+    d = np.einsum('fnji,fpj->fpni', rotation, directions) / half[:, None]
+
+    # cylinders are intersected as cylinders along y, with their axis swapped into y
+    axes = cylinder_axes(extents)
+    order = np.array([[1, 0, 2], [0, 1, 2], [0, 2, 1]])[axes][:, None]
+    o_cylinder, d_cylinder = np.take_along_axis(o, order, -1), np.take_along_axis(d, order, -1)
+
+    t_sphere, n_sphere = _sphere_hits(o, d)
+    t_cylinder, n_cylinder = _cylinder_hits(o_cylinder, d_cylinder)
+    n_cylinder = np.take_along_axis(n_cylinder, order, -1)
+    t_convex, n_convex = _convex_hits(o, d, shapes[:, None])
+
+    shape = shapes[:, None]
+    t = np.select([shape == SPHERE, shape == CYLINDER], [t_sphere, t_cylinder], t_convex)
+    normal = np.select([(shape == SPHERE)[..., None], (shape == CYLINDER)[..., None]], [n_sphere, n_cylinder],
+                       n_convex)
+    t = np.where(visible[:, None], t, np.inf)
+
+    nearest = np.argmin(t, axis=-1)
+    t_hit = np.take_along_axis(t, nearest[..., None], -1)[..., 0]
+    normal = np.take_along_axis(normal, nearest[..., None, None], 2)[:, :, 0]
+    rotation = np.take_along_axis(rotation[:, None], nearest[..., None, None, None], 2)[:, :, 0]
+    half = np.take_along_axis(half[:, None], nearest[..., None, None], 2)[:, :, 0]
+    normal = np.einsum('fpij,fpj->fpi', rotation, normal / half)
+    normal /= np.maximum(np.linalg.norm(normal, axis=-1, keepdims=True), EPSILON)
+
+    hit = np.isfinite(t_hit)
+    colors, _ = _shade_scene(origins, directions, t_hit, (normal, PALETTE[nearest % len(PALETTE)]))
+    return colors, np.where(hit, nearest + 1, 0).astype(np.uint8)
+
+
+def _shade_scene(origins: np.ndarray, directions: np.ndarray, t_objects: np.ndarray,
+                 objects: Optional[Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Colours (F, P, 3) of the nearest of objects, floor and sky along every ray, and where the floor is seen."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_floor = -origins[:, None, 1] / directions[..., 1]
+    t_floor = np.where((directions[..., 1] < -EPSILON) & (t_floor > 0), t_floor, np.inf)
+    floor_point = origins[:, None] + np.nan_to_num(t_floor, posinf=0)[..., None] * directions
+    checker = (np.floor(floor_point[..., 0]) + np.floor(floor_point[..., 2])).astype(np.int64) % 2
+    colors = np.where(np.isfinite(t_floor)[..., None], FLOOR_COLORS[checker],
+                      SKY_COLORS[0] + np.clip(directions[..., 1:2], 0, 1) * (SKY_COLORS[1] - SKY_COLORS[0]))
+
+    if objects is not None:
+        normal, albedo = objects
+        # normals face the camera, the insides of containers are seen from within
+        normal = np.where(np.sum(normal * directions, axis=-1, keepdims=True) > 0, -normal, normal)
+        light = AMBIENT + (1 - AMBIENT) * np.clip(normal @ LIGHT, 0, 1)
+        colors = np.where((t_objects < t_floor)[..., None], albedo * light[..., None], colors)
+    return np.clip(colors, 0, 255).astype(np.uint8), np.isfinite(t_floor)
+
+
+def pad_trials(trajectories: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    """
+    Stack trajectories of batch_physics.py into (B, T, N, k) arrays padded to the longest trial and the most
+    objects; padded objects have NaN positions.
+    """
+    frames = max(len(trajectory['positions']) for trajectory in trajectories)
+    objects = max(trajectory['positions'].shape[1] for trajectory in trajectories)
+    batch = len(trajectories)
+    arrays = {'positions': np.full((batch, frames, objects, 3), np.nan, dtype=np.float32),
+              'rotations': np.tile(np.array([0, 0, 0, 1], dtype=np.float32), (batch, frames, objects, 1)),
+              'shapes': np.full((batch, frames, objects), BOX, dtype=np.int64),
+              'extents': np.zeros((batch, frames, objects, 3), dtype=np.float32),
+              'camera_matrices': np.tile(np.eye(4, dtype=np.float32), (batch, frames, 1, 1)),
+              'projection_matrices': np.tile(np.eye(4, dtype=np.float32), (batch, frames, 1, 1))}
+    for b, trajectory in enumerate(trajectories):
+        length, num = trajectory['positions'].shape[:2]
+        arrays['positions'][b, :length, :num] = trajectory['positions']
+        arrays['rotations'][b, :length, :num] = trajectory['rotations']
+        arrays['shapes'][b, :, :num] = trajectory['shapes']
+        arrays['extents'][b, :, :num] = trajectory['extents']
+        arrays['camera_matrices'][b, :length] = trajectory['camera_matrices']
+        arrays['projection_matrices'][b, :length] = trajectory['projection_matrices']
+    return arrays
+
+
+def render_trials(trajectories: List[Dict[str, np.ndarray]], size: Tuple[int, int],
+                  chunk: int = 32) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Render a batch of trials at once. Returns RGB frames (B, T, H, W, 3) and instance masks (B, T, H, W) as long as
+    the longest trial; the frames after the end of shorter trials are not meaningful.
+    """
+    arrays = pad_trials(trajectories)
+    batch, frames = arrays['positions'].shape[:2]
+    flat = {name: value.reshape((batch * frames,) + value.shape[2:]) for name, value in arrays.items()}
+    rgb, masks = render(flat['positions'], flat['rotations'], flat['shapes'], flat['extents'],
+                        flat['camera_matrices'], flat['projection_matrices'], size, chunk)
+    return rgb.reshape(batch, frames, size[1], size[0], 3), masks.reshape(batch, frames, size[1], size[0])
+
+
+def get_first_transition(value) -> int:
+    value = parse_log_value(value)
+    frames = [int(t) for t in (value if isinstance(value, list) else [value]) if isinstance(t, (int, float)) and t >= 0]
+    return min(frames, default=-1)
+
+
+def build_dataset(path: str, size: Tuple[int, int], batch_size: int = 32, chunk: int = 32) -> int:
+    """
+    Render all trials of the log of a batch_physics.py output directory into the uint8 memmap layout of the Loci
+    PhyPsyDataset, with frames in the BGR order of OpenCV, and return the number of trials.
+    """
+    log = pd.read_csv(f'{path}/log.csv', index_col=False)
+    rows, trajectories = [], []
+    for row in log.to_dict('records'):
+        trajectory_path = resolve_path(row.get('trajectory_path'), path)
+        if trajectory_path is None:
+            continue
+        with np.load(trajectory_path) as data:
+            if 'shapes' not in data.files:
+                print(console_msg(f'{trajectory_path} has no primitive shapes, skipping it', 'warning'))
+                continue
+            length = len(data['positions'])
+        rows.append(row)
+        trajectories.append((trajectory_path, length))
+    if not rows:
+        raise FileNotFoundError(console_msg(f'Found no batch_physics.py trajectories in {path}/log.csv', 'error'))
+
+    file = f'{path}/phypsy-{size[0]}x{size[1]}'
+    offsets = np.concatenate(([0], np.cumsum([length for _, length in trajectories]))).astype(np.int64)
+    frames = np.lib.format.open_memmap(f'{file}.frames.npy', mode='w+', dtype=np.uint8,
+                                       shape=(int(offsets[-1]), size[1], size[0], 3))
+    masks = np.lib.format.open_memmap(f'{file}.masks.npy', mode='w+', dtype=np.uint8,
+                                      shape=(int(offsets[-1]), size[1], size[0]))
+    backgrounds = np.zeros((len(rows), size[1], size[0], 3), dtype=np.uint8)
+
+    for start in range(0, len(rows), batch_size):
+        batch = [load_trajectory(trajectory_path) for trajectory_path, _ in trajectories[start:start + batch_size]]
+        rgb, instances = render_trials(batch, size, chunk)
+        for b, trajectory in enumerate(batch):
+            trial = start + b
+            length = offsets[trial + 1] - offsets[trial]
+            frames[offsets[trial]:offsets[trial + 1]] = rgb[b, :length, ..., ::-1]
+            masks[offsets[trial]:offsets[trial + 1]] = instances[b, :length]
+            backgrounds[trial] = render_background(trajectory['camera_matrices'][:1],
+                                                   trajectory['projection_matrices'][:1], size)[0, ..., ::-1]
+        print(f'Rendered {min(start + batch_size, len(rows))}/{len(rows)} trials', flush=True)
+
+    frames.flush()
+    masks.flush()
+    del frames, masks
+    np.save(f'{file}.backgrounds.npy', backgrounds)
+    np.savez(f'{file}.index.npz', offsets=offsets,
+             first_transition=np.array([get_first_transition(row.get('transition_frame')) for row in rows],
+                                       dtype=np.int64),
+             trial_ids=np.array([row['id'] for row in rows], dtype=np.int64),
+             trial_types=np.array([str(row.get('trial_type')) for row in rows]))
+    return len(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render batch_physics.py trials into a Loci PhyPsyDataset.")
+    parser.add_argument("path", type=str, nargs='?', default="data/batch_physics",
+                        help="Output directory of batch_physics.py")
+    parser.add_argument("--size", type=str, default="64x64", help="WxH, the input size of Loci")
+    parser.add_argument("--batch_size", type=int, default=32, help="Trials rendered at once")
+    parser.add_argument("--chunk", type=int, default=32, help="Frames ray cast at once")
+    args = parser.parse_args()
+
+    size = tuple(int(value) for value in args.size.split('x'))
+    count = build_dataset(args.path, size, args.batch_size, args.chunk)
+    print(console_msg(f'Rendered {count} trials into {args.path}/phypsy-{args.size}', 'success'))
@@ -0,0 +1,132 @@
+"""
+Shared-memory ring buffer of finished trials, for training on a live stream of generated trials.
+
+The buffer is one shared memory block with a fixed number of slots, each holding up to max_frames uint8 frames
+(H, W, 3), the background of the trial and its first transition frame. Generator processes claim the next slot under
+a file lock and write into it; readers never lock. Every slot has a version that is odd while the slot is written,
+so a reader copies a slot and keeps the copy only if the version did not change meanwhile (a seqlock). A slot is only
+claimed while its version is even, so with more generators than slots a writer waits instead of sharing a slot with
+another one. Trials get increasing sequence numbers, which readers use to tell fresh trials from trials they have
+already seen.
+
+Only NumPy and the standard library are used, so the Loci data loader can import this module as well.
+"""
+
+import fcntl
+import os
+import time
+import numpy as np
+from multiprocessing import resource_tracker, shared_memory
+from typing import Optional, Tuple
+
+HEADER = 8  # slots, max_frames, height, width, next sequence number, reserved
+SLOT_META = 4  # version, sequence number, frames, first transition frame
+CLAIM_INTERVAL = .001  # seconds a writer waits before trying again to claim a slot that is being written
+
+
+class TrialRingBuffer:
+    """
+    Fixed-size ring of trials in shared memory, written by generator processes and read by data loaders.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool = False):
+        self.shm = shm
+        self.owner = owner
+        header = np.ndarray((HEADER,), dtype=np.int64, buffer=shm.buf)
+        self.slots, self.max_frames, self.height, self.width = (int(value) for value in header[:4])
+        self.header = header
+        offset = HEADER * 8
+        self.meta = np.ndarray((self.slots, SLOT_META), dtype=np.int64, buffer=shm.buf, offset=offset)
+        offset += self.meta.nbytes
+        self.backgrounds = np.ndarray((self.slots, self.height, self.width, 3), dtype=np.uint8, buffer=shm.buf,
+                                      offset=offset)
+        offset += self.backgrounds.nbytes
+        self.frames = np.ndarray((self.slots, self.max_frames, self.height, self.width, 3), dtype=np.uint8,
+                                 buffer=shm.buf, offset=offset)
+        self.lock_path = f'/tmp/{shm.name}.lock'
+
+    @staticmethod
+    def get_nbytes(slots: int, max_frames: int, size: Tuple[int, int]) -> int:
+        width, height = size
+        return HEADER * 8 + slots * SLOT_META * 8 + slots * (max_frames + 1) * height * width * 3
+
+    @classmethod
+    def create(cls, name: str, slots: int, max_frames: int, size: Tuple[int, int]) -> 'TrialRingBuffer':
+        """Create the buffer for trials of at most max_frames frames of size (W, H)."""
+        shm = shared_memory.SharedMemory(name=name, create=True, size=cls.get_nbytes(slots, max_frames, size))
+        header = np.ndarray((HEADER,), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[:4] = [slots, max_frames, size[1], size[0]]
+        buffer = cls(shm, owner=True)
+        buffer.meta[:] = 0
+        buffer.meta[:, 1] = -1
+        return buffer
+
+    @classmethod
+    def attach(cls, name: str) -> 'TrialRingBuffer':
+        """Attach to an existing buffer. Only its creator unlinks it, so the block is not tracked here: the resource
+        tracker would otherwise remove it as soon as the attaching process exits."""
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm)
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.width, self.height
+
+    @property
+    def latest(self) -> int:
+        """Sequence number of the next trial to be written."""
+        return int(self.header[4])
+
+    def write(self, frames: np.ndarray, background: np.ndarray, transition: int = -1) -> int:
+        """
+        Write a trial, given as (T, H, W, 3) uint8 frames and an (H, W, 3) background at the size of the buffer,
+        into the oldest slot and return its sequence number. Frames beyond max_frames are dropped.
+        """
+        while True:
+            with open(self.lock_path, 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                sequence = int(self.header[4])
+                slot = sequence % self.slots
+                # an odd version means another writer still fills the slot
+                if self.meta[slot, 0] % 2 == 0:
+                    self.header[4] = sequence + 1
+                    self.meta[slot, 0] += 1
+                    break
+            time.sleep(CLAIM_INTERVAL)
+        try:
+            num = min(len(frames), self.max_frames)
+            self.frames[slot, :num] = frames[:num]
+            self.backgrounds[slot] = background
+            self.meta[slot, 1:] = [sequence, num, transition]
+        finally:
+            self.meta[slot, 0] += 1
+        return sequence
+
+    def read(self, slot: int) -> Optional[Tuple[int, np.ndarray, np.ndarray, int]]:
+        """
+        Copy of (sequence number, frames, background, transition) of a slot, or None if it is empty or was
+        overwritten while it was read.
+        """
+        version = int(self.meta[slot, 0])
+        sequence, num, transition = (int(value) for value in self.meta[slot, 1:])
+        if version % 2 or sequence < 0:
+            return None
+        frames = self.frames[slot, :num].copy()
+        background = self.backgrounds[slot].copy()
+        if int(self.meta[slot, 0]) != version:
+            return None
+        return sequence, frames, background, transition
+
+    def slot_of(self, sequence: int) -> int:
+        return sequence % self.slots
+
+    def close(self) -> None:
+        # views into the shared memory have to be released before it can be closed
+        self.header = self.meta = self.backgrounds = self.frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+            if os.path.exists(self.lock_path):
+                os.remove(self.lock_path)
@@ -2,25 +2,218 @@ from tdw.add_ons.third_person_camera import ThirdPersonCamera
 from tdw.add_ons.image_capture import ImageCapture
 from tdw.librarian import SceneLibrarian
 from utils import *
-from typing import List, Tuple, Optional, Union
-import time
+from annotations import annotate_trial
+from trajectories import TrajectoryRecorder
+from agent_planner import AgentPlan
+from adaptive_sampler import AdaptiveSampler
+from ring_buffer import TrialRingBuffer
+from typing import Any, List, Tuple, Optional, Union, Dict
+import copy
+import glob
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from tdw.librarian import ModelLibrarian
 import pandas as pd
 
+TILE_SIZE = 12
+BACKGROUND_MAX_FRAMES = 10
+OBJECT_OUTPUT_DATA = ('send_transforms', 'send_rigidbodies')
+LOG_COLUMNS = ('id', 'batch', 'videos_path', 'frames_path', 'trial_type', 'objects',
+               'png', 'pass_masks', 'framerate', 'room', 'tot_frames', 'add_object_to_scene',
+               'save_frames', 'save_mp4', 'transition_frame', 'camera_loc', 'camera_look_at', 'resolution',
+               'annotations_path', 'trajectory_path', 'rejected_draws', 'attempts', 'sampling_weights')
+
+
+class TileStepper:
+    """TileStepper advances several trial instances that share one scene with a single
+    communicate per frame. Each tile runs its own trial loop in a thread; only one tile
+    executes Python at a time and the frame is sent once every active tile has submitted.
+    """
+    def __init__(self, controller: Controller, tiles: list):
+        self.controller = controller
+        self.cond = threading.Condition()
+        self.turn = threading.Lock()
+        self.active = {tile.tile_index for tile in tiles}
+        self.pending = {}
+        self.responses = {}
+        self.extra_cmds = []
+        self.output_requests = {send_type: {} for send_type in OBJECT_OUTPUT_DATA}
+        self.changed_requests = set()
+
+    def communicate(self, tile, commands: Union[dict, List[dict]]) -> list:
+        """Submit the commands of one tile and block until the shared frame was sent."""
+        cmds = [commands] if isinstance(commands, dict) else list(commands)
+        for add_on in tile.add_ons:
+            if not add_on.initialized:
+                cmds.extend(add_on.get_initialization_commands())
+                add_on.initialized = True
+            else:
+                cmds.extend(add_on.commands)
+                add_on.commands.clear()
+        for add_on in tile.add_ons:
+            add_on.before_send(cmds)
+
+        cmds = offset_commands(cmds, tile.offset)
+
+        self.turn.release()
+        with self.cond:
+            self.pending[tile.tile_index] = self._collect_output_requests(tile.tile_index, cmds)
+            self._send_if_complete()
+            while tile.tile_index not in self.responses:
+                self.cond.wait()
+            response = self.responses.pop(tile.tile_index)
+        self.turn.acquire()
+
+        for add_on in tile.add_ons:
+            add_on.on_send(resp=response)
+        return response
+
+    def leave(self, tile) -> None:
+        """Remove a finished tile so the remaining tiles are no longer waiting for it."""
+        with self.cond:
+            self.active.discard(tile.tile_index)
+            for send_type, requests in self.output_requests.items():
+                if requests.pop(tile.tile_index, False) is not False:
+                    self.changed_requests.add(send_type)
+            self.extra_cmds.append({"$type": "enable_image_sensor", "enable": False, "avatar_id": tile.avatar_id})
+            self._send_if_complete()
+
+    def _collect_output_requests(self, tile_index: int, cmds: List[dict]) -> List[dict]:
+        """Take the per-object output data requests out of the commands of a tile. Requests are shared by the whole
+        scene, so they are merged over all tiles before sending; other requests are not switched off by a tile."""
+        kept = []
+        for cmd in cmds:
+            send_type, frequency = cmd['$type'], cmd.get('frequency')
+            if send_type in OBJECT_OUTPUT_DATA and frequency in ('always', 'never'):
+                if frequency == 'always':
+                    self.output_requests[send_type][tile_index] = cmd.get('ids')
+                else:
+                    self.output_requests[send_type].pop(tile_index, None)
+                self.changed_requests.add(send_type)
+            elif not (send_type.startswith('send_') and frequency == 'never'):
+                kept.append(cmd)
+        return kept
+
+    def _get_merged_output_requests(self) -> List[dict]:
+        """Output data requests for the union of the object ids requested by the tiles."""
+        cmds = []
+        for send_type in sorted(self.changed_requests):
+            requests = self.output_requests[send_type].values()
+            if any(ids is None for ids in requests):
+                cmds.append({"$type": send_type, "frequency": "always"})
+            elif any(requests):
+                cmds.append({"$type": send_type, "frequency": "always",
+                             "ids": sorted(set().union(*requests))})
+            else:
+                cmds.append({"$type": send_type, "frequency": "never"})
+        self.changed_requests.clear()
+        return cmds
+
+    def _send_if_complete(self) -> None:
+        """Send the combined frame once all active tiles have submitted their commands."""
+        if not self.active or not self.active.issubset(self.pending):
+            return
+        cmds, self.extra_cmds = self.extra_cmds, []
+        cmds.extend(self._get_merged_output_requests())
+        for tile_index in sorted(self.pending):
+            cmds.extend(self.pending[tile_index])
+        response = self.controller.communicate(cmds)
+        for tile_index in self.pending:
+            self.responses[tile_index] = response
+        self.pending.clear()
+        self.cond.notify_all()
+
 
 class SimulationHandler(Controller):
     """SimulationHandler is responsible for managing a simulation, including setting up
     the trial, running the simulation, and setting the camera.
     """
+    avatar_id = 'frames_temp'
+    tile_index = 0
+    offset = {"x": 0, "y": 0, "z": 0}
+    trajectory = None
+    _stepper = None
+    rejected_draws = None
+    sampler = None
+    attempts = 0
+    stream = None
+
     def __init__(self, port=1071):
+        # per handler, tiles get copies in make_tile
+        self._pending_cmds = []
+        self.sampled = {}
+        # ids of the objects of the current trial, set by init_trial_cmds
+        self.o_ids = []
         lib = ModelLibrarian('models_core.json')
         self.recs = lib.records
         super().__init__(port=port)
 
+    def communicate(self, commands: Union[dict, List[dict]]) -> list:
+        """Send commands, or hand them to the tile stepper if this is a tile of a tiled run.
+        While a trial is recorded, the state of its objects is kept from every response."""
+        if self._pending_cmds:
+            commands = ([commands] if isinstance(commands, dict) else list(commands)) + self._pending_cmds
+            self._pending_cmds = []
+        if self._stepper is None:
+            response = super().communicate(commands)
+        else:
+            response = self._stepper.communicate(self, commands)
+        if self.trajectory is not None:
+            self.trajectory.record(response)
+        return response
+
     def init_trial_cmds(self) -> List[dict]:
         """Initialize the commands for the trial."""
         return []
 
+    def sample_uniform(self, name: str, low: float, high: float) -> float:
+        """Draw a parameter of the current attempt between low and high, weighted by the adaptive sampler."""
+        value = self.sampler.uniform(name, low, high) if self.sampler else random.uniform(low, high)
+        self.sampled[name] = value
+        return value
+
+    def sample_choice(self, name: str, options: List[Any], given: Any = None) -> Any:
+        """Choose a parameter of the current attempt among the options, weighted by the adaptive sampler. With given,
+        the weights are kept per value of given, so that combinations of parameters are learned."""
+        if given is not None:
+            name = f'{name}|{given}'
+        value = self.sampler.choice(name, options) if self.sampler else random.choice(options)
+        self.sampled[name] = value
+        return value
+
+    def record_attempt(self, success: bool) -> None:
+        """Feed the outcome of an attempt back to the adaptive sampler."""
+        self.attempts += 1
+        if self.sampler:
+            self.sampler.record(self.sampled, success)
+        self.sampled = {}
+
+    def get_output_data(self) -> Dict[str, List[int]]:
+        """Output data the scenario reads to decide the current trial, as send command and object ids."""
+        return {}
+
+    def get_output_data_cmds(self, decided: bool = False) -> List[dict]:
+        """Output data requests restricted to the object ids that are read. Once the trial is decided, only the
+        data of the recorded trajectory is still requested."""
+        requests = {} if decided else {send_type: list(ids) for send_type, ids in self.get_output_data().items()}
+        if self.settings['save_trajectory']:
+            for send_type, ids in TrajectoryRecorder.get_output_data(self.o_ids).items():
+                requests.setdefault(send_type, []).extend(ids)
+
+        cmds = []
+        for send_type in OBJECT_OUTPUT_DATA:
+            ids = sorted(set(requests.get(send_type, [])))
+            if ids:
+                cmds.append({"$type": send_type, "frequency": "always", "ids": ids})
+            else:
+                cmds.append({"$type": send_type, "frequency": "never"})
+        return cmds
+
+    def decision_made(self) -> None:
+        """Switch off the output data the scenario no longer needs, with the next frame that is sent."""
+        self._pending_cmds = self.get_output_data_cmds(decided=True)
+
     def run_frame_by_frame(self, trial_type: str, tot_frames: int) -> Tuple[Optional[str], bool]:
         """Execute the simulation frame by frame."""
         self._communicate_for_n_frames(tot_frames)
@@ -31,6 +224,27 @@ class SimulationHandler(Controller):
         self.communicate(destroy_cmds)
         return None, True
 
+    def get_positions(self, response: list, ids: List[int]) -> Dict[int, np.ndarray]:
+        """Positions of the given objects in a response, local to the trial (without the cell offset of a tile)."""
+        offset = np.array([self.offset[axis] for axis in 'xyz'])
+        positions = {}
+        for data in response[:-1]:
+            if OutputData.get_data_type_id(data) == "tran":
+                transforms = Transforms(data)
+                for j in range(transforms.get_num()):
+                    if transforms.get_id(j) in ids:
+                        positions[transforms.get_id(j)] = np.array(transforms.get_position(j)) - offset
+        return positions
+
+    def step_agent_plan(self, plan: AgentPlan, cmds: List[dict]) -> Tuple[List[dict], bool]:
+        """Send one frame of a precomputed agent path together with cmds. Returns the commands of the next frame,
+        which replan the path if the check of this frame found a deviation, and whether the agent moved."""
+        moving = plan.moving
+        response = self.communicate(cmds + plan.get_commands())
+        if plan.needs_check():
+            return plan.check(self.get_positions(response, plan.ids)), moving
+        return [], moving
+
     def run_mass_loc_rot(self, entity_id: str, cmds: List[dict]) -> Tuple[List[dict], dict]:
         """Execute the commands and retrieve transforms."""
         response = self.communicate(cmds)
@@ -48,7 +262,7 @@ class SimulationHandler(Controller):
         """Set the camera for the simulation."""
         self.camera = ThirdPersonCamera(position=self.camera_pos,
                                         look_at={"x": 0, "y": 0, "z": 0},
-                                        avatar_id='frames_temp')
+                                        avatar_id=self.avatar_id)
         self.add_ons.append(self.camera)
 
     def _communicate_for_n_frames(self, n: int) -> None:
@@ -62,9 +276,8 @@ class SimulationHandler(Controller):
 
     def _reset_frames_directory(self) -> None:
         """Reset the frames directory."""
-        path_frames = f'{self.path}/frames_temp'
-        shutil.rmtree(path_frames)
-        os.makedirs(path_frames, exist_ok=True)
+        shutil.rmtree(self.frames_path, ignore_errors=True)
+        os.makedirs(self.frames_path, exist_ok=True)
 
     def validate_inputs(self, pass_masks: List[str], trial_type: str, tot_frames: int, add_object_to_scene: Union[bool, int]) -> Union[str, None]:
         """Validate the input arguments."""
@@ -118,153 +331,233 @@ class SimulationHandler(Controller):
 
         return backgrounds_path, videos_path, frames_path
 
-    def get_scene_commands(self, room: str) -> List[dict]:
+    def get_scene_commands(self, room: str, tiles: int = 1) -> List[dict]:
         """Get commands to set up the room or scene."""
         lib = SceneLibrarian(library="scenes.json")
         available_scenes = [record.name for record in lib.records]
         if room == 'empty':
-            return [TDWUtils.create_empty_room(12, 12)]
+            return [TDWUtils.create_empty_room(TILE_SIZE * tiles, TILE_SIZE)]
         elif room in available_scenes or room == 'random':
             selected_scene = random.choice(available_scenes) if room == 'random' else room
             print('Name of selected environment:', selected_scene)
             return [self.get_add_scene(scene_name=selected_scene)]
         else:
-            console_msg(f"Scene should be one of the following: \n {available_scenes}", 'error')
+            print(console_msg(f"Scene should be one of the following: \n {available_scenes}", 'error'))
             return []
 
 
+    def make_tile(self, tile_index: int, tiles: int) -> 'SimulationHandler':
+        """Create a trial instance that shares the connection of this controller but keeps its own state."""
+        tile = copy.copy(self)
+        for name, value in vars(self).items():
+            if isinstance(value, (list, dict)):
+                setattr(tile, name, copy.copy(value))
+        tile.add_ons = []
+        tile.tile_index = tile_index
+        tile.avatar_id = f'frames_temp_{tile_index}'
+        tile.offset = {"x": (tile_index - (tiles - 1) / 2) * TILE_SIZE, "y": 0, "z": 0}
+        tile.frames_path = f'{self.path}/{tile.avatar_id}'
+        os.makedirs(tile.frames_path, exist_ok=True)
+        return tile
+
+    def get_image_capture(self, avatar_ids: List[str]) -> ImageCapture:
+        """Get the capture add-on, writing the pyramid levels of the frames if requested."""
+        settings = self.settings
+        if settings['pyramid_levels']:
+            return PyramidCapture(path=self.path + '/', avatar_ids=avatar_ids, png=settings['png'],
+                                  pass_masks=settings['pass_masks'], levels=settings['pyramid_levels'])
+        return ImageCapture(path=self.path + '/', avatar_ids=avatar_ids, png=settings['png'],
+                            pass_masks=settings['pass_masks'])
+
+    def get_render_commands(self) -> List[dict]:
+        """Get commands to set the screen size and render quality of the trials."""
+        settings = self.settings
+        cmds = [{"$type": "set_render_quality", "render_quality": settings['render_quality']}]
+        if settings['resolution']:
+            width, height = settings['resolution']
+            cmds.append({"$type": "set_screen_size", "width": width, "height": height})
+        return cmds
+
+    def save_backgrounds(self, response: list, backgrounds: Dict[str, str]) -> None:
+        """Write the _img pass of every camera, given as avatar id and background path without extension, from the
+        image output data of the scene setup. Frames are only advanced while a camera has not rendered yet, and the
+        cameras are written in parallel."""
+        images = get_avatar_images(response, list(backgrounds))
+        for _ in range(BACKGROUND_MAX_FRAMES):
+            if len(images) == len(backgrounds):
+                break
+            images.update(get_avatar_images(self.communicate([]), list(backgrounds)))
+        missing = set(backgrounds) - set(images)
+        if missing:
+            raise RuntimeError(console_msg(f'No background image received from {sorted(missing)}', 'error'))
+
+        levels = self.settings['pyramid_levels']
+        with ThreadPoolExecutor(max_workers=len(backgrounds)) as executor:
+            files = executor.map(lambda avatar_id: save_image_pass(images[avatar_id], '_img', backgrounds[avatar_id],
+                                                                   levels), backgrounds)
+            self.background_files = dict(zip(backgrounds, files))
+
+    def stream_trial(self, frames_path: str, transition_frame: Union[int, List[int]]) -> None:
+        """Write the _img frames of a successful trial, resized to the ring buffer and in BGR order as Loci decodes
+        them, with its background and first transition frame to the stream."""
+        size = self.stream.size
+        frames = np.stack([np.asarray(Image.open(file).convert('RGB').resize(size, Image.LANCZOS))[..., ::-1]
+                           for file in sorted(glob.glob(f'{frames_path}/img_*'))])
+        background = Image.open(self.background_files[self.avatar_id]).convert('RGB').resize(size, Image.LANCZOS)
+        transitions = [t for t in (transition_frame if isinstance(transition_frame, list) else [transition_frame])
+                       if isinstance(t, int) and t >= 0]
+        self.stream.write(frames, np.asarray(background)[..., ::-1], min(transitions, default=-1))
+
+    def load_log(self) -> pd.DataFrame:
+        """Read the log of the batch directory or start a new one."""
+        try:
+            log = pd.read_csv(f'{self.path}/log.csv', index_col=False)
+        except FileNotFoundError:
+            log = pd.DataFrame(index=None, columns=LOG_COLUMNS)
+        return log.reindex(columns=LOG_COLUMNS)
+
+    def start_trial(self, trial_cmds: List[dict]) -> None:
+        """Send the commands of a new trial, keep the segmentation colors of its objects, reset the frames and
+        start recording the trajectory, so that recorded and captured frames line up."""
+        recorder = TrajectoryRecorder(self.o_ids, self.avatar_id, self.offset) if self.settings['save_trajectory'] else None
+        self.trajectory = None
+
+        trial_cmds.extend(self.get_output_data_cmds())
+        if recorder:
+            trial_cmds.extend(recorder.get_commands())
+        if '_id' in self.settings['pass_masks']:
+            trial_cmds.append({"$type": "send_segmentation_colors", "frequency": "once"})
+        response = self.communicate(trial_cmds)
+
+        colors = get_segmentation_colors(response)
+        self.segmentation_colors = {o_id: colors[o_id] for o_id in self.o_ids if o_id in colors}
+        self._reset_frames_directory()
+        self.trajectory = recorder
+
+    def save_trial(self, frames_path: str, trial_id: int, n_trial: int, transition_frame: Union[int, List[int]],
+                   camera_loc: dict, camera_look_at: dict) -> None:
+        """Encode the frames of a successful trial and append it to the log."""
+        settings = self.settings
+        output = f"{self.videos_path}/{trial_id}_trial_{n_trial}"
+
+        trajectory_path = None
+        if self.trajectory:
+            trajectory_path = f'{output}_trajectory.npz'
+            self.trajectory.save(trajectory_path)
+            self.trajectory = None
+
+        annotations_path = f'{output}_annotations.npz'
+        if '_id' not in settings['pass_masks'] or \
+                not annotate_trial(frames_path, annotations_path, self.segmentation_colors):
+            annotations_path = None
+
+        if self.stream:
+            self.stream_trial(frames_path, transition_frame)
+
+        path_videos_saved, path_frames_saved = generate_mp4(frames_path, output, settings['framerate'],
+                                                            settings['pass_masks'], settings['png'],
+                                                            settings['save_frames'], settings['save_mp4'])
+
+        columns = (
+            trial_id, n_trial, path_videos_saved, path_frames_saved, self.trial_type, self.names, settings['png'],
+            settings['pass_masks'], settings['framerate'], settings['room'], settings['tot_frames'],
+            settings['add_object_to_scene'], settings['save_frames'], settings['save_mp4'],
+            transition_frame, camera_loc, camera_look_at, settings['resolution'], annotations_path,
+            trajectory_path, self.rejected_draws, self.attempts,
+            self.sampler.get_weights() if self.sampler else None)
+        self.attempts = 0
+        self.log.loc[len(self.log)] = columns
+        self.log.to_csv(f'{self.path}/log.csv', index=False)
+
     def run(self, num=5, trial_type='object', png=False, pass_masks=["_img", "_mask"], framerate=30, room='random',
-            tot_frames=200, add_object_to_scene=False, save_frames=True, save_mp4=False):
+            tot_frames=200, add_object_to_scene=False, save_frames=True, save_mp4=False, tiles=1,
+            resolution='default', render_quality=5, pyramid=1, save_trajectory=True, adaptive_sampling=True,
+            stream=None):
 
         validation_message = self.validate_inputs(pass_masks, trial_type, tot_frames, add_object_to_scene)
         if validation_message:
             return validation_message
+        if tiles > 1 and room != 'empty':
+            return console_msg('Tiled trials require the empty room', 'error')
+        try:
+            resolution = parse_resolution(resolution)
+        except ValueError:
+            return console_msg(f'resolution must be WxH or one of {list(RESOLUTION_PRESETS)}', 'error')
+        pyramid_levels = get_pyramid_levels(resolution, pyramid)
+        if pyramid < 1 or any(0 in level for level in pyramid_levels):
+            return console_msg('pyramid must be at least 1 and leave every level at least one pixel wide', 'error')
 
         self.trial_type = trial_type
         self.framerate = framerate
+        self.settings = {'png': png, 'pass_masks': pass_masks, 'framerate': framerate, 'room': room,
+                         'tot_frames': tot_frames, 'add_object_to_scene': add_object_to_scene,
+                         'save_frames': save_frames, 'save_mp4': save_mp4, 'resolution': resolution,
+                         'render_quality': render_quality, 'pyramid_levels': pyramid_levels,
+                         'save_trajectory': save_trajectory}
         self.add_ons.clear()
 
-        camera_loc, camera_look_at = self.set_camera()
-
         backgrounds_path, videos_path, frames_path = self.initialize_directories()
+        self.videos_path = videos_path
+        self.log = self.load_log()
         ctrl_id = self.ctrl_id
-
-        curr_dir = os.getcwd()
-        if curr_dir.endswith("controllers"):
-            self.path = '../data/batch'
-        else:
-            self.path = 'data/batch'
-
-        path = self.path
-        paths= [f'{path}/{name}/{ctrl_id}/{trial_type}' for name in ['backgrounds', 'videos']]
-        backgrounds_path, videos_path = paths
-        frames_path = f'{path}/frames_temp'
-        self.frames_path = frames_path
-        paths.append(frames_path)
-
-        try:
-            shutil.rmtree(frames_path)
-        except FileNotFoundError:
-            pass
-
-        for path in paths:
-            os.makedirs(path, exist_ok=True)
+        sampler_path = f'{self.path}/sampler_{ctrl_id}_{trial_type}.json'
+        self.sampler = AdaptiveSampler.load(sampler_path) if adaptive_sampling else None
+        self.sampled, self.attempts = {}, 0
+        self.stream = TrialRingBuffer.attach(stream) if stream else None
 
         trial_id = random.randint(10 ** 16, 10 ** 17 - 1)
         print(f'Trial id: {trial_id}')
 
-        self.add_ons.append(
-            ImageCapture(path=path + '/', avatar_ids=['frames_temp'], png=png, pass_masks=pass_masks))
+        if tiles > 1:
+            message = self.run_tiled(num, tiles, trial_id, backgrounds_path)
+            if self.sampler:
+                self.sampler.save(sampler_path)
+            if self.stream:
+                self.stream.close()
+            return message
 
-        lib = SceneLibrarian(library="scenes.json")
-        available_scenes = [record.name for record in lib.records]
-        if room == 'empty':
-            cmds = [TDWUtils.create_empty_room(12, 12)]
-        elif room in available_scenes or room == 'random':
-            selected_scene = random.choice(available_scenes) if room == 'random' else room
-            print('Name of selected environment:', selected_scene)
-            cmds = [self.get_add_scene(scene_name=selected_scene)]
-        else:
-            return console_msg(
-                f"Scene should be one of the following: \n {available_scenes}",
-                'error')
-
-        cmds.append({"$type": "set_target_framerate",
-                         "framerate": framerate})
+        camera_loc, camera_look_at = self.set_camera()
 
-        if type(add_object_to_scene) == bool:
-            if add_object_to_scene:
-                cmds = self.spawn_entity(cmds)
-            if not add_object_to_scene and self.ctrl_id == 'rolling':
-                return console_msg('Rolling trials require a slope, must set add_object_to_scene to 1', 'error')
+        self.add_ons.append(self.get_image_capture([self.avatar_id]))
 
-        else:
-            return console_msg('add_object_to_scene is not boolean', 'error')
-
-        self.communicate(cmds)
-        extension = '.png' if png else '.jpg'
-        moved = False
-        while not moved:
-            try:
-                shutil.move(f'{frames_path}/img_0000{extension}',
-                            f'{backgrounds_path}/background_{ctrl_id}{trial_id}{extension}')
-                moved = True
-            except FileNotFoundError:
-                print(console_msg("Taking longer than expected...", 'warning'))
-                time.sleep(5)
+        cmds = self.get_scene_commands(room)
+        if not cmds:
+            return console_msg(f'Room {room} is not available', 'error')
+        cmds.extend(self.get_render_commands())
 
-                self.communicate([])
+        cmds.append({"$type": "set_target_framerate",
+                     "framerate": framerate})
 
-        shutil.rmtree(frames_path)
-        os.makedirs(frames_path)
+        if add_object_to_scene:
+            cmds = self.spawn_entity(cmds)
 
-        try:
-            log = pd.read_csv(f'{path}/log.csv', index_col=False)
-        except FileNotFoundError:
-            log = pd.DataFrame(index=None, columns=(
-                'id', 'batch', 'videos_path', 'frames_path', 'trial_type', 'objects',
-                'png', 'pass_masks', 'framerate', 'room', 'tot_frames', 'add_object_to_scene',
-                'save_frames', 'save_mp4', 'transition_frame', 'camera_loc', 'camera_look_at'))
+        response = self.communicate(cmds)
+        self.save_backgrounds(response, {self.avatar_id: f'{backgrounds_path}/background_{ctrl_id}{trial_id}'})
+        self._reset_frames_directory()
 
-        print(f"Videos will be saved in {videos_path}/{trial_type}/{trial_id}")
+        print(f"Videos will be saved in {videos_path}/{trial_id}")
         n_trial = 0
         while n_trial != num:
             trial_cmds = self.init_trial_cmds()
             if type(trial_cmds) != list:
                 return trial_cmds
 
-            self.communicate(trial_cmds)
-
-            try:
-                shutil.rmtree(frames_path)
-            except FileNotFoundError:
-                pass
-            os.makedirs(frames_path, exist_ok=True)
+            self.start_trial(trial_cmds)
 
             transition_frame, success = self.run_frame_by_frame(trial_type=trial_type, tot_frames=tot_frames)
+            self.record_attempt(success)
 
             if success:
-                output = f"{videos_path}/{trial_id}_trial_{n_trial}"
-
-                path_videos_saved, path_frames_saved = generate_mp4(frames_path, output, framerate, pass_masks,
-                                                                    png, save_frames, save_mp4)
-
-                columns = (
-                    trial_id, n_trial, path_videos_saved, path_frames_saved, trial_type, self.names, png,
-                    pass_masks, framerate, room, tot_frames, add_object_to_scene, save_frames, save_mp4,
-                    transition_frame, camera_loc, camera_look_at)
-                try:
-                    log = log.drop(columns='Unnamed: 0')
-                except KeyError:
-                    pass
-                log.loc[len(log)] = columns
-                log.to_csv(f'{path}/info.csv')
-
+                self.save_trial(frames_path, trial_id, n_trial, transition_frame, camera_loc, camera_look_at)
                 n_trial += 1
             else:
                 print(console_msg(f'Trial {n_trial} failed. Retrying...', 'error'))
 
         self.communicate({"$type": "terminate"})
+        if self.sampler:
+            self.sampler.save(sampler_path)
+        if self.stream:
+            self.stream.close()
 
         shutil.rmtree(frames_path)
 
@@ -272,6 +565,100 @@ class SimulationHandler(Controller):
             f'Finished generation.',
             'success')
 
+    def run_tiled(self, num: int, tiles: int, trial_id: int, backgrounds_path: str) -> str:
+        """Run num trials as several instances of the scenario, each in its own cell of one large empty room
+        with its own camera and object ids. A single communicate per frame advances all instances.
+
+        Cells are laid out along the x axis, so the simulators' checks on relative distances and on z coordinates
+        keep working unchanged. Commands of each instance are translated into its cell by the TileStepper.
+        """
+        settings = self.settings
+        instances = [self.make_tile(tile_index, tiles) for tile_index in range(tiles)]
+        for tile in instances:
+            tile.camera_view = tile.set_camera()
+
+        self.add_ons.append(self.get_image_capture([tile.avatar_id for tile in instances]))
+
+        cmds = self.get_scene_commands('empty', tiles)
+        cmds.extend(self.get_render_commands())
+        cmds.append({"$type": "set_target_framerate",
+                     "framerate": settings['framerate']})
+        for tile in instances:
+            tile_cmds = []
+            for add_on in tile.add_ons:
+                tile_cmds.extend(add_on.get_initialization_commands())
+                add_on.initialized = True
+            if settings['add_object_to_scene']:
+                tile_cmds = tile.spawn_entity(tile_cmds)
+            cmds.extend(offset_commands(tile_cmds, tile.offset))
+
+        response = self.communicate(cmds)
+        self.save_backgrounds(response, {
+            tile.avatar_id: f'{backgrounds_path}/background_{self.ctrl_id}{trial_id}_tile{tile.tile_index}'
+            for tile in instances})
+        for tile in instances:
+            tile.background_files = self.background_files
+            tile._reset_frames_directory()
+
+        stepper = TileStepper(self, instances)
+        for tile in instances:
+            tile._stepper = stepper
+
+        print(f"Videos of {tiles} tiles will be saved in {self.videos_path}/{trial_id}")
+        trial_counter = itertools.count()
+        errors = []
+        threads = [threading.Thread(target=tile._run_tile,
+                                    args=(num // tiles + (tile.tile_index < num % tiles), trial_id, trial_counter,
+                                          errors))
+                   for tile in instances]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.communicate({"$type": "terminate"})
+
+        for tile in instances:
+            shutil.rmtree(tile.frames_path, ignore_errors=True)
+
+        for error in errors:
+            if isinstance(error, Exception):
+                raise error
+            return error
+
+        return console_msg(
+            f'Finished generation.',
+            'success')
+
+    def _run_tile(self, num: int, trial_id: int, trial_counter: itertools.count, errors: list) -> None:
+        """Trial loop of a single tile, executed in its own thread; success and transitions are tracked per tile."""
+        self._stepper.turn.acquire()
+        try:
+            n_trial = 0
+            while n_trial != num:
+                trial_cmds = self.init_trial_cmds()
+                if type(trial_cmds) != list:
+                    errors.append(trial_cmds)
+                    break
+
+                self.start_trial(trial_cmds)
+
+                transition_frame, success = self.run_frame_by_frame(trial_type=self.trial_type,
+                                                                    tot_frames=self.settings['tot_frames'])
+                self.record_attempt(success)
+
+                if success:
+                    self.save_trial(self.frames_path, trial_id, next(trial_counter), transition_frame,
+                                    *self.camera_view)
+                    n_trial += 1
+                else:
+                    print(console_msg(f'Trial of tile {self.tile_index} failed. Retrying...', 'error'))
+        except Exception as error:
+            errors.append(error)
+        finally:
+            self._stepper.leave(self)
+            self._stepper.turn.release()
+
 
 if __name__ == "__main__":
     c = SimulationHandler()
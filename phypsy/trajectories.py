@@ -0,0 +1,101 @@
+"""
+Compact 3D trajectory store of a trial.
+
+The TrajectoryRecorder requests transforms and rigidbodies of the trial objects every frame and keeps them. Per frame and object it stores position, rotation, velocity, angular velocity and the
+sleeping flag, plus the camera and projection matrix of the trial's avatar, and saves them as float32 (T, N, k)
+arrays that line up with the captured frames.
+"""
+
+import numpy as np
+from typing import Dict, List
+from tdw.output_data import OutputData, Transforms, Rigidbodies, CameraMatrices
+
+
+class TrajectoryRecorder:
+    """
+    Collects the state of a fixed set of objects from every response of a trial.
+    """
+
+    def __init__(self, object_ids: List[int], avatar_id: str, offset: Dict[str, float] = None):
+        self.object_ids = list(object_ids)
+        self.avatar_id = avatar_id
+        self.offset = offset or {"x": 0, "y": 0, "z": 0}
+        self.index = {o_id: i for i, o_id in enumerate(self.object_ids)}
+        self.frames = {name: [] for name in ['positions', 'rotations', 'velocities', 'angular_velocities',
+                                             'sleeping', 'camera_matrices', 'projection_matrices']}
+
+    @staticmethod
+    def get_output_data(object_ids: List[int]) -> Dict[str, List[int]]:
+        """
+        Per-object output data the trajectory needs with every frame, as send command and object ids.
+        """
+        return {"send_transforms": list(object_ids), "send_rigidbodies": list(object_ids)}
+
+    def get_commands(self) -> List[dict]:
+        """
+        Commands requesting the camera matrices with every frame. All avatars are requested, since tiles of a tiled
+        run share the request; record() keeps the matrices of this avatar.
+        """
+        return [{"$type": "send_camera_matrices", "frequency": "always"}]
+
+    def record(self, response: List) -> None:
+        """
+        Append the state of the objects in a response; objects missing from it are stored as NaN.
+        """
+        n = len(self.object_ids)
+        positions = np.full((n, 3), np.nan, dtype=np.float32)
+        rotations = np.full((n, 4), np.nan, dtype=np.float32)
+        velocities = np.full((n, 3), np.nan, dtype=np.float32)
+        angular_velocities = np.full((n, 3), np.nan, dtype=np.float32)
+        sleeping = np.zeros(n, dtype=bool)
+        camera_matrix = np.full((4, 4), np.nan, dtype=np.float32)
+        projection_matrix = np.full((4, 4), np.nan, dtype=np.float32)
+
+        for data in response[:-1]:
+            res_id = OutputData.get_data_type_id(data)
+            if res_id == "tran":
+                transforms = Transforms(data)
+                for j in range(transforms.get_num()):
+                    i = self.index.get(transforms.get_id(j))
+                    if i is not None:
+                        positions[i] = transforms.get_position(j)
+                        rotations[i] = transforms.get_rotation(j)
+            elif res_id == "rigi":
+                rigidbodies = Rigidbodies(data)
+                for j in range(rigidbodies.get_num()):
+                    i = self.index.get(rigidbodies.get_id(j))
+                    if i is not None:
+                        velocities[i] = rigidbodies.get_velocity(j)
+                        angular_velocities[i] = rigidbodies.get_angular_velocity(j)
+                        sleeping[i] = rigidbodies.get_sleeping(j)
+            elif res_id == "cama":
+                matrices = CameraMatrices(data)
+                if matrices.get_avatar_id() == self.avatar_id:
+                    camera_matrix[:] = matrices.get_camera_matrix().reshape(4, 4)
+                    projection_matrix[:] = matrices.get_projection_matrix().reshape(4, 4)
+
+        for name, value in zip(self.frames, [positions, rotations, velocities, angular_velocities, sleeping,
+                                             camera_matrix, projection_matrix]):
+            self.frames[name].append(value)
+
+    def __len__(self):
+        return len(self.frames['positions'])
+
+    def save(self, path: str) -> None:
+        """
+        Save the trajectory as .npz; positions and camera matrices are in world coordinates of the scene,
+        offset is the origin of the trial's cell (non-zero only in tiled runs).
+        """
+        n = len(self.object_ids)
+        arrays = {name: np.stack(values) if values else np.zeros((0, n), dtype=np.float32)
+                  for name, values in self.frames.items()}
+        np.savez_compressed(path, object_ids=np.array(self.object_ids, dtype=np.int64),
+                            offset=np.array([self.offset[axis] for axis in 'xyz'], dtype=np.float32), **arrays)
+
+
+def load_trajectory(path: str) -> Dict[str, np.ndarray]:
+    """
+    Load a saved trajectory into a dictionary of arrays.
+    """
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
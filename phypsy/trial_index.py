@@ -0,0 +1,261 @@
+"""
+SQLite index of generated trials.
+
+All log.csv files below the given directories (batch directories, plan outputs) are consolidated into one database
+with a row per trial and a row per trial object, so training splits and evaluation subsets can be selected without
+parsing the logs again:
+
+    python trial_index.py build data/batch data/plan --db data/trials.sqlite
+    python trial_index.py query --scenario containment --trial_type transitional --object container=bowl \
+        --min_transition 60
+
+    index = TrialIndex('data/trials.sqlite')
+    paths = index.paths(scenario='containment', trial_type='transitional', objects={'container': 'bowl'})
+
+Paths are stored as absolute paths. Trials are identified by the trial id and the number of the trial in its run,
+so indexing a directory again, or a plan output together with its chunks, updates the trials instead of repeating
+them. Issues from validation/report.csv (see validate.py) are imported with the trials; quarantined trials are
+skipped.
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import pandas as pd
+from typing import Any, Dict, Iterator, List, Optional
+from utils import console_msg
+from validate import list_frames, parse_log_value, resolve_path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trials (
+    trial_id INTEGER NOT NULL,
+    n_trial INTEGER NOT NULL,
+    scenario TEXT,
+    trial_type TEXT,
+    room TEXT,
+    first_transition INTEGER,
+    transition_frames TEXT,
+    frame_count INTEGER,
+    tot_frames INTEGER,
+    resolution TEXT,
+    pass_masks TEXT,
+    camera_loc TEXT,
+    camera_look_at TEXT,
+    objects TEXT,
+    frames_path TEXT,
+    videos_path TEXT,
+    annotations_path TEXT,
+    trajectory_path TEXT,
+    issues TEXT,
+    log_path TEXT,
+    PRIMARY KEY (trial_id, n_trial)
+);
+CREATE TABLE IF NOT EXISTS trial_objects (
+    trial_id INTEGER NOT NULL,
+    n_trial INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS trials_scenario ON trials (scenario, trial_type, room);
+CREATE INDEX IF NOT EXISTS trials_transition ON trials (first_transition);
+CREATE INDEX IF NOT EXISTS trial_objects_name ON trial_objects (name, role);
+CREATE INDEX IF NOT EXISTS trial_objects_trial ON trial_objects (trial_id, n_trial);
+"""
+SCENARIO_PATH = re.compile(r'(?:videos|frames)/([^/]+)/(?:physical|transitional|psychological)/')
+PATH_COLUMNS = ['frames_path', 'annotations_path', 'trajectory_path']
+
+
+def find_logs(roots: List[str]) -> Iterator[str]:
+    """
+    log.csv files below the roots, without the quarantine of validate.py.
+    """
+    for root in roots:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [name for name in dirnames if name not in ('quarantine', 'frames', 'videos', 'backgrounds')]
+            if 'log.csv' in filenames:
+                yield os.path.join(dirpath, 'log.csv')
+
+
+def get_scenario(row: dict) -> Optional[str]:
+    """
+    The controller id of a trial, from the directory layout of its outputs.
+    """
+    for column in ['videos_path', 'annotations_path', 'trajectory_path', 'frames_path']:
+        match = SCENARIO_PATH.search(str(row.get(column)))
+        if match:
+            return match.group(1)
+    return None
+
+
+def get_object_rows(objects: Any) -> Iterator[tuple]:
+    """
+    (role, name) of every object of the objects column: names, lists of names and lists of object metadata.
+    """
+    if not isinstance(objects, dict):
+        return
+    for role, value in objects.items():
+        for item in value if isinstance(value, list) else [value]:
+            name = item.get('name') if isinstance(item, dict) else item
+            if isinstance(name, str):
+                yield role, name
+
+
+def _transitions(value: Any) -> List[int]:
+    value = parse_log_value(value)
+    values = value if isinstance(value, list) else [value]
+    transitions = []
+    for t in values:
+        try:
+            t = int(t)
+        except (TypeError, ValueError):
+            continue
+        if t >= 0:
+            transitions.append(t)
+    return transitions
+
+
+def _absolute(path: Any, batch_dir: str) -> Optional[str]:
+    resolved = resolve_path(path, batch_dir) if isinstance(path, str) else None
+    return os.path.abspath(resolved) if resolved else None
+
+
+def read_issues(batch_dir: str) -> Dict[tuple, str]:
+    """
+    Issues per (trial id, trial number) from the validation report of a batch directory.
+    """
+    try:
+        report = pd.read_csv(f'{batch_dir}/validation/report.csv', index_col=False)
+    except FileNotFoundError:
+        return {}
+    return {(int(row['id']), int(row['batch'])): row['issues'] if isinstance(row['issues'], str) else ''
+            for row in report.to_dict('records')}
+
+
+def index_log(connection: sqlite3.Connection, log_path: str, count_frames: bool = True) -> int:
+    """
+    Insert or update the trials of a log and return their number.
+    """
+    batch_dir = os.path.dirname(log_path)
+    log = pd.read_csv(log_path, index_col=False)
+    issues = read_issues(batch_dir)
+    trials, objects = [], []
+    for row in log.to_dict('records'):
+        key = (int(row['id']), int(row['batch']))
+        transitions = _transitions(row.get('transition_frame'))
+        frames_path = _absolute(row.get('frames_path'), batch_dir)
+        frame_count = None
+        if count_frames and frames_path:
+            frame_count = len(list_frames(frames_path).get('_img', {}))
+        videos = [_absolute(video, batch_dir) for video in parse_log_value(row.get('videos_path')) or []]
+        names = parse_log_value(row.get('objects'))
+
+        trials.append(key + (
+            get_scenario(row), row.get('trial_type'), row.get('room'), min(transitions) if transitions else None,
+            json.dumps(transitions), frame_count, row.get('tot_frames'), str(row.get('resolution')),
+            str(row.get('pass_masks')), str(row.get('camera_loc')), str(row.get('camera_look_at')),
+            json.dumps(names) if isinstance(names, (dict, list)) else str(names), frames_path, json.dumps(videos),
+            _absolute(row.get('annotations_path'), batch_dir), _absolute(row.get('trajectory_path'), batch_dir),
+            issues.get(key), os.path.abspath(log_path)))
+        objects.extend(key + object_row for object_row in get_object_rows(names))
+
+    connection.executemany('DELETE FROM trial_objects WHERE trial_id = ? AND n_trial = ?', [t[:2] for t in trials])
+    connection.executemany(f'INSERT OR REPLACE INTO trials VALUES ({", ".join("?" * 20)})', trials)
+    connection.executemany('INSERT INTO trial_objects VALUES (?, ?, ?, ?)', objects)
+    return len(trials)
+
+
+def build_index(db_path: str, roots: List[str], count_frames: bool = True) -> int:
+    """
+    Index all logs below the roots into the database at db_path and return the number of indexed trials.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    with sqlite3.connect(db_path) as connection:
+        connection.executescript(SCHEMA)
+        return sum(index_log(connection, log_path, count_frames) for log_path in find_logs(roots))
+
+
+class TrialIndex:
+    """
+    Read access to a trial index built with build_index.
+    """
+
+    def __init__(self, db_path: str):
+        self.connection = sqlite3.connect(db_path)
+        self.connection.row_factory = sqlite3.Row
+
+    def query(self, scenario: Optional[str] = None, trial_type: Optional[str] = None, room: Optional[str] = None,
+              objects: Optional[Dict[str, str]] = None, min_transition: Optional[int] = None,
+              max_transition: Optional[int] = None, valid_only: bool = False,
+              limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Trials matching all given filters. objects maps roles to model names, e.g. {'container': 'bowl'};
+        the role '*' matches any role.
+        """
+        conditions, params = [], []
+        for column, value in [('scenario', scenario), ('trial_type', trial_type), ('room', room)]:
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        if min_transition is not None:
+            conditions.append('first_transition >= ?')
+            params.append(min_transition)
+        if max_transition is not None:
+            conditions.append('first_transition <= ?')
+            params.append(max_transition)
+        if valid_only:
+            conditions.append("(issues IS NULL OR issues = '')")
+        for role, name in (objects or {}).items():
+            role_condition = '' if role == '*' else ' AND o.role = ?'
+            conditions.append('EXISTS (SELECT 1 FROM trial_objects o WHERE o.trial_id = trials.trial_id AND '
+                              f'o.n_trial = trials.n_trial AND o.name = ?{role_condition})')
+            params.extend([name] if role == '*' else [name, role])
+
+        sql = 'SELECT * FROM trials'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+        return [dict(row) for row in self.connection.execute(sql, params)]
+
+    def paths(self, column: str = 'frames_path', **filters) -> List[str]:
+        """
+        A path column (frames_path, annotations_path, trajectory_path) of the trials matching the filters.
+        """
+        if column not in PATH_COLUMNS:
+            raise ValueError(console_msg(f'column must be one of {PATH_COLUMNS}', 'error'))
+        return [trial[column] for trial in self.query(**filters) if trial[column]]
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the SQLite index of generated trials.")
+    parser.add_argument("command", choices=["build", "query"])
+    parser.add_argument("roots", nargs='*', default=['data/batch'], help="Directories with logs to index")
+    parser.add_argument("--db", type=str, default='data/trials.sqlite', help="Database file")
+    parser.add_argument("--no_frame_count", dest="count_frames", action="store_false",
+                        help="Do not count the frames of every trial while indexing")
+    parser.add_argument("--scenario", type=str, default=None)
+    parser.add_argument("--trial_type", type=str, default=None)
+    parser.add_argument("--room", type=str, default=None)
+    parser.add_argument("--object", type=str, action='append', default=[],
+                        help="role=name, or a name of any role; can be given several times")
+    parser.add_argument("--min_transition", type=int, default=None)
+    parser.add_argument("--max_transition", type=int, default=None)
+    parser.add_argument("--valid_only", action="store_true", help="Only trials without validation issues")
+    parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        count = build_index(args.db, args.roots, args.count_frames)
+        print(console_msg(f'Indexed {count} trials into {args.db}', 'success'))
+    else:
+        filters = dict(item.split('=', 1) if '=' in item else ('*', item) for item in args.object)
+        index = TrialIndex(args.db)
+        for path in index.paths(scenario=args.scenario, trial_type=args.trial_type, room=args.room, objects=filters,
+                                min_transition=args.min_transition, max_transition=args.max_transition,
+                                valid_only=args.valid_only, limit=args.limit):
+            print(path)
@@ -4,13 +4,85 @@ import numpy as np
 import os
 import shutil
 import ffmpeg
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional
 from entities import *
 from tdw.controller import Controller
+from tdw.add_ons.image_capture import ImageCapture
 from tdw.librarian import ModelLibrarian
 from tdw.tdw_utils import TDWUtils
-from tdw.output_data import OutputData, Transforms, Rigidbodies, StaticRigidbodies
+from tdw.output_data import OutputData, Transforms, Rigidbodies, StaticRigidbodies, SegmentationColors, Images
 from scipy.spatial.transform import Rotation
+from PIL import Image
+
+RESOLUTION_PRESETS = {
+    'loci': (320, 240),  # input_size [240, 320] of Loci-main/model/cater.json
+    'loci_half': (160, 120),
+}
+DEFAULT_RESOLUTION = (256, 256)  # TDW screen size if none is set
+SMOOTH_PASSES = ['_img', '_albedo']
+
+
+class PyramidCapture(ImageCapture):
+    """
+    ImageCapture that also writes downscaled levels of every pass into {W}x{H} subdirectories.
+    The levels are resized from the image data of the same frame, so no separate resize step is needed.
+    """
+
+    def __init__(self, path: str, avatar_ids: List[str], png: bool, pass_masks: List[str],
+                 levels: List[Tuple[int, int]]):
+        super().__init__(path=path, avatar_ids=avatar_ids, png=png, pass_masks=pass_masks)
+        self.levels = levels
+
+    def on_send(self, resp: List[bytes]) -> None:
+        frame = self.frame
+        super().on_send(resp)
+        filename = TDWUtils.zero_padding(frame, 4)
+        for avatar_id, images in self.images.items():
+            if self.avatar_ids and avatar_id not in self.avatar_ids:
+                continue
+            for i in range(images.get_num_passes()):
+                pass_mask = images.get_pass_mask(i)
+                resample = Image.LANCZOS if pass_mask in SMOOTH_PASSES else Image.NEAREST
+                image = TDWUtils.get_pil_image(images, i)
+                for width, height in self.levels:
+                    image = image.resize((width, height), resample)
+                    output_dir = self.path.joinpath(avatar_id, f'{width}x{height}')
+                    output_dir.mkdir(parents=True, exist_ok=True)
+                    image.save(output_dir.joinpath(f'{pass_mask[1:]}_{filename}.{images.get_extension(i)}'))
+
+
+def get_avatar_images(response: List[bytes], avatar_ids: List[str]) -> Dict[str, Images]:
+    """
+    Image output data of the given avatars in a response.
+    """
+    images = {}
+    for data in response[:-1]:
+        if OutputData.get_data_type_id(data) == "imag":
+            avatar_images = Images(data)
+            if avatar_images.get_avatar_id() in avatar_ids:
+                images[avatar_images.get_avatar_id()] = avatar_images
+    return images
+
+
+def save_image_pass(images: Images, pass_mask: str, path: str, levels: List[Tuple[int, int]] = ()) -> Optional[str]:
+    """
+    Write a pass of the image output data to path (without extension) as it was encoded by the build, and its
+    downscaled levels to path_{W}x{H}. Returns the written file, or None if the pass is not in the images.
+    """
+    for i in range(images.get_num_passes()):
+        if images.get_pass_mask(i) != pass_mask:
+            continue
+        extension = images.get_extension(i)
+        with open(f'{path}.{extension}', 'wb') as f:
+            f.write(images.get_image(i))
+        if levels:
+            resample = Image.LANCZOS if pass_mask in SMOOTH_PASSES else Image.NEAREST
+            image = TDWUtils.get_pil_image(images, i)
+            for width, height in levels:
+                image = image.resize((width, height), resample)
+                image.save(f'{path}_{width}x{height}.{extension}')
+        return f'{path}.{extension}'
+    return None
 
 
 class EntityProperties:
@@ -31,13 +103,15 @@ def get_entity_by_name(name: str, lib: str = 'models_full.json') -> ModelLibrari
     return ModelLibrarian(lib).get_record(name)
 
 
-def get_random_entity_pair(list1: List[str], list2: List[str], axes: List[int] = [0, 1, 2]) -> Tuple[
-    List[str], List[List[float]]]:
+def get_random_entity_pair(list1: List[str], list2: List[str], axes: List[int] = [0, 1, 2],
+                           first: Optional[str] = None) -> Tuple[List[str], List[List[float]]]:
     """
     Retrieve a random entity pair based on size requirements.
+    The entity of list1 is tried first if given, and drawn at random if no entity of list2 fits it.
     """
     while True:
-        list1_entity = get_entity_by_name(random.choice(list1))
+        list1_entity = get_entity_by_name(first or random.choice(list1))
+        first = None
         entity1_bounds = TDWUtils.get_bounds_extents(list1_entity.bounds)
 
         random.shuffle(list2)
@@ -101,6 +175,19 @@ def get_mass_loc_rot(response: List, entity_id: int) -> Tuple[np.array, List[flo
     return rot, loc, mass
 
 
+def get_segmentation_colors(response: List) -> Dict[int, np.ndarray]:
+    """
+    Retrieve the segmentation color of every object in the response.
+    """
+    colors = {}
+    for data in response[:-1]:
+        if OutputData.get_data_type_id(data) == "segm":
+            segmentation_colors = SegmentationColors(data)
+            for j in range(segmentation_colors.get_num()):
+                colors[segmentation_colors.get_object_id(j)] = segmentation_colors.get_object_color(j)
+    return colors
+
+
 def generate_mp4(img_path: str, mp4_name: str, framerate: int, masks: List[str], png: bool, keep_imgs: bool,
                  save_video: bool) -> Tuple[List[str], str]:
     """
@@ -161,14 +248,15 @@ def console_msg(msg: str, msg_type: str, indicator: int = None) -> str:
     return f"{color_code}{full_message}\033[0m\r"
 
 
-def scale_force(entity, noise: float = 5) -> float:
+def scale_force(entity, noise: float = 5, offset: Optional[float] = None) -> float:
     """
         Calculate a scaling force based on entity properties.
+        The noise is drawn uniformly from [-noise, noise] unless an offset is given.
     """
 
     scale = (-TDWUtils.get_unit_scale(entity) * 1.9 + 48) / 1.8 + \
             (np.prod(TDWUtils.get_bounds_extents(entity.bounds)) * 12 + 13) / 2.1 - 3.8
-    return scale + random.uniform(-noise, noise)
+    return scale + (random.uniform(-noise, noise) if offset is None else offset)
 
 
 def is_sleeping(response, entity_id: int) -> bool:
@@ -203,9 +291,57 @@ def target_cmd(target_entity_id, agent_pos, cmds=[]):
     return cmds, get_entity_by_name(target, lib=lib)
 
 
-def build_arg_pars(masks: bool = True) -> argparse.Namespace:
+ABSOLUTE_POSITION_CMDS = ('add_object', 'teleport_object', 'object_look_at_position', 'apply_force_at_position',
+                          'teleport_avatar_to', 'look_at_position')
+
+
+def offset_commands(cmds: List[dict], offset: Dict[str, float]) -> List[dict]:
+    """
+    Translate the worldspace positions of the commands by an offset, leaving relative commands untouched.
+    """
+    shifted = []
+    for cmd in cmds:
+        if cmd.get('$type') in ABSOLUTE_POSITION_CMDS and 'position' in cmd:
+            cmd = dict(cmd)
+            cmd['position'] = {axis: val + offset.get(axis, 0) for axis, val in cmd['position'].items()}
+        shifted.append(cmd)
+    return shifted
+
+
+def parse_resolution(resolution: str) -> Optional[Tuple[int, int]]:
+    """
+    Parse a resolution preset name or a WxH string; 'default' keeps the screen size of TDW.
+    """
+    if resolution is None or resolution == 'default':
+        return None
+    if resolution in RESOLUTION_PRESETS:
+        return RESOLUTION_PRESETS[resolution]
+    width, height = resolution.lower().split('x')
+    return int(width), int(height)
+
+
+def get_pyramid_levels(resolution: Optional[Tuple[int, int]], pyramid: int) -> List[Tuple[int, int]]:
+    """
+    Sizes of the downscaled levels below the render resolution, each half the size of the previous one.
+    """
+    width, height = resolution or DEFAULT_RESOLUTION
+    return [(width >> level, height >> level) for level in range(1, pyramid)]
+
+
+def parse_bool(value: str) -> bool:
+    """
+    Boolean command line value; bool('False') would be True.
+    """
+    if value.lower() in ('true', '1', 'yes'):
+        return True
+    if value.lower() in ('false', '0', 'no'):
+        return False
+    raise argparse.ArgumentTypeError(f'Expected a boolean, got {value}')
+
+
+def build_arg_pars(masks: bool = True, extra_arguments: Optional[List[dict]] = None) -> argparse.Namespace:
     """
-    Build and parse command line arguments.
+    Build and parse command line arguments, including the script specific extra_arguments.
     """
 
     parser = argparse.ArgumentParser(description="Specify the parameters for trial creation.")
@@ -215,17 +351,32 @@ def build_arg_pars(masks: bool = True) -> argparse.Namespace:
         {"flags": ["-t", "--trial_type"], "type": str, "default": "physical",
          "choices": ["psychological", "transitional", "physical"],
          "help": "Type of trial (psychological, transitional, or physical)"},
-        {"flags": ["--png"], "default": True, "type": bool, "help": "Use png or jpg?"},
-        {"flags": ["--save_frames"], "default": True, "type": bool, "help": "Keep the frame images"},
-        {"flags": ["--save_mp4"], "default": False, "type": bool, "help": "Save in mp4 format"},
+        {"flags": ["--png"], "default": True, "type": parse_bool, "help": "Use png or jpg?"},
+        {"flags": ["--save_frames"], "default": True, "type": parse_bool, "help": "Keep the frame images"},
+        {"flags": ["--save_mp4"], "default": False, "type": parse_bool, "help": "Save in mp4 format"},
         {"flags": ["--pass_masks"], "type": str, "default": "_img,_mask", "help": "Output masks"},
         {"flags": ["--framerate"], "type": int, "default": 30, "help": "FPS of output sequence"},
         {"flags": ["--room"], "default": "empty", "help": "Environment type; 'random_unsafe' for random untested room"},
         {"flags": ["--tot_frames"], "type": int, "default": 200,
          "help": "Max frames; may terminate earlier occasionally"},
-        {"flags": ["--add_object_to_scene"], "default": False, "type": bool,
-         "help": "Introduce items to scene & backdrop"}
-    ]
+        {"flags": ["--add_object_to_scene"], "default": False, "type": parse_bool,
+         "help": "Introduce items to scene & backdrop"},
+        {"flags": ["--tiles"], "type": int, "default": 1,
+         "help": "Trial instances simulated side by side in one empty room"},
+        {"flags": ["--resolution"], "type": str, "default": "default",
+         "help": f"Render size as WxH or one of {list(RESOLUTION_PRESETS)}"},
+        {"flags": ["--render_quality"], "type": int, "default": 5, "choices": range(6),
+         "help": "Render quality from 0 (fastest) to 5 (best)"},
+        {"flags": ["--pyramid"], "type": int, "default": 1,
+         "help": "Number of resolution levels, each half the size of the previous one"},
+        {"flags": ["--no_trajectory"], "dest": "save_trajectory", "action": "store_false",
+         "help": "Do not record the 3D trajectory, so only the output data the scenario reads is requested"},
+        {"flags": ["--no_adaptive_sampling"], "dest": "adaptive_sampling", "action": "store_false",
+         "help": "Draw trial parameters uniformly instead of favouring the ranges that succeeded before"},
+        {"flags": ["--port"], "type": int, "default": 1071, "help": "Port of the TDW build"},
+        {"flags": ["--stream"], "type": str, "default": None,
+         "help": "Name of a shared-memory ring buffer (see ring_buffer.py) to also write every finished trial to"}
+    ] + (extra_arguments or [])
 
     for arg in arguments:
         flags = arg.pop("flags")
@@ -0,0 +1,262 @@
+"""
+Quality check of the trials of a batch directory.
+
+Every trial of the log is checked in a process pool: the frames of each pass are counted and compared with each
+other and with the log, and the _img and mask passes are decoded in bulk at a reduced size to compute cheap per-frame
+statistics, i.e. mean intensity, frame-diff energy and mask coverage. Trials with missing or black frames, frozen
+videos, empty masks or frame counts that do not match are listed in validation/report.csv with their issues, and with
+--quarantine their frames and videos are moved to quarantine/ and their rows to quarantine/log.csv.
+
+Usage:
+    python validate.py data/batch --workers 8 --quarantine
+"""
+
+import argparse
+import ast
+import csv
+import glob
+import json
+import os
+import re
+import shutil
+import numpy as np
+import pandas as pd
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from typing import Dict, List, Optional
+from utils import console_msg
+
+FRAME_FILE = re.compile(r'^([a-z]+)_(\d{4})\.(png|jpg)$')
+MASK_PASSES = ['_mask', '_id']
+STAT_REDUCE = 4  # frames are decoded at 1/STAT_REDUCE of their size for the statistics
+MIN_FRAMES = 10
+BLACK_INTENSITY = 4.
+FROZEN_ENERGY = .01  # below this maximal frame difference no pixel changes visibly
+CHUNKSIZE = 16
+REPORT_COLUMNS = ['id', 'batch', 'trial_type', 'frames_path', 'frames', 'passes', 'mean_intensity',
+                  'black_frames', 'mean_diff_energy', 'max_diff_energy', 'mask_coverage', 'issues']
+
+
+def parse_log_value(value):
+    """Lists and dicts are stored as their Python representation in the log."""
+    if isinstance(value, str) and value[:1] in '[{(':
+        try:
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return value
+    return value
+
+
+def resolve_path(path: Optional[str], batch_dir: str) -> Optional[str]:
+    """
+    Find a path of the log, which is relative to the directory the simulator ran in, or to the batch directory for
+    merged plan logs.
+    """
+    if not isinstance(path, str):
+        return None
+    root = os.path.dirname(os.path.dirname(os.path.abspath(batch_dir)))
+    for candidate in [path, os.path.join(batch_dir, path), os.path.join(root, path)]:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def list_frames(frames_dir: str) -> Dict[str, Dict[int, str]]:
+    """
+    Frame files per pass and frame number, from the capture directory of a trial and its avatar subdirectory.
+    Downscaled pyramid levels are left out.
+    """
+    frames = {}
+    for file in glob.glob(f'{frames_dir}/*') + glob.glob(f'{frames_dir}/*/*'):
+        match = FRAME_FILE.match(os.path.basename(file))
+        if match and not re.fullmatch(r'\d+x\d+', os.path.basename(os.path.dirname(file))):
+            frames.setdefault(f'_{match.group(1)}', {})[int(match.group(2))] = file
+    return frames
+
+
+def load_reduced(files: List[str]) -> np.ndarray:
+    """
+    Decode frames into a (T, h, w, 3) uint8 array at 1/STAT_REDUCE of their size.
+    """
+    stack = None
+    for i, file in enumerate(files):
+        image = Image.open(file)
+        width, height = image.size
+        # JPEG frames are decoded at the reduced size directly, the rest is reduced after decoding.
+        image.draft('RGB', (width // STAT_REDUCE, height // STAT_REDUCE))
+        image = image.convert('RGB')
+        factor = min(image.width * STAT_REDUCE // width, image.width, image.height)
+        if factor > 1:
+            image = image.reduce(factor)
+        frame = np.asarray(image)
+        if stack is None:
+            stack = np.empty((len(files),) + frame.shape, dtype=np.uint8)
+        if frame.shape != stack.shape[1:]:
+            frame = np.asarray(image.resize(stack.shape[2:0:-1]))
+        stack[i] = frame
+    return stack if stack is not None else np.zeros((0, 0, 0, 3), dtype=np.uint8)
+
+
+def frame_statistics(stack: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Mean intensity per frame and mean absolute difference to the previous frame.
+    """
+    frames = stack.astype(np.float32)
+    intensity = frames.mean(axis=(1, 2, 3))
+    diff_energy = np.abs(np.diff(frames, axis=0)).mean(axis=(1, 2, 3)) if len(frames) > 1 else np.zeros(0)
+    return {'intensity': intensity, 'diff_energy': diff_energy}
+
+
+def _number(value) -> Optional[float]:
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if np.isnan(number) else number
+
+
+def validate_trial(row: dict, batch_dir: str) -> dict:
+    """
+    Check the frames and videos of one trial of the log and return its report row.
+    """
+    result = {column: row.get(column) for column in ['id', 'batch', 'trial_type', 'frames_path']}
+    issues = []
+
+    for video in parse_log_value(row.get('videos_path')) or []:
+        if resolve_path(video, batch_dir) is None:
+            issues.append('missing_video')
+            break
+
+    frames_dir = resolve_path(row.get('frames_path'), batch_dir)
+    if frames_dir is None:
+        if isinstance(row.get('frames_path'), str):
+            issues.append('missing_frames_dir')
+        result['issues'] = ';'.join(issues)
+        return result
+
+    frames = list_frames(frames_dir)
+    counts = {pass_mask: len(files) for pass_mask, files in frames.items()}
+    result['passes'] = json.dumps(counts)
+    result['frames'] = max(counts.values()) if counts else 0
+
+    pass_masks = parse_log_value(row.get('pass_masks'))
+    if isinstance(pass_masks, str):
+        pass_masks = pass_masks.split(',')
+    for pass_mask in pass_masks or []:
+        if pass_mask not in frames:
+            issues.append(f'missing_pass{pass_mask}')
+    if len(set(counts.values())) > 1:
+        issues.append('pass_count_mismatch')
+    for pass_mask, files in frames.items():
+        numbers = sorted(files)
+        if numbers and numbers[-1] - numbers[0] + 1 != len(numbers):
+            issues.append(f'frame_gap{pass_mask}')
+
+    tot_frames = _number(row.get('tot_frames'))
+    if result['frames'] < MIN_FRAMES:
+        issues.append('too_few_frames')
+    elif tot_frames is not None and result['frames'] > tot_frames + 2:
+        issues.append('too_many_frames')
+    transitions = parse_log_value(row.get('transition_frame'))
+    transitions = transitions if isinstance(transitions, list) else [transitions]
+    if any((_number(t) or 0) > result['frames'] for t in transitions):
+        issues.append('transition_after_end')
+
+    if '_img' in frames:
+        stats = frame_statistics(load_reduced([frames['_img'][n] for n in sorted(frames['_img'])]))
+        black = int((stats['intensity'] < BLACK_INTENSITY).sum())
+        result.update(mean_intensity=round(float(stats['intensity'].mean()), 2), black_frames=black)
+        if black:
+            issues.append('black_frames')
+        if len(stats['diff_energy']):
+            result.update(mean_diff_energy=round(float(stats['diff_energy'].mean()), 3),
+                          max_diff_energy=round(float(stats['diff_energy'].max()), 3))
+            if stats['diff_energy'].max() < FROZEN_ENERGY:
+                issues.append('frozen')
+
+    mask_pass = next((pass_mask for pass_mask in MASK_PASSES if pass_mask in frames), None)
+    if mask_pass:
+        masks = load_reduced([frames[mask_pass][n] for n in sorted(frames[mask_pass])])
+        coverage = (masks.max(axis=-1) > 0).mean(axis=(1, 2)) if len(masks) else np.zeros(0)
+        result['mask_coverage'] = round(float(coverage.mean()), 4) if len(coverage) else 0.
+        if not coverage.any():
+            issues.append('empty_masks')
+
+    result['issues'] = ';'.join(issues)
+    return result
+
+
+def _validate_row(args) -> dict:
+    row, batch_dir = args
+    try:
+        return validate_trial(row, batch_dir)
+    except Exception as e:
+        return {'id': row.get('id'), 'batch': row.get('batch'), 'trial_type': row.get('trial_type'),
+                'frames_path': row.get('frames_path'), 'issues': f'error:{type(e).__name__}'}
+
+
+def quarantine_trials(batch_dir: str, log: pd.DataFrame, bad: np.ndarray) -> None:
+    """
+    Move the frames and videos of the bad trials to quarantine/ with the same relative paths, and their log rows
+    to quarantine/log.csv.
+    """
+    quarantine_dir = f'{batch_dir}/quarantine'
+    for _, row in log[bad].iterrows():
+        for path in [row['frames_path']] + list(parse_log_value(row['videos_path']) or []):
+            source = resolve_path(path, batch_dir)
+            if source is None:
+                continue
+            relative = os.path.relpath(os.path.abspath(source), os.path.abspath(batch_dir))
+            if relative.startswith('..'):
+                relative = os.path.basename(os.path.normpath(source))
+            target = os.path.join(quarantine_dir, relative)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(source, target)
+
+    quarantine_log = f'{quarantine_dir}/log.csv'
+    os.makedirs(quarantine_dir, exist_ok=True)
+    log[bad].to_csv(quarantine_log, mode='a', header=not os.path.exists(quarantine_log), index=False)
+    log[~bad].to_csv(f'{batch_dir}/log.csv', index=False)
+
+
+def validate_batch(batch_dir: str, workers: Optional[int] = None, quarantine: bool = False) -> Counter:
+    """
+    Validate all trials of the log of a batch directory, write the report and return the count of every issue.
+    """
+    log = pd.read_csv(f'{batch_dir}/log.csv', index_col=False)
+    rows = [(row, batch_dir) for row in log.to_dict('records')]
+    report_dir = f'{batch_dir}/validation'
+    os.makedirs(report_dir, exist_ok=True)
+
+    issues = Counter()
+    bad = np.zeros(len(log), dtype=bool)
+    with open(f'{report_dir}/report.csv', 'w', newline='') as f, ProcessPoolExecutor(workers) as executor:
+        writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        for i, result in enumerate(executor.map(_validate_row, rows, chunksize=CHUNKSIZE)):
+            writer.writerow(result)
+            if result['issues']:
+                bad[i] = True
+                issues.update(issue.split(':')[0] for issue in result['issues'].split(';'))
+
+    summary = {'trials': len(log), 'bad_trials': int(bad.sum()), 'issues': dict(issues)}
+    with open(f'{report_dir}/summary.json', 'w') as f:
+        json.dump(summary, f, indent=2)
+    if quarantine and bad.any():
+        quarantine_trials(batch_dir, log, bad)
+    return issues
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate the trials of a batch directory.")
+    parser.add_argument("batch_dir", type=str, nargs='?', default='data/batch', help="Directory with the log.csv")
+    parser.add_argument("--workers", type=int, default=None, help="Processes, all cores by default")
+    parser.add_argument("--quarantine", action="store_true", help="Move the bad trials to quarantine/")
+    args = parser.parse_args()
+
+    issues = validate_batch(args.batch_dir, args.workers, args.quarantine)
+    if issues:
+        for issue, count in issues.most_common():
+            print(console_msg(f'{issue}: {count} trials', 'warning'))
+    print(console_msg(f'Report written to {args.batch_dir}/validation/report.csv', 'success'))